@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/1.8/ref/settings/
 """
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
+import datetime
 import os
 from os.path import expanduser
 
@@ -46,10 +47,13 @@ INSTALLED_APPS = (
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
+    'django_filters',
     'reservation'
 )
 
 MIDDLEWARE_CLASSES = (
+    # First, so that the request timings cover the other middlewares
+    'reservation.middleware.MetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -88,9 +92,28 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # A file rather than sqlite's default in-memory test database, which the threads of the concurrent booking
+        # tests can not share: without it they would be skipped.
+        'TEST': {
+            'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+        },
     }
 }
 
+# Read replica for the list and detail GETs, see reservation/routers.py. Set REPLICA_DATABASE_NAME to a second sqlite
+# file to try it locally, after `python manage.py migrate --database replica`. Leave it unset to run the tests, a test
+# case's transaction on the default database is not visible from another connection.
+if os.environ.get('REPLICA_DATABASE_NAME'):
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ['REPLICA_DATABASE_NAME'],
+    }
+
+# Alias of the database read only requests are sent to, None to keep them on the default database.
+REPLICA_DATABASE = 'replica' if 'replica' in DATABASES else None
+
+DATABASE_ROUTERS = ['reservation.routers.ReplicaRouter']
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/1.8/topics/i18n/
@@ -129,7 +152,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny'
     ],
 
-    # 'DEFAULT_FILTER_BACKENDS': ('rest_framework.filters.DjangoFilterBackend',),
+    'DEFAULT_FILTER_BACKENDS': ('django_filters.rest_framework.DjangoFilterBackend',),
     'DEFAULT_RENDERER_CLASSES': (
         'rest_framework.renderers.JSONRenderer',
         'rest_framework.renderers.BrowsableAPIRenderer',
@@ -140,6 +163,54 @@ REST_FRAMEWORK = {
 }
 
 
+# Number of seconds clients and proxies may cache a hotel vacancy calendar (/api/hotels/<pk>/calendar).
+CALENDAR_CACHE_MAX_AGE = 60
+
+# Largest number of reservations accepted in one request to /api/reservations/bulk.
+BULK_RESERVATION_MAX_ITEMS = 1000
+
+# Number of rows deleted per transaction when a hotel is deleted or reservations are cancelled in bulk
+# (/api/reservations/cancel), keeping the memory used and the time rows stay locked bounded.
+DELETE_BATCH_SIZE = 1000
+
+# Number of stays of the same length, closest to the one asked for, suggested when a booking is refused for lack of
+# room, and number of days the suggested arrivals may move earlier or later (see Hotel.suggest_stays).
+SUGGESTION_COUNT = 3
+SUGGESTION_HORIZON_DAYS = 30
+
+# In-process LRU cache of the hotels read by the bookings, see reservation/hotel_cache.py. Set VERSION_CACHE to the
+# alias of a cache backend shared by all the server processes (memcached, redis) so that they drop their cached hotels
+# when one of them changes a hotel.
+HOTEL_CACHE = {
+    'MAX_SIZE': 1024,
+    'TIMEOUT': 300,
+    'VERSION_CACHE': os.environ.get('HOTEL_CACHE_VERSION_CACHE') or None,
+}
+
+# Cache of the availability checks in front of the occupancy ledger, see reservation/availability_cache.py. Disabled
+# unless BACKEND is set, to reservation.availability_cache.LocMemAvailabilityCache for a single process server or to
+# reservation.availability_cache.DjangoAvailabilityCache to share it through the CACHE_ALIAS entry of CACHES.
+AVAILABILITY_CACHE = {
+    'BACKEND': os.environ.get('AVAILABILITY_CACHE_BACKEND') or None,
+    'MAX_ENTRIES': 10000,
+    'TIMEOUT': 300,
+    'CACHE_ALIAS': 'default',
+}
+
+# Shared availability engine, keeps the per night hotel occupancy in a memory mapped file read by every worker process.
+# Filled from the reservations by the first worker started on a new file (see hotel_management/wsgi.py), disabled by
+# default.
+AVAILABILITY_ENGINE = {
+    'ENABLED': os.environ.get('AVAILABILITY_ENGINE', '') == 'on',
+    'PATH': os.environ.get('AVAILABILITY_ENGINE_PATH', os.path.join(BASE_DIR, 'availability.bin')),
+    # First night held and number of nights held for each hotel, other nights are read from the database.
+    'START_DATE': datetime.date(2015, 1, 1),
+    'DAYS': 365*15,
+    # Hotels with an id greater or equal to this one are read from the database.
+    'MAX_HOTELS': 1024,
+}
+
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': True,
@@ -185,4 +256,18 @@ LOGGING = {
             'level': 'INFO',
         }
     }
-}
\ No newline at end of file
+}
+
+# Write the restAPI log from a background thread, so that requests never wait on the log file (see
+# reservation/log_handlers.py). Records are dropped, and counted, when more than LOG_QUEUE_SIZE are waiting. Set
+# ASYNC_LOGGING=off to write them on the request thread again.
+if os.environ.get('ASYNC_LOGGING', 'on') == 'on':
+    restApi_handler = LOGGING['handlers']['restApi']
+    LOGGING['handlers']['restApi'] = {
+        'class': 'reservation.log_handlers.AsyncHandler',
+        'target_class': restApi_handler.pop('class'),
+        'target_kwargs': dict((key, value) for key, value in restApi_handler.items() if key != 'formatter'),
+        'formatter': restApi_handler['formatter'],
+        'queue_size': int(os.environ.get('LOG_QUEUE_SIZE', 10000)),
+        'policy': os.environ.get('LOG_QUEUE_POLICY', 'drop'),
+    }
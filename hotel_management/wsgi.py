@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "hotel_management.settings")
 
 application = get_wsgi_application()
+
+# Fill the shared availability engine from the reservations before serving if its file is new, a no-op unless it is
+# enabled in settings.
+from reservation.engine import startup
+startup()
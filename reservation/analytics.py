@@ -0,0 +1,173 @@
+"""
+Daily occupancy analytics of the hotels: occupancy rate, overbooking usage and pickup over a window of nights.
+
+The confirmed reservations staying in the window are read once, as (hotel, arrival, departure, created) intervals,
+from the archive as well for windows starting before the last archived departure.
+Each interval adds 1 at the index of its first night in the window and removes 1 at the index of its departure day,
+in a difference array per hotel over the night ordinals, and one running sum over the array gives the rooms held on
+every night. The cost is one pass over the reservations plus one pass per series over the nights, instead of one
+availability query per hotel and night.
+
+Pickup is the number of rooms held on a night which were already booked a number of days before it. A reservation
+booked on day b holding nights a to d-1 is on the books lead days ahead for the nights max(a, b+lead) to d-1, one
+more interval in the difference array of that lead time.
+"""
+import datetime
+import itertools
+from collections import defaultdict, OrderedDict
+from django.conf import settings
+from django.db import connections
+from django.utils import six, timezone
+from reservation import metrics
+from reservation.models import ArchivedReservation, Reservation
+from reservation.utilities import normalize_date
+
+# Days before a night at which the rooms already booked for it are counted in its pickup
+PICKUP_LEAD_TIMES = (7, 14, 30, 60, 90)
+
+
+def running_sum(values):
+    """
+    :return: list of the cumulative sums of the values
+    """
+    total = 0
+    sums = []
+    for value in values:
+        total += value
+        sums.append(total)
+    return sums
+
+
+class DayOrdinals(dict):
+    """
+    Day ordinals of the values of datetime columns as the database driver gives them: text starting with the UTC day
+    on sqlite ('YYYY-MM-DD') and datetime objects on the other backends. Django's conversion of every value to an aware
+    datetime is most of the cost of reading the intervals, and there are only a few hundred distinct days in a window,
+    each one is converted once.
+    """
+
+    def __missing__(self, day):
+        if isinstance(day, six.string_types):
+            ordinal = datetime.date(int(day[:4]), int(day[5:7]), int(day[8:10])).toordinal()
+        else:
+            ordinal = day.toordinal()
+        self[day] = ordinal
+        return ordinal
+
+    def get_ordinal(self, value):
+        return self[value[:10] if isinstance(value, six.string_types) else value.date()]
+
+
+def read_intervals(queryset):
+    """
+    :param queryset: QuerySet of reservations or archived reservations
+    :return: iterator of (hotel id, arrival, departure, created) with the dates as the database driver gives them, see
+        DayOrdinals
+    """
+    # The dates are selected as extra columns, which Django returns as the driver gives them. The sqlite driver still
+    # converts the columns declared as datetime, not the day part of their text.
+    connection = connections[queryset.db]
+    template = 'substr({0}.{1}, 1, 10)' if connection.vendor == 'sqlite' else '{0}.{1}'
+    columns = ('arrival_date', 'departure_date', 'created_time')
+    queryset = queryset.extra(select=OrderedDict(
+        ('raw_{0}'.format(column), template.format(connection.ops.quote_name(queryset.model._meta.db_table),
+                                                   connection.ops.quote_name(column)))
+        for column in columns))
+    return queryset.values_list('hotel_id', *['raw_{0}'.format(column) for column in columns]).iterator()
+
+
+def rate(numerator, denominator):
+    return round(float(numerator)/denominator, 4) if denominator else 0.0
+
+
+def get_occupancy(hotels, first_night, last_night, lead_times=PICKUP_LEAD_TIMES):
+    """
+    Compute the daily occupancy series of the hotels between two nights.
+    :param hotels: QuerySet of the hotels
+    :param first_night: datetime.date of the first night, included
+    :param last_night: datetime.date of the last night, included
+    :param lead_times: days before a night the pickup is counted at
+    :return: dict of hotel id to a dict of series, each a list with one value per night:
+        occupied: rooms held
+        occupancy_rate: rooms held over room_capacity, above 1 when overbooked
+        overbooked: rooms held beyond room_capacity
+        overbooking_usage: overbooked rooms over the overbooking capacity
+        pickup: dict of lead time (as a string) to the rooms held which were booked at least that many days before
+    """
+    with metrics.timed('availability'):
+        days = (last_night-first_night).days+1
+        origin = first_night.toordinal()
+
+        # Stays holding a room on a night of the window, as the availability checks count them
+        start_date = normalize_date(datetime.datetime.combine(first_night, datetime.time()))
+        end_date = normalize_date(datetime.datetime.combine(last_night+datetime.timedelta(1), datetime.time()),
+                                  type='departure')
+        if settings.USE_TZ:
+            start_date, end_date = timezone.make_aware(start_date), timezone.make_aware(end_date)
+        models = [Reservation]
+        if ArchivedReservation.departed_after(start_date):
+            # Past nights were also held by the reservations archived since
+            models.append(ArchivedReservation)
+        intervals = itertools.chain.from_iterable(
+            read_intervals(model.objects.active().filter(hotel__in=hotels.values('id')).overlapping(start_date,
+                                                                                                    end_date))
+            for model in models)
+        ordinals = DayOrdinals()
+
+        occupied = defaultdict(lambda: [0]*(days+1))
+        pickup = defaultdict(lambda: dict((lead, [0]*(days+1)) for lead in lead_times))
+        for hotel_id, arrival_date, departure_date, created_time in intervals:
+            start = max(ordinals.get_ordinal(arrival_date)-origin, 0)
+            end = min(ordinals.get_ordinal(departure_date)-origin, days)
+            if start >= end:
+                continue
+            changes = occupied[hotel_id]
+            changes[start] += 1
+            changes[end] -= 1
+
+            booked = ordinals.get_ordinal(created_time)-origin
+            lead_changes = pickup[hotel_id]
+            for lead in lead_times:
+                on_books = max(start, booked+lead)
+                if on_books < end:
+                    lead_changes[lead][on_books] += 1
+                    lead_changes[lead][end] -= 1
+
+        series = {}
+        for hotel in hotels:
+            rooms = running_sum(occupied[hotel.id])[:days]
+            overbooking_capacity = hotel.get_over_booking_capacity()
+            overbooked = [max(held-hotel.room_capacity, 0) for held in rooms]
+            series[hotel.id] = {
+                'occupied': rooms,
+                'occupancy_rate': [rate(held, hotel.room_capacity) for held in rooms],
+                'overbooked': overbooked,
+                'overbooking_usage': [rate(held, overbooking_capacity) for held in overbooked],
+                'pickup': OrderedDict((str(lead), running_sum(pickup[hotel.id][lead])[:days]) for lead in lead_times),
+            }
+        return series
+
+
+def get_report(hotel, series):
+    """
+    :return: the capacity of a hotel, the totals of its series over the window and the series, see get_occupancy()
+    """
+    nights = len(series['occupied'])
+    room_nights = sum(series['occupied'])
+    return OrderedDict([
+        ('hotel', hotel.id),
+        ('room_capacity', hotel.room_capacity),
+        ('over_booking_rooms', hotel.get_over_booking_capacity()),
+        ('total_capacity', hotel.get_total_capacity()),
+        ('summary', OrderedDict([
+            ('room_nights', room_nights),
+            ('occupancy_rate', rate(room_nights, hotel.room_capacity*nights)),
+            ('peak_occupied', max(series['occupied']) if nights else 0),
+            ('overbooked_nights', sum(1 for rooms in series['overbooked'] if rooms)),
+        ])),
+        ('occupied', series['occupied']),
+        ('occupancy_rate', series['occupancy_rate']),
+        ('overbooked', series['overbooked']),
+        ('overbooking_usage', series['overbooking_usage']),
+        ('pickup', series['pickup']),
+    ])
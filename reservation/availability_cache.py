@@ -0,0 +1,266 @@
+"""
+Cache of the occupancy ledger reads made by the availability checks.
+
+Searches repeat the same few (hotel, arrival, departure) combinations far more often than bookings change them, so
+HotelOccupancy.max_occupied() keeps the rooms held on every night of the ranges it read, keyed on the hotel and the
+first and last night of the range. HotelOccupancy.apply_changes(), which every booking, update, cancellation and bulk
+operation goes through, evicts the ranges overlapping the nights it changed and HotelOccupancy.rebuild() evicts all
+the ranges of the rebuilt hotels. Hotel capacities are not cached, a capacity change needs no eviction.
+
+The backend is chosen with settings.AVAILABILITY_CACHE['BACKEND'], the dotted path of one of the classes below or of
+any class implementing the same methods:
+
+- LocMemAvailabilityCache keeps the ranges in the memory of the process, evictions only reach that process. Fit for a
+  single process server.
+- DjangoAvailabilityCache keeps them in a Django cache backend (settings.CACHES), shared by every process using it.
+  Every night has a version stamp in the cache, bumped when the night changes, and a range is only used while the
+  stamps of all of its nights are those it was read with.
+
+A range read by another request between a change and its commit holds the former counts, and would be cached as if
+they were current. The changed ranges are therefore evicted twice: at once, so that the rest of the transaction does
+not read them, and again once the transaction commits (see reservation.transactions). Entries also expire after
+TIMEOUT seconds.
+"""
+import datetime
+import random
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+DEFAULTS = {
+    'BACKEND': None,
+    'MAX_ENTRIES': 10000,
+    'TIMEOUT': 300,
+    'CACHE_ALIAS': 'default',
+}
+
+_availability_cache = None
+_availability_cache_lock = threading.Lock()
+
+
+class BaseAvailabilityCache(object):
+    """
+    Counters and interface shared by the availability cache backends.
+
+    Attributes:
+        timeout: Seconds a range is used for before it is read again from the ledger
+        hits, misses: Number of lookups answered from the cache and from the ledger
+    """
+
+    def __init__(self, timeout, **options):
+        self.timeout = timeout
+        self.hits = self.misses = 0
+        self._counters_lock = threading.Lock()
+
+    def count(self, hit):
+        with self._counters_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get_stats(self):
+        """
+        :return: dict with the hits, misses and hit ratio of the lookups made by this process
+        """
+        lookups = self.hits+self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_ratio': float(self.hits)/lookups if lookups else 0.0}
+
+    def get(self, hotel_id, first_night, last_night):
+        """
+        :return: (occupancy, token). occupancy is the dict of night to rooms held cached for the range, None on a
+            miss. The token is handed back to set() for the range read on a miss.
+        """
+        raise NotImplementedError
+
+    def set(self, hotel_id, first_night, last_night, occupancy, token):
+        """
+        Cache the occupancy of a range, unless one of its nights changed since get() returned the token.
+        """
+        raise NotImplementedError
+
+    def invalidate(self, changes):
+        """
+        Evict the ranges holding any of the changed nights.
+        :param changes: dict of hotel_id to an iterable of the datetime.date which changed
+        """
+        raise NotImplementedError
+
+    def invalidate_hotels(self, hotel_ids=None):
+        """
+        Evict every range of the hotels, of all of them by default.
+        """
+        raise NotImplementedError
+
+
+class LocMemAvailabilityCache(BaseAvailabilityCache):
+    """
+    Availability cache held in the memory of the process, bounded to MAX_ENTRIES ranges evicted in LRU order.
+    """
+
+    def __init__(self, timeout, max_entries=DEFAULTS['MAX_ENTRIES'], **options):
+        super(LocMemAvailabilityCache, self).__init__(timeout, **options)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._hotel_ranges = defaultdict(set)
+        # Bumped on every eviction of a hotel, a ledger read racing with one is not cached.
+        self._generations = defaultdict(int)
+
+    def _remove(self, key):
+        del self._entries[key]
+        self._hotel_ranges[key[0]].discard(key)
+
+    def get(self, hotel_id, first_night, last_night):
+        key = (hotel_id, first_night, last_night)
+        with self._lock:
+            token = self._generations[hotel_id]
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[0] <= time.time():
+                self._hotel_ranges[hotel_id].discard(key)
+                entry = None
+            if entry is not None:
+                self._entries[key] = entry
+        self.count(entry is not None)
+        return (entry[1] if entry is not None else None), token
+
+    def set(self, hotel_id, first_night, last_night, occupancy, token):
+        key = (hotel_id, first_night, last_night)
+        with self._lock:
+            if self._generations[hotel_id] != token:
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time()+self.timeout, occupancy)
+            self._hotel_ranges[hotel_id].add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, changes):
+        with self._lock:
+            for hotel_id, nights in changes.items():
+                nights = list(nights)
+                self._generations[hotel_id] += 1
+                for key in list(self._hotel_ranges.get(hotel_id, ())):
+                    if any(key[1] <= night <= key[2] for night in nights):
+                        self._remove(key)
+
+    def invalidate_hotels(self, hotel_ids=None):
+        with self._lock:
+            if hotel_ids is None:
+                hotel_ids = list(self._hotel_ranges)
+            for hotel_id in hotel_ids:
+                self._generations[hotel_id] += 1
+                for key in list(self._hotel_ranges.get(hotel_id, ())):
+                    self._remove(key)
+
+
+class DjangoAvailabilityCache(BaseAvailabilityCache):
+    """
+    Availability cache held in the Django cache backend CACHE_ALIAS, shared by the processes using it. A lookup reads
+    the range and the version stamps of its nights in one get_many().
+    """
+    prefix = 'availability'
+
+    def __init__(self, timeout, cache_alias=DEFAULTS['CACHE_ALIAS'], **options):
+        from django.core.cache import caches
+        super(DjangoAvailabilityCache, self).__init__(timeout, **options)
+        self.cache = caches[cache_alias]
+
+    def range_key(self, hotel_id, first_night, last_night):
+        return '{0}:{1}:{2}:{3}'.format(self.prefix, hotel_id, first_night.isoformat(), last_night.isoformat())
+
+    def version_keys(self, hotel_id, first_night, last_night):
+        """
+        :return: keys of the version stamps a range depends on: all hotels, the hotel, and each of the nights
+        """
+        keys = ['{0}:v'.format(self.prefix), '{0}:v:{1}'.format(self.prefix, hotel_id)]
+        for day in range((last_night-first_night).days+1):
+            keys.append(self.night_key(hotel_id, first_night+datetime.timedelta(day)))
+        return keys
+
+    def night_key(self, hotel_id, night):
+        return '{0}:v:{1}:{2}'.format(self.prefix, hotel_id, night.isoformat())
+
+    def bump(self, key):
+        """
+        Move a version stamp. Stamps start at a random value, so that one evicted from the cache backend and created
+        again does not come back to a value cached ranges were read with.
+        """
+        self.cache.add(key, random.getrandbits(48))
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.set(key, random.getrandbits(48))
+
+    def get(self, hotel_id, first_night, last_night):
+        range_key = self.range_key(hotel_id, first_night, last_night)
+        version_keys = self.version_keys(hotel_id, first_night, last_night)
+        found = self.cache.get_many([range_key]+version_keys)
+
+        for key in version_keys:
+            if key not in found:
+                self.cache.add(key, random.getrandbits(48))
+                found[key] = self.cache.get(key)
+        token = tuple(found[key] for key in version_keys)
+
+        entry = found.get(range_key)
+        hit = entry is not None and entry[0] == token
+        self.count(hit)
+        return (entry[1] if hit else None), token
+
+    def set(self, hotel_id, first_night, last_night, occupancy, token):
+        if None not in token:
+            self.cache.set(self.range_key(hotel_id, first_night, last_night), (token, occupancy), self.timeout)
+
+    def invalidate(self, changes):
+        for hotel_id, nights in changes.items():
+            for night in nights:
+                self.bump(self.night_key(hotel_id, night))
+
+    def invalidate_hotels(self, hotel_ids=None):
+        if hotel_ids is None:
+            self.bump('{0}:v'.format(self.prefix))
+        else:
+            for hotel_id in hotel_ids:
+                self.bump('{0}:v:{1}'.format(self.prefix, hotel_id))
+
+
+def get_config():
+    """
+    :return: settings.AVAILABILITY_CACHE merged over the defaults
+    """
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'AVAILABILITY_CACHE', {}))
+    return config
+
+
+def get_availability_cache():
+    """
+    :return: the availability cache of this process, None when no backend is set in the settings
+    """
+    global _availability_cache
+    config = get_config()
+    if not config['BACKEND']:
+        return None
+
+    if _availability_cache is None:
+        with _availability_cache_lock:
+            if _availability_cache is None:
+                _availability_cache = import_string(config['BACKEND'])(
+                    timeout=config['TIMEOUT'], max_entries=config['MAX_ENTRIES'], cache_alias=config['CACHE_ALIAS'])
+    return _availability_cache
+
+
+@receiver(setting_changed)
+def reset_availability_cache(**kwargs):
+    """
+    Drop the cache of this process when its settings change (in tests), the next get_availability_cache() makes a
+    new one.
+    """
+    global _availability_cache
+    if kwargs['setting'] in ('AVAILABILITY_CACHE', 'CACHES'):
+        _availability_cache = None
@@ -0,0 +1,96 @@
+"""
+Conditional requests (ETag, Last-Modified) for the API views.
+
+A view method decorated with conditional(stamp_func) answers a GET with 304 Not Modified when the If-None-Match or
+If-Modified-Since headers of the request match the current state of the resource, and refuses a PUT, PATCH or
+DELETE with 412 Precondition Failed when If-Match or If-Unmodified-Since do not. The decision only needs the stamp
+of the resource, which stamp functions read with a single cheap query, the body is never serialized for it.
+
+Django's condition() decorator is not used: after a PUT it would send back the ETag of the resource as it was
+before the change, and it reads the stamp without locking the row the change is about to write.
+"""
+import hashlib
+from calendar import timegm
+from functools import wraps
+from django.http import HttpResponseNotModified
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+def make_etag(request, *parts):
+    """
+    Strong ETag from the stamp parts of a resource and its url, the host included since the body holds absolute urls.
+    The query string is left out, list views whose body depends on it add it to the parts.
+    """
+    key = u'|'.join([request.build_absolute_uri(request.path)]+[u'{0}'.format(part) for part in parts])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def get_etags(request, header):
+    value = request.META.get(header)
+    return parse_etags(value) if value else []
+
+
+def precondition_failed():
+    return Response({'detail': 'The resource was modified since, or does not match the If-Match header.'},
+                    status=status.HTTP_412_PRECONDITION_FAILED)
+
+
+def conditional(stamp_func):
+    """
+    Decorator for the handler methods of a view, see the module docstring.
+    :param stamp_func: called with (view, request, for_update, *args, **kwargs), returns (etag, last_modified) of
+        the resource (last_modified may be None), None if it does not exist. for_update is True before a PUT, PATCH or DELETE, the stamp should
+        then be read with select_for_update() so that nothing changes the resource until the transaction ends.
+    """
+    def read_stamp(view, request, for_update, *args, **kwargs):
+        stamp = stamp_func(view, request, for_update, *args, **kwargs)
+        if not stamp:
+            return None, None
+        etag, last_modified = stamp
+        return etag, timegm(last_modified.utctimetuple()) if last_modified else None
+
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            safe = request.method in SAFE_METHODS
+            etag, last_modified = read_stamp(self, request, not safe, *args, **kwargs)
+
+            if_none_match = get_etags(request, 'HTTP_IF_NONE_MATCH')
+            if_match = get_etags(request, 'HTTP_IF_MATCH')
+            if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+            if_unmodified_since = parse_http_date_safe(request.META.get('HTTP_IF_UNMODIFIED_SINCE', ''))
+
+            response = None
+            if etag is not None and safe:
+                if if_none_match:
+                    # If-Modified-Since is ignored when If-None-Match is given
+                    not_modified = etag in if_none_match or '*' in if_none_match
+                else:
+                    not_modified = None not in (if_modified_since, last_modified) and last_modified <= if_modified_since
+                if not_modified:
+                    response = HttpResponseNotModified()
+            elif not safe:
+                if if_match and (etag is None or (etag not in if_match and '*' not in if_match)):
+                    response = precondition_failed()
+                elif None not in (if_unmodified_since, last_modified) and last_modified > if_unmodified_since:
+                    response = precondition_failed()
+
+            if response is None:
+                response = view_method(self, request, *args, **kwargs)
+                if not status.is_success(response.status_code):
+                    return response
+                if not safe:
+                    # The stamp of the resource as the change left it
+                    etag, last_modified = read_stamp(self, request, False, *args, **kwargs)
+
+            if etag is not None:
+                response['ETag'] = quote_etag(etag)
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+            return response
+        return wrapper
+    return decorator
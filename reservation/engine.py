@@ -0,0 +1,244 @@
+"""
+Shared availability engine.
+
+Holds the number of rooms occupied per hotel per night in a memory mapped file, so that every worker process of the
+server answers availability checks from the same counts without a database round trip. The file is laid out as a
+header followed by one block of unsigned 32 bit counters per hotel id, one counter per night starting at START_DATE.
+The header ends with a flag set once the counters are filled from the Reservation rows, until then every check is
+answered from the ledger.
+
+The engine is optional and only used when settings.AVAILABILITY_ENGINE['ENABLED'] is true. It mirrors the
+HotelOccupancy ledger, which stays the source of truth: HotelOccupancy.apply_stays() and HotelOccupancy.rebuild()
+update both, and hotels or nights outside of the mapped range are answered from the ledger. Changes are applied to the
+engine once their transaction commits, a rolled back booking never reaches it. Requires a POSIX system (fcntl.flock
+is used to serialize writers across processes).
+
+The first worker to start on a new file fills it, counting the reservations while it holds the file lock so that
+the bookings other workers apply wait for it. Workers starting on a filled file keep its counters, which are live.
+Changes made behind the ledger's back (bulk SQL, a server run with the engine disabled) need the rebuild_occupancy
+command, or the file to be deleted before the workers start.
+"""
+import datetime
+import mmap
+import os
+import struct
+import threading
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+# Magic, first night ordinal, days, max hotels and filled flag
+HEADER = struct.Struct('<8sIIII')
+MAGIC = b'HMAVAIL2'
+FILLED = struct.Struct('<I')
+FILLED_OFFSET = HEADER.size-FILLED.size
+COUNTER_SIZE = struct.calcsize('<I')
+
+DEFAULTS = {
+    'ENABLED': False,
+    'PATH': os.path.join(settings.BASE_DIR, 'availability.bin'),
+    'START_DATE': datetime.date(2015, 1, 1),
+    'DAYS': 365*15,
+    'MAX_HOTELS': 1024,
+}
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+class AvailabilityEngine(object):
+    """
+    Memory mapped per hotel, per night occupancy counters.
+
+    Attributes:
+        path: File backing the counters, shared by every process opening the same path
+        start_date: The first night held by the engine
+        days: Number of nights held for each hotel
+        max_hotels: Hotels with an id greater or equal to this are not held by the engine
+    """
+
+    def __init__(self, path, start_date, days, max_hotels):
+        self.path = path
+        self.start_date = start_date
+        self.days = days
+        self.max_hotels = max_hotels
+        self.size = HEADER.size+days*max_hotels*COUNTER_SIZE
+
+        # flock() does not exclude threads sharing the descriptor, so threads of this process take this lock first.
+        self._lock = threading.Lock()
+
+        self._file = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT), 'r+b')
+        with self._locked(exclusive=True):
+            self._file.seek(0)
+            header = self._file.read(HEADER.size)
+            layout = (MAGIC, start_date.toordinal(), days, max_hotels)
+            if len(header) != HEADER.size or HEADER.unpack(header)[:-1] != layout or \
+                    os.fstat(self._file.fileno()).st_size != self.size:
+                # New file or different settings, start over with empty counters, not filled until startup() runs.
+                self._file.truncate(0)
+                self._file.truncate(self.size)
+                self._file.seek(0)
+                self._file.write(HEADER.pack(*(layout+(0,))))
+                self._file.flush()
+            self._map = mmap.mmap(self._file.fileno(), self.size)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def _locked(self, exclusive=False):
+        return _FileLock(self, exclusive)
+
+    def _offset(self, hotel_id, night):
+        """
+        :return: position of the counter of a hotel on a night in the mapped file
+        """
+        return HEADER.size+(hotel_id*self.days+(night-self.start_date).days)*COUNTER_SIZE
+
+    @property
+    def filled(self):
+        """
+        :return: True once the counters were filled from the Reservation rows
+        """
+        return bool(FILLED.unpack_from(self._map, FILLED_OFFSET)[0])
+
+    def covers(self, hotel_id, nights):
+        """
+        :param nights: sorted list of datetime.date
+        :return: True if the engine is filled and holds the counters of the hotel for all the nights
+        """
+        return 0 <= hotel_id < self.max_hotels and self.start_date <= nights[0] and \
+            (nights[-1]-self.start_date).days < self.days and self.filled
+
+    def max_occupied(self, hotel_id, nights, exclude_nights=()):
+        """
+        Get the number of rooms held on the busiest of the nights.
+        :param nights: sorted list of consecutive datetime.date, all covered by the engine
+        :param exclude_nights: nights on which one room is not counted, the stay of a reservation being updated
+        """
+        counter = struct.Struct('<{0}I'.format(len(nights)))
+        with self._locked():
+            occupied = list(counter.unpack_from(self._map, self._offset(hotel_id, nights[0])))
+
+        for night in exclude_nights:
+            index = (night-nights[0]).days
+            if 0 <= index < len(occupied):
+                occupied[index] -= 1
+        return max(occupied)
+
+    def apply(self, changes):
+        """
+        Add the changes to the counters, nights the engine does not hold are skipped.
+        :param changes: dict of hotel_id to a dict of datetime.date to the change in rooms held that night
+        """
+        with self._locked(exclusive=True):
+            for hotel_id, nights in changes.items():
+                for night, change in nights.items():
+                    if self.covers(hotel_id, [night]):
+                        offset = self._offset(hotel_id, night)
+                        occupied = struct.unpack_from('<I', self._map, offset)[0]
+                        struct.pack_into('<I', self._map, offset, max(occupied+change, 0))
+
+    def fill(self, count_nights):
+        """
+        Fill the counters of a new file, a filled one is left as it is.
+        :param count_nights: called while the file is locked, returns a dict of (hotel_id, datetime.date) to the
+            number of rooms held that night, see HotelOccupancy.count_nights()
+        :return: True if the counters were filled by this call
+        """
+        with self._locked(exclusive=True):
+            if self.filled:
+                return False
+            self._rebuild(count_nights(), None)
+            return True
+
+    def rebuild(self, count_nights, hotel_ids=None):
+        """
+        Replace the counters with the counted ones.
+        :param count_nights: called while the file is locked, returns a dict of (hotel_id, datetime.date) to the
+            number of rooms held that night, for the hotel_ids
+        :param hotel_ids: only reset the counters of these hotels, all of them otherwise
+        """
+        with self._locked(exclusive=True):
+            self._rebuild(count_nights(), hotel_ids)
+
+    def _rebuild(self, counts, hotel_ids):
+        block = self.days*COUNTER_SIZE
+        for hotel_id in range(self.max_hotels) if hotel_ids is None else hotel_ids:
+            if 0 <= hotel_id < self.max_hotels:
+                offset = self._offset(hotel_id, self.start_date)
+                self._map[offset:offset+block] = b'\0'*block
+
+        for (hotel_id, night), occupied in counts.items():
+            if 0 <= hotel_id < self.max_hotels and 0 <= (night-self.start_date).days < self.days:
+                struct.pack_into('<I', self._map, self._offset(hotel_id, night), occupied)
+        if hotel_ids is None:
+            FILLED.pack_into(self._map, FILLED_OFFSET, 1)
+        self._map.flush()
+
+
+class _FileLock(object):
+    """
+    Context manager holding the thread lock and the file lock of an engine.
+    """
+
+    def __init__(self, engine, exclusive):
+        self.engine = engine
+        self.exclusive = exclusive
+
+    def __enter__(self):
+        import fcntl
+        self.engine._lock.acquire()
+        fcntl.flock(self.engine._file.fileno(), fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH)
+
+    def __exit__(self, *exc_info):
+        import fcntl
+        fcntl.flock(self.engine._file.fileno(), fcntl.LOCK_UN)
+        self.engine._lock.release()
+
+
+def get_config():
+    """
+    :return: settings.AVAILABILITY_ENGINE merged over the defaults
+    """
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'AVAILABILITY_ENGINE', {}))
+    return config
+
+
+def get_engine():
+    """
+    :return: the AvailabilityEngine of this process, None when it is disabled in the settings
+    """
+    global _engine
+    config = get_config()
+    if not config['ENABLED']:
+        return None
+
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = AvailabilityEngine(config['PATH'], config['START_DATE'], config['DAYS'],
+                                             config['MAX_HOTELS'])
+    return _engine
+
+
+def startup():
+    """
+    Fill the engine from the Reservation rows if its file is new, called once by each server process when it starts.
+    """
+    engine = get_engine()
+    if engine is not None:
+        from reservation.models import HotelOccupancy
+        engine.fill(HotelOccupancy.count_nights)
+
+
+@receiver(setting_changed)
+def reset_engine(**kwargs):
+    """
+    Drop the engine of this process when its settings change (in tests), the next get_engine() opens a new one.
+    """
+    global _engine
+    if kwargs['setting'] == 'AVAILABILITY_ENGINE' and _engine is not None:
+        _engine.close()
+        _engine = None
@@ -0,0 +1,104 @@
+"""
+Streaming export of the reservations as NDJSON (one JSON object per line) or CSV.
+
+The rows are read in chunks ordered by id, each chunk starting after the last id of the previous one, and every chunk
+is serialized and written out before the next one is read: memory use is bounded by the chunk size however many
+reservations are exported, and no chunk pays an OFFSET. A plain queryset iterator would not do, the database drivers
+of Django 1.8 fetch the whole result set on the client.
+"""
+import csv
+import json
+from collections import OrderedDict
+from django.utils import six
+from django.utils.encoding import force_str
+from rest_framework.serializers import Serializer
+from rest_framework.utils.encoders import JSONEncoder
+from reservation.routers import use_replica
+
+CHUNK_SIZE = 1000
+
+
+def iter_chunks(queryset, chunk_size=CHUNK_SIZE):
+    """
+    :return: generator of lists of at most chunk_size objects of the queryset, in id order. Reads go to the replica
+    when one is configured, the generator runs after the view returned and outside of its database routing.
+    """
+    last_id = None
+    while True:
+        chunk = queryset.order_by('id')
+        if last_id is not None:
+            chunk = chunk.filter(id__gt=last_id)
+        with use_replica():
+            chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1].id
+
+
+def iter_rows(queryset, serializer_class, context, chunk_size=CHUNK_SIZE):
+    """
+    :return: generator of the serialized representation of every object of the queryset
+    """
+    for chunk in iter_chunks(queryset, chunk_size):
+        for row in serializer_class(chunk, many=True, context=context).data:
+            yield row
+
+
+def flatten(row, prefix=''):
+    """
+    Flatten the nested objects of a serialized row, {'hotel_data': {'id': 1}} becomes {'hotel_data.id': 1}.
+    """
+    flat = OrderedDict()
+    for key, value in row.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix+key+'.'))
+        else:
+            flat[prefix+key] = value
+    return flat
+
+
+def get_columns(serializer, prefix=''):
+    """
+    :return: names of the fields of the serializer, the fields of nested serializers named as flatten() does
+    """
+    columns = []
+    for name, field in serializer.fields.items():
+        if isinstance(field, Serializer):
+            columns.extend(get_columns(field, prefix+name+'.'))
+        else:
+            columns.append(prefix+name)
+    return columns
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row, cls=JSONEncoder)+'\n'
+
+
+class _Echo(object):
+    """
+    File like object handing back what the csv writer writes to it, so that each row is yielded as it is written.
+    """
+
+    def write(self, value):
+        return value
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    # The csv module of python 2 only writes bytes
+    return force_str(value) if six.PY2 else value
+
+
+def csv_lines(rows, columns):
+    """
+    :param columns: names of the flattened fields written out, see get_columns()
+    :return: generator of the CSV lines of the rows, a header line first
+    """
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        row = flatten(row)
+        yield writer.writerow([_csv_value(row.get(column)) for column in columns])
@@ -0,0 +1,59 @@
+import django_filters
+from django_filters import rest_framework as filters
+from rest_framework.exceptions import ValidationError
+from reservation.models import ArchivedReservation, Reservation
+from reservation.utilities import normalize_date
+
+
+class ReservationFilter(filters.FilterSet):
+    """
+    Filters of the reservation list, every one backed by an index of the reservation table:
+        hotel: reservations of a hotel, (hotel, arrival_date, departure_date) index
+        arrival_after, arrival_before: arrival date range, (arrival_date, id) index
+        departure_after, departure_before: departure date range, departure_date index
+        from, to: reservations holding a room between these dates, same as the export
+        guest_email: reservations of a guest whatever the case of the address, guest_email_key index
+
+    Date ranges include their start and exclude their end. Invalid values answer 400 instead of an empty list.
+    """
+    hotel = django_filters.NumberFilter(name='hotel_id')
+    arrival_after = django_filters.IsoDateTimeFilter(name='arrival_date', lookup_expr='gte')
+    arrival_before = django_filters.IsoDateTimeFilter(name='arrival_date', lookup_expr='lt')
+    departure_after = django_filters.IsoDateTimeFilter(name='departure_date', lookup_expr='gte')
+    departure_before = django_filters.IsoDateTimeFilter(name='departure_date', lookup_expr='lt')
+    to = django_filters.IsoDateTimeFilter(method='filter_to')
+    guest_email = django_filters.CharFilter(method='filter_guest_email')
+
+    class Meta:
+        model = Reservation
+        fields = ()
+
+    @property
+    def qs(self):
+        if self.is_bound and not self.form.is_valid():
+            raise ValidationError(self.form.errors)
+        return super(ReservationFilter, self).qs
+
+    def filter_from(self, queryset, name, value):
+        return queryset.filter(departure_date__gt=normalize_date(value))
+
+    def filter_to(self, queryset, name, value):
+        return queryset.filter(arrival_date__lt=normalize_date(value, type='departure'))
+
+    def filter_guest_email(self, queryset, name, value):
+        return queryset.of_guest(value)
+
+
+# "from" is a python keyword and can not be declared as a class attribute, declared here so that subclasses get it too
+ReservationFilter.declared_filters['from'] = ReservationFilter.base_filters['from'] = django_filters.IsoDateTimeFilter(
+    name='from', method='filter_from')
+
+
+class ArchivedReservationFilter(ReservationFilter):
+    """
+    Filters of the archived reservation list, the same as the reservation list ones
+    """
+
+    class Meta:
+        model = ArchivedReservation
+        fields = ()
@@ -0,0 +1,186 @@
+"""
+In-process cache of the hotels.
+
+Bookings read the capacity of their hotel on every request while hotels rarely change, so each server process keeps
+the id, name and capacities of the hotels it used last in a bounded LRU cache. Saving or deleting a hotel evicts it
+through the post_save and post_delete signals.
+
+Signals only reach the process making the change. With settings.HOTEL_CACHE['VERSION_CACHE'] set to the alias of a
+shared cache backend (memcached, redis...) every change also bumps a version stamp held there, and each process drops
+its whole cache when it sees the stamp move, at the cost of one cache backend read per lookup. Entries also expire
+after TIMEOUT seconds, which bounds how long a process can serve a hotel it cached while a change to it was not
+committed yet. Hotels are always read from the primary database, even by the views routed to a replica: a lagging
+replica would otherwise fill the cache every booking reads with stale capacities.
+"""
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+FIELDS = ('id', 'name', 'room_capacity', 'over_booking_capacity')
+VERSION_KEY = 'reservation.hotel_cache.version'
+
+DEFAULTS = {
+    'MAX_SIZE': 1024,
+    'TIMEOUT': 300,
+    'VERSION_CACHE': None,
+}
+
+_hotel_cache = None
+_hotel_cache_lock = threading.Lock()
+
+
+class HotelCache(object):
+    """
+    Bounded LRU cache of the Hotel rows, see the module docstring.
+
+    Attributes:
+        max_size: Number of hotels kept, the least recently used one is evicted past it
+        timeout: Seconds an entry is used for before it is read again from the database
+        version_cache: Django cache backend holding the cross process version stamp, None to only rely on signals
+        hits, misses: Number of lookups answered from the cache and from the database
+    """
+
+    def __init__(self, max_size, timeout, version_cache=None):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.version_cache = version_cache
+        self.hits = self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # Bumped on every eviction, a database read racing with an eviction does not store what it read.
+        self._generation = 0
+        self._version = self.get_shared_version()
+
+    def get_shared_version(self):
+        if self.version_cache is None:
+            return None
+        return self.version_cache.get(VERSION_KEY, 0)
+
+    def check_version(self):
+        """
+        Drop every entry when another process changed a hotel since the last check.
+        """
+        version = self.get_shared_version()
+        if version != self._version:
+            with self._lock:
+                self._entries.clear()
+                self._generation += 1
+                self._version = version
+
+    def get(self, hotel_id):
+        """
+        :return: the Hotel with this id, Exception Hotel.DoesNotExist if there is none
+        """
+        from reservation.models import Hotel
+        hotel = self.get_many([hotel_id]).get(hotel_id)
+        if hotel is None:
+            raise Hotel.DoesNotExist('Hotel matching query does not exist.')
+        return hotel
+
+    def get_many(self, hotel_ids):
+        """
+        :return: dict of hotel id to Hotel for the ids which exist, the missing ones read in a single query
+        """
+        from reservation.models import Hotel
+        self.check_version()
+
+        rows, missing = {}, []
+        now = time.time()
+        with self._lock:
+            generation = self._generation
+            for hotel_id in set(hotel_ids):
+                entry = self._entries.pop(hotel_id, None)
+                if entry is not None and entry[0] > now:
+                    self._entries[hotel_id] = entry
+                    rows[hotel_id] = entry[1]
+                else:
+                    missing.append(hotel_id)
+            self.hits += len(rows)
+            self.misses += len(missing)
+
+        if missing:
+            fetched = dict((row[0], row) for row in Hotel.objects.using(DEFAULT_DB_ALIAS).filter(id__in=missing)
+                           .values_list(*FIELDS))
+            rows.update(fetched)
+            with self._lock:
+                if generation == self._generation:
+                    for hotel_id, row in fetched.items():
+                        self._entries[hotel_id] = (now+self.timeout, row)
+                    while len(self._entries) > self.max_size:
+                        self._entries.popitem(last=False)
+
+        # A new object for every lookup, callers are free to modify it. It only holds the cached fields and is not
+        # meant to be saved.
+        return dict((hotel_id, self.make_hotel(row)) for hotel_id, row in rows.items())
+
+    def make_hotel(self, row):
+        from reservation.models import Hotel
+        hotel = Hotel(**dict(zip(FIELDS, row)))
+        hotel._state.adding = False
+        hotel._state.db = DEFAULT_DB_ALIAS
+        return hotel
+
+    def invalidate(self, hotel_id):
+        with self._lock:
+            self._entries.pop(hotel_id, None)
+            self._generation += 1
+
+        if self.version_cache is not None:
+            self.version_cache.add(VERSION_KEY, 0)
+            try:
+                self._version = self.version_cache.incr(VERSION_KEY)
+            except ValueError:
+                # Evicted from the cache backend in between, a new stamp still tells the other processes
+                self.version_cache.set(VERSION_KEY, 1)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+            self.hits = self.misses = 0
+
+
+def get_config():
+    """
+    :return: settings.HOTEL_CACHE merged over the defaults
+    """
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'HOTEL_CACHE', {}))
+    return config
+
+
+def get_hotel_cache():
+    """
+    :return: the HotelCache of this process
+    """
+    global _hotel_cache
+    if _hotel_cache is None:
+        with _hotel_cache_lock:
+            if _hotel_cache is None:
+                from django.core.cache import caches
+                config = get_config()
+                version_cache = caches[config['VERSION_CACHE']] if config['VERSION_CACHE'] else None
+                _hotel_cache = HotelCache(config['MAX_SIZE'], config['TIMEOUT'], version_cache)
+    return _hotel_cache
+
+
+@receiver(post_save, sender='reservation.Hotel')
+@receiver(post_delete, sender='reservation.Hotel')
+def invalidate_hotel(sender, instance, **kwargs):
+    get_hotel_cache().invalidate(instance.pk)
+
+
+@receiver(setting_changed)
+def reset_hotel_cache(**kwargs):
+    """
+    Drop the cache of this process when its settings change (in tests), the next get_hotel_cache() makes a new one.
+    """
+    global _hotel_cache
+    if kwargs['setting'] in ('HOTEL_CACHE', 'CACHES'):
+        _hotel_cache = None
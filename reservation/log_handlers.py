@@ -0,0 +1,163 @@
+"""
+Logging handler writing the records from a background thread.
+
+AsyncHandler puts the records in a bounded in-memory queue and returns, a writer thread takes them out and hands them
+to the handler doing the actual I/O (a RotatingFileHandler for the restAPI logger), so that a slow disk or a file
+rotation never holds up a request. When the queue is full, a record is dropped ('drop' policy, the default) or the
+logging thread waits up to block_timeout seconds for room before dropping it ('block' policy, backpressure). Dropped
+records are counted, and the writer logs how many were dropped once it catches up.
+
+Python 2 has no logging.handlers.QueueHandler, hence this module.
+"""
+import atexit
+import logging
+import os
+import threading
+from django.utils.module_loading import import_string
+from django.utils.six.moves import queue
+
+DROP = 'drop'
+BLOCK = 'block'
+
+_STOP = object()
+
+
+class _Flush(object):
+    """
+    Marker queued by AsyncHandler.flush(), the writer sets done once it reaches it.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class AsyncHandler(logging.Handler):
+    """
+    Handler queueing the records for a writer thread, configured from settings.LOGGING as:
+
+        'class': 'reservation.log_handlers.AsyncHandler',
+        'target_class': 'logging.handlers.RotatingFileHandler',
+        'target_kwargs': {'filename': ..., 'maxBytes': ...},
+        'formatter': 'standard',
+
+    Attributes:
+        target: The handler writing the records, it gets the formatter and level of this handler
+        policy: DROP or BLOCK, what to do with a record when the queue is full
+        dropped: Number of records dropped since the handler was created
+    """
+
+    def __init__(self, target_class, target_kwargs=None, queue_size=10000, policy=DROP, block_timeout=0.1):
+        super(AsyncHandler, self).__init__()
+        if policy not in (DROP, BLOCK):
+            raise ValueError('Unknown policy {0}, expected {1} or {2}'.format(policy, DROP, BLOCK))
+        self.target = import_string(target_class)(**dict(target_kwargs or {}))
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.queue_size = queue_size
+        self.dropped = 0
+        self._reported = 0
+        # Records are dropped from any logging thread and reported from the writer one
+        self._dropped_lock = threading.Lock()
+
+        self._start_lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        atexit.register(self.close)
+
+    def setFormatter(self, fmt):
+        super(AsyncHandler, self).setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def setLevel(self, level):
+        super(AsyncHandler, self).setLevel(level)
+        self.target.setLevel(level)
+
+    def start(self):
+        """
+        Start the writer thread, again in a process forked from the one which started it (threads do not survive a
+        fork).
+        """
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(self.queue_size)
+                self._thread = threading.Thread(target=self.write, name='AsyncHandler writer')
+                self._thread.daemon = True
+                self._pid = os.getpid()
+                self._thread.start()
+
+    def prepare(self, record):
+        """
+        Render the message and the exception of a record on the logging thread, its arguments may change or hold
+        resources gone by the time the writer gets to it.
+        """
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            self.start()
+        try:
+            record = self.prepare(record)
+            if self.policy == BLOCK:
+                self._queue.put(record, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def write(self):
+        """
+        Body of the writer thread.
+        """
+        while True:
+            record = self._queue.get()
+            if record is _STOP:
+                return
+            if isinstance(record, _Flush):
+                self.report_dropped()
+                self.target.flush()
+                record.done.set()
+                continue
+            self.target.handle(record)
+            if self._queue.empty():
+                self.report_dropped()
+
+    def report_dropped(self):
+        """
+        Log how many records were dropped since the last report, if any.
+        """
+        with self._dropped_lock:
+            dropped, self._reported = self.dropped-self._reported, self.dropped
+        if not dropped:
+            return
+        self.target.handle(logging.makeLogRecord({
+            'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+            'msg': 'Dropped {0} log records, the logging queue was full'.format(dropped)}))
+
+    def flush(self, timeout=5):
+        """
+        Wait for the writer to write the records queued so far, then flush the target.
+        """
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            marker = _Flush()
+            try:
+                self._queue.put(marker, timeout=timeout)
+                marker.done.wait(timeout)
+            except queue.Full:
+                pass
+        self.target.flush()
+
+    def close(self):
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(5)
+        self.target.close()
+        super(AsyncHandler, self).close()
@@ -0,0 +1,49 @@
+import datetime
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from reservation.models import ArchivedReservation
+
+
+class Command(BaseCommand):
+    """
+    Move the reservations which departed before a cutoff from the Reservation table to the ArchivedReservation one.
+
+    Reservations are moved in batches, each in its own short transaction locking only the rows it moves, so bookings
+    go on while the command runs. --sleep pauses between batches to leave the database some room on a busy server.
+    The command can be stopped and run again at any time, a batch is either fully moved or not at all.
+    """
+    help = 'Archive the reservations which departed before a cutoff, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=365,
+                            help='Archive the reservations which departed more than this many days ago')
+        parser.add_argument('--before', help='Archive the reservations which departed before this date (YYYY-MM-DD), '
+                                             'instead of --days')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of reservations moved per transaction')
+        parser.add_argument('--sleep', type=float, default=0.0, help='Seconds to wait between two batches')
+
+    def handle(self, *args, **options):
+        if options['before']:
+            try:
+                cutoff = datetime.datetime.strptime(options['before'], '%Y-%m-%d')
+            except ValueError:
+                raise CommandError('--before should be a date formatted as YYYY-MM-DD')
+            cutoff = timezone.make_aware(cutoff, timezone.utc)
+        else:
+            cutoff = timezone.now()-datetime.timedelta(options['days'])
+
+        archived = batches = 0
+        while True:
+            moved = ArchivedReservation.archive(cutoff, batch_size=options['batch_size'])
+            if not moved:
+                break
+            archived += moved
+            batches += 1
+            if options['verbosity'] > 1:
+                self.stdout.write('Archived {0} reservations'.format(archived))
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        self.stdout.write('Archived {0} reservations which departed before {1} in {2} batches'.format(
+            archived, cutoff.isoformat(), batches))
@@ -0,0 +1,311 @@
+import datetime
+import json
+import math
+import random
+import threading
+import time
+import timeit
+from django.core.handlers.base import BaseHandler
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction, OperationalError
+from django.test import RequestFactory
+from django.utils import six
+from rest_framework.reverse import reverse
+from reservation.models import Hotel, HotelOccupancy, Reservation
+from reservation.utilities import normalize_date
+
+SCENARIOS = ('hotel-list', 'hotel-detail', 'availability', 'reservation-list', 'reservation-detail',
+             'reservation-create', 'reservation-update', 'reservation-delete')
+
+PERCENTILES = (50, 95, 99)
+
+
+class BenchHandler(BaseHandler):
+    """
+    Request handler going through the middlewares and the url routes like the WSGI handler does. Unlike it, it keeps
+    the database connection of the client thread open between requests and raises the exceptions of the views, so that
+    a request failing on a sqlite lock can be retried.
+    """
+
+    def __call__(self, environ):
+        if self._request_middleware is None:
+            self.load_middleware()
+        request = WSGIRequest(environ)
+        request._dont_enforce_csrf_checks = True
+        return self.get_response(request)
+
+    def handle_uncaught_exception(self, request, resolver, exc_info):
+        six.reraise(*exc_info)
+
+
+class BenchClient(RequestFactory):
+    """
+    RequestFactory whose requests are served by a BenchHandler, one per client thread.
+    """
+
+    def __init__(self, **defaults):
+        super(BenchClient, self).__init__(**defaults)
+        self.handler = BenchHandler()
+
+    def request(self, **request):
+        return self.handler(self._base_environ(**request))
+
+
+def percentile(latencies, percent):
+    """
+    :param latencies: sorted list of values
+    :return: the nearest rank percentile of the values
+    """
+    if not latencies:
+        return None
+    rank = int(math.ceil(percent/100.0*len(latencies)))
+    return latencies[min(max(rank, 1), len(latencies))-1]
+
+
+def summarize(latencies, statuses, elapsed):
+    """
+    :param latencies: request latencies in seconds
+    :param statuses: dict of response status (or exception name) to count
+    :param elapsed: wall clock seconds the requests took
+    :return: dict of the throughput and latencies in milliseconds of a scenario
+    """
+    latencies = sorted(latencies)
+    errors = sum(count for status, count in statuses.items() if not (isinstance(status, int) and status < 400))
+    result = {
+        'requests': len(latencies),
+        'errors': errors,
+        'statuses': dict((str(status), count) for status, count in statuses.items()),
+        'throughput': len(latencies)/elapsed if elapsed else 0.0,
+        'mean_ms': sum(latencies)*1000/len(latencies) if latencies else None,
+        'max_ms': latencies[-1]*1000 if latencies else None,
+    }
+    for percent in PERCENTILES:
+        value = percentile(latencies, percent)
+        result['p{0}_ms'.format(percent)] = value*1000 if value is not None else None
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """
+    :param results: scenario results of this run, as returned by summarize()
+    :param baseline: scenario results of an earlier run
+    :param tolerance: fraction by which the p95 latency may grow or the throughput drop before it is a regression
+    :return: list of (scenario, metric, baseline value, value) of the regressions
+    """
+    regressions = []
+    for scenario, result in results.items():
+        base = baseline.get(scenario)
+        if not base:
+            continue
+        if base['p95_ms'] is not None and result['p95_ms'] > base['p95_ms']*(1+tolerance):
+            regressions.append((scenario, 'p95_ms', base['p95_ms'], result['p95_ms']))
+        if result['throughput'] < base['throughput']*(1-tolerance):
+            regressions.append((scenario, 'throughput', base['throughput'], result['throughput']))
+    return regressions
+
+
+class Command(BaseCommand):
+    """
+    Load and latency benchmark of the reservation API.
+
+    Seeds hotels and reservations with bulk inserts (and rebuilds their occupancy ledger), then runs each scenario in
+    turn: --clients threads send --requests requests in total to the real url routes, through the middlewares, and the
+    throughput and p50/p95/p99 latencies are reported. --output saves the results as JSON, --baseline compares them to
+    the JSON of an earlier run and fails when a scenario got slower than --tolerance allows.
+
+    The seeded rows, and the reservations created by the run, are deleted at the end unless --keep is given. sqlite
+    refuses concurrent writers, write requests failing on a lock are retried and the retries count in their latency.
+    """
+    help = 'Benchmark the throughput and latency of the reservation API under concurrent clients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hotels', type=int, default=50, help='Number of hotels seeded')
+        parser.add_argument('--reservations', type=int, default=10000, help='Number of reservations seeded')
+        parser.add_argument('--clients', type=int, default=8, help='Number of concurrent clients')
+        parser.add_argument('--requests', type=int, default=500, help='Number of requests of each scenario')
+        parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS),
+                            help='Scenarios to run, all by default')
+        parser.add_argument('--retries', type=int, default=100,
+                            help='Times a request failing on a database lock (sqlite) is retried')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the random stays and requests')
+        parser.add_argument('--output', help='Save the results as JSON to this file')
+        parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Fraction by which the p95 latency may grow or the throughput drop against the '
+                                 'baseline before the command fails')
+        parser.add_argument('--keep', action='store_true', default=False, help='Keep the seeded rows')
+
+    def handle(self, *args, **options):
+        if 'reservation-delete' in options['scenarios'] and options['requests'] > options['reservations']:
+            raise CommandError('reservation-delete needs at least as many seeded reservations as requests')
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)['scenarios']
+
+        self.random = random.Random(options['seed'])
+        self.first_day = normalize_date(datetime.datetime(2031, 1, 1))
+        self.lock = threading.Lock()
+
+        seed_started = timeit.default_timer()
+        self.hotel_ids, self.stays = self.seed(options['hotels'], options['reservations'])
+        self.stdout.write('Seeded {0} hotels and {1} reservations in {2:.2f}s'.format(
+            options['hotels'], options['reservations'], timeit.default_timer()-seed_started))
+
+        try:
+            results = {}
+            self.stdout.write('{0:>20} {1:>8} {2:>7} {3:>10} {4:>9} {5:>9} {6:>9}'.format(
+                'scenario', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+            for scenario in options['scenarios']:
+                result = results[scenario] = self.run_scenario(scenario, options)
+                self.stdout.write('{0:>20} {1:>8} {2:>7} {3:>10.1f} {4:>9.2f} {5:>9.2f} {6:>9.2f}'.format(
+                    scenario, result['requests'], result['errors'], result['throughput'], result['p50_ms'],
+                    result['p95_ms'], result['p99_ms']))
+        finally:
+            if not options['keep']:
+                self.clean()
+
+        if options['output']:
+            report = {
+                'date': datetime.datetime.utcnow().isoformat(),
+                'database': connection.vendor,
+                'options': dict((name, options[name]) for name in (
+                    'hotels', 'reservations', 'clients', 'requests', 'retries', 'seed')),
+                'scenarios': results,
+            }
+            with open(options['output'], 'w') as output_file:
+                json.dump(report, output_file, indent=2, sort_keys=True)
+            self.stdout.write('Results saved to {0}'.format(options['output']))
+
+        if baseline is not None:
+            regressions = compare(results, baseline, options['tolerance'])
+            for scenario, metric, before, after in regressions:
+                self.stdout.write('{0} {1}: {2:.2f} -> {3:.2f}'.format(scenario, metric, before, after))
+            if regressions:
+                raise CommandError('{0} regressions against {1}'.format(len(regressions), options['baseline']))
+            self.stdout.write('No regression against {0}'.format(options['baseline']))
+
+    def random_stay(self):
+        """
+        :return: (arrival_date, departure_date) of a 1 to 14 night stay in the benchmarked year
+        """
+        arrival_date = self.first_day+datetime.timedelta(self.random.randrange(365))
+        departure_date = arrival_date+datetime.timedelta(self.random.randint(1, 14))
+        return arrival_date, normalize_date(departure_date, type='departure')
+
+    def seed(self, hotels, reservations):
+        """
+        Bulk insert the hotels and reservations and build their occupancy ledger. Every hotel has room for all the
+        reservations, the bookings made by the run are never refused for lack of room.
+        :return: (list of hotel ids, list of (reservation id, hotel id, arrival_date, departure_date))
+        """
+        name = 'benchmark hotel {0}'.format(datetime.datetime.utcnow().isoformat())
+        with transaction.atomic():
+            Hotel.objects.bulk_create([Hotel(name=name, room_capacity=reservations*2+1000, over_booking_capacity=0)
+                                       for i in range(hotels)])
+            hotel_ids = list(Hotel.objects.filter(name=name).values_list('id', flat=True))
+
+            rows = []
+            for i in range(reservations):
+                arrival_date, departure_date = self.random_stay()
+                rows.append(Reservation(guest_name='guest {0}'.format(i), guest_email='guest{0}@bench.com'.format(i),
+                                        arrival_date=arrival_date, departure_date=departure_date,
+                                        hotel_id=self.random.choice(hotel_ids)))
+            Reservation.objects.bulk_create(rows)
+        HotelOccupancy.rebuild(hotel_ids=hotel_ids)
+
+        stays = list(Reservation.objects.filter(hotel_id__in=hotel_ids).order_by('id').values_list(
+            'id', 'hotel_id', 'arrival_date', 'departure_date'))
+        return hotel_ids, stays
+
+    def clean(self):
+        # The cascade deletes bypass the ledger, rebuilding it resets the availability engine and caches too
+        Hotel.objects.filter(id__in=self.hotel_ids).delete()
+        HotelOccupancy.rebuild(hotel_ids=self.hotel_ids)
+
+    def make_request(self, scenario, index, generator):
+        """
+        :return: (method, url, data) of the index-th request of a scenario
+        """
+        if scenario == 'hotel-list':
+            return 'get', reverse('reservation:hotel-list'), None
+        if scenario == 'hotel-detail':
+            return 'get', reverse('reservation:hotel-detail', args=[generator.choice(self.hotel_ids)]), None
+        if scenario == 'availability':
+            arrival_date = self.first_day+datetime.timedelta(generator.randrange(365))
+            departure_date = arrival_date+datetime.timedelta(generator.randint(1, 14))
+            return 'get', reverse('reservation:availability'), {
+                'arrival': arrival_date.isoformat(), 'departure': departure_date.isoformat()}
+        if scenario == 'reservation-list':
+            return 'get', reverse('reservation:reservation-list'), None
+        if scenario == 'reservation-detail':
+            return 'get', reverse('reservation:reservation-detail', args=[generator.choice(self.stays)[0]]), None
+        if scenario == 'reservation-create':
+            arrival_date, departure_date = self.random_stay()
+            return 'post', reverse('reservation:reservation-list'), {
+                'guest_name': 'bench', 'guest_email': 'bench@bench.com', 'hotel': generator.choice(self.hotel_ids),
+                'arrival_date': arrival_date.isoformat(), 'departure_date': departure_date.isoformat()}
+        if scenario == 'reservation-update':
+            reservation_id, hotel_id, arrival_date, departure_date = self.stays[index % len(self.stays)]
+            return 'put', reverse('reservation:reservation-detail', args=[reservation_id]), {
+                'guest_name': 'updated {0}'.format(index), 'guest_email': 'updated@bench.com', 'hotel': hotel_id,
+                'arrival_date': arrival_date.isoformat(), 'departure_date': departure_date.isoformat()}
+        # reservation-delete, every request deletes a different reservation, starting from the last one
+        return 'delete', reverse('reservation:reservation-detail', args=[self.stays[-1-index][0]]), None
+
+    def run_scenario(self, scenario, options):
+        """
+        Send the requests of a scenario from concurrent client threads.
+        :return: dict of its results, see summarize()
+        """
+        pending = [options['requests']]
+        latencies, statuses = [], {}
+
+        def client(client_seed):
+            http = BenchClient(SERVER_NAME='localhost')
+            generator = random.Random(client_seed)
+            try:
+                while True:
+                    with self.lock:
+                        if not pending[0]:
+                            return
+                        pending[0] -= 1
+                        index = pending[0]
+                        request = self.make_request(scenario, index, generator)
+
+                    started = timeit.default_timer()
+                    status = self.send(http, request, options['retries'])
+                    latency = timeit.default_timer()-started
+                    with self.lock:
+                        latencies.append(latency)
+                        statuses[status] = statuses.get(status, 0)+1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=client, args=(options['seed']*1000+i,)) for i in range(options['clients'])]
+        started = timeit.default_timer()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return summarize(latencies, statuses, timeit.default_timer()-started)
+
+    def send(self, http, request, retries):
+        """
+        Send a request, retrying it when the database failed to take a lock.
+        :return: the status code of the response, or the name of the exception raised for it
+        """
+        method, url, data = request
+        for attempt in range(retries+1):
+            try:
+                if method == 'get':
+                    return http.get(url, data or {}, HTTP_ACCEPT='application/json').status_code
+                return getattr(http, method)(url, json.dumps(data) if data else '',
+                                             content_type='application/json').status_code
+            except OperationalError as exc:
+                if 'locked' not in str(exc) or attempt == retries:
+                    return exc.__class__.__name__
+            except Exception as exc:
+                return exc.__class__.__name__
+            time.sleep(random.random()*0.01*(attempt+1))
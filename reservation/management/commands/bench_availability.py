@@ -0,0 +1,90 @@
+import datetime
+import random
+import timeit
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from reservation.models import Hotel, HotelOccupancy, Reservation
+from reservation.utilities import normalize_date
+
+
+def legacy_count(hotel, start_date, end_date):
+    """
+    The six clause reservation count get_available_reservation_slots used to run, kept for comparison only.
+    """
+    return hotel.hotel_reservations.filter(Q(arrival_date=start_date) |
+                                           Q(departure_date=end_date) |
+                                           Q(arrival_date__lt=start_date, departure_date__gt=start_date,
+                                             departure_date__lt=end_date) |
+                                           Q(arrival_date__lt=end_date,
+                                             departure_date__gt=end_date, arrival_date__gt=start_date) |
+                                           Q(arrival_date__gt=start_date, departure_date__lt=end_date) |
+                                           Q(arrival_date__lt=start_date, departure_date__gt=end_date)
+                                           ).count()
+
+
+class Command(BaseCommand):
+    """
+    Benchmark the availability queries of a single hotel for growing numbers of reservations.
+
+    Every size seeds a fresh hotel inside a transaction which is rolled back at the end, the database is left as it
+    was found. Reported times are the mean over --repeat random stays, in milliseconds.
+    """
+    help = 'Benchmark availability query time for 10k, 100k and 1M reservations per hotel'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000],
+                            help='Numbers of reservations to seed for the hotel')
+        parser.add_argument('--repeat', type=int, default=50, help='Number of stays to time for each query')
+        parser.add_argument('--years', type=int, default=5, help='Years of booking history to spread the stays over')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the generated stays')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.first_day = normalize_date(datetime.datetime(2015, 1, 1))
+        self.days = 365*options['years']
+
+        self.stdout.write('{0:>10} {1:>12} {2:>12} {3:>12}'.format('rows', 'legacy ms', 'overlap ms', 'ledger ms'))
+        for size in options['sizes']:
+            with transaction.atomic():
+                hotel = self.seed(size)
+                stays = [self.random_stay() for i in range(options['repeat'])]
+
+                timings = [self.time(stays, lambda start, end: legacy_count(hotel, start, end)),
+                           self.time(stays, lambda start, end: hotel.get_overlapping_reservations(start, end).count()),
+                           self.time(stays, lambda start, end: hotel.get_available_reservation_slots(start, end))]
+
+                self.stdout.write('{0:>10} {1:>12.3f} {2:>12.3f} {3:>12.3f}'.format(size, *timings))
+                transaction.set_rollback(True)
+
+    def random_stay(self):
+        """
+        :return: (arrival_date, departure_date) of a 1 to 14 night stay inside the benchmarked history
+        """
+        arrival_date = self.first_day+datetime.timedelta(self.random.randrange(self.days))
+        departure_date = arrival_date+datetime.timedelta(self.random.randint(1, 14))
+        return arrival_date, normalize_date(departure_date, type='departure')
+
+    def seed(self, size):
+        """
+        Create a hotel with the given number of reservations, bulk inserted, and its occupancy ledger.
+        """
+        hotel = Hotel.objects.create(name='benchmark hotel', room_capacity=size, over_booking_capacity=0)
+
+        reservations = []
+        for i in range(size):
+            arrival_date, departure_date = self.random_stay()
+            reservations.append(Reservation(guest_name='guest {0}'.format(i), guest_email='guest{0}@bench.com'.format(i),
+                                            arrival_date=arrival_date, departure_date=departure_date, hotel=hotel))
+        Reservation.objects.bulk_create(reservations)
+        HotelOccupancy.rebuild(hotel_ids=[hotel.id])
+        return hotel
+
+    def time(self, stays, query):
+        """
+        :return: mean time in milliseconds to run the query for each of the stays
+        """
+        def run():
+            for start_date, end_date in stays:
+                query(start_date, end_date)
+        return timeit.timeit(run, number=1)*1000/len(stays)
@@ -0,0 +1,67 @@
+import datetime
+import random
+import timeit
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import RequestFactory
+from rest_framework.request import Request
+from rest_framework.reverse import reverse
+from reservation.models import Hotel, Reservation
+from reservation.serializers import ReservationSerializer, ReservationReadSerializer
+from reservation.utilities import normalize_date
+
+
+class Command(BaseCommand):
+    """
+    Benchmark the serialization of a reservation list response with ReservationSerializer and with
+    ReservationReadSerializer, and check both give the same representation.
+
+    The reservations are seeded inside a transaction which is rolled back at the end, the database is left as it was
+    found. Only the serialization is timed, the rows are fetched once beforehand. Reported times are the best of
+    --repeat runs, in milliseconds.
+    """
+    help = 'Benchmark the reservation list serializers on 10k reservations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='Number of reservations to serialize')
+        parser.add_argument('--hotels', type=int, default=50, help='Number of hotels the reservations are spread over')
+        parser.add_argument('--repeat', type=int, default=5, help='Number of times each serializer is timed')
+
+    def handle(self, *args, **options):
+        request = Request(RequestFactory(SERVER_NAME='localhost').get(reverse('reservation:reservation-list')))
+        context = {'request': request, 'format': None}
+
+        with transaction.atomic():
+            reservations = self.seed(options['rows'], options['hotels'])
+
+            results = {}
+            self.stdout.write('{0:>28} {1:>12}'.format('serializer', 'ms'))
+            for serializer_class in (ReservationSerializer, ReservationReadSerializer):
+                def run():
+                    results[serializer_class] = serializer_class(reservations, many=True, context=context).data
+                elapsed = min(timeit.repeat(run, number=1, repeat=options['repeat']))*1000
+                self.stdout.write('{0:>28} {1:>12.3f}'.format(serializer_class.__name__, elapsed))
+            transaction.set_rollback(True)
+
+        if results[ReservationSerializer] != results[ReservationReadSerializer]:
+            raise CommandError('ReservationReadSerializer does not give the same representation')
+
+    def seed(self, rows, hotels):
+        """
+        :return: list of reservations, with their hotel, as the reservation list fetches them
+        """
+        hotels = [Hotel.objects.create(name='benchmark hotel {0}'.format(i), room_capacity=rows,
+                                       over_booking_capacity=0) for i in range(hotels)]
+        first_day = normalize_date(datetime.datetime(2015, 1, 1))
+        generator = random.Random(0)
+
+        reservations = []
+        for i in range(rows):
+            arrival_date = first_day+datetime.timedelta(generator.randrange(365))
+            departure_date = normalize_date(arrival_date+datetime.timedelta(generator.randint(1, 14)), type='departure')
+            reservations.append(Reservation(guest_name='guest {0}'.format(i), guest_email='guest{0}@bench.com'.format(i),
+                                            arrival_date=arrival_date, departure_date=departure_date,
+                                            hotel=generator.choice(hotels)))
+        Reservation.objects.bulk_create(reservations)
+        return list(Reservation.objects.filter(hotel__in=hotels)
+                    .select_related(*ReservationSerializer.select_related_fields).order_by('id'))
@@ -0,0 +1,76 @@
+import datetime
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from reservation.models import Hotel, Reservation
+from reservation.utilities import normalize_date
+
+
+class Command(BaseCommand):
+    """
+    Cancel the reservations of a hotel holding a room between two dates, or delete the hotel with all of its
+    reservations with --delete-hotel.
+
+    Reservations are cancelled in batches, each in its own short transaction locking only the rows it updates and
+    releasing their nights from the occupancy ledger, so bookings go on while the command runs. A deleted hotel goes
+    the same way, its rows deleted in batches. --sleep pauses between batches to leave the database some room on a
+    busy server. The command can be stopped and run again at any time.
+    """
+    help = 'Cancel the reservations of a hotel between two dates, or delete the hotel, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('hotel', type=int, help='Id of the hotel')
+        parser.add_argument('--from', dest='from', help='Cancel the reservations holding a room from this date '
+                                                        '(YYYY-MM-DD)')
+        parser.add_argument('--to', help='Cancel the reservations holding a room before this date (YYYY-MM-DD)')
+        parser.add_argument('--delete-hotel', action='store_true',
+                            help='Delete the hotel with all of its reservations, archived ones included')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of rows cancelled or deleted per transaction')
+        parser.add_argument('--sleep', type=float, default=0.0, help='Seconds to wait between two batches')
+
+    def parse_date(self, name, value, type):
+        try:
+            date = normalize_date(datetime.datetime.strptime(value, '%Y-%m-%d'), type=type)
+        except ValueError:
+            raise CommandError('--{0} should be a date formatted as YYYY-MM-DD'.format(name))
+        return timezone.make_aware(date, timezone.utc)
+
+    def handle(self, *args, **options):
+        try:
+            hotel = Hotel.objects.get(pk=options['hotel'])
+        except Hotel.DoesNotExist:
+            raise CommandError('No hotel with the id {0}'.format(options['hotel']))
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size should be at least 1')
+
+        if options['delete_hotel']:
+            if options['from'] or options['to']:
+                raise CommandError('--delete-hotel deletes every reservation, it takes no --from or --to')
+            for model_name, deleted in hotel.delete_in_batches(batch_size=options['batch_size']):
+                self.progress(options, 'Deleted {0} rows of {1}'.format(deleted, model_name))
+            self.stdout.write('Deleted the hotel {0}'.format(options['hotel']))
+            return
+
+        if not options['from'] or not options['to']:
+            raise CommandError('Give the --from and --to dates of the reservations to cancel')
+        start_date = self.parse_date('from', options['from'], 'arrival')
+        end_date = self.parse_date('to', options['to'], 'departure')
+        if end_date <= start_date:
+            raise CommandError('--to should be after --from')
+
+        reservations = Reservation.objects.filter(hotel_id=hotel.id).overlapping(start_date, end_date)
+        cancelled = batches = 0
+        for count in reservations.cancel_in_batches(batch_size=options['batch_size']):
+            cancelled += count
+            batches += 1
+            self.progress(options, 'Cancelled {0} reservations'.format(cancelled))
+
+        self.stdout.write('Cancelled {0} reservations of the hotel {1} in {2} batches'.format(
+            cancelled, hotel.id, batches))
+
+    def progress(self, options, message):
+        if options['verbosity'] > 1:
+            self.stdout.write(message)
+        if options['sleep']:
+            time.sleep(options['sleep'])
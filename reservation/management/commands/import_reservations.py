@@ -0,0 +1,194 @@
+import csv
+import io
+import json
+import os
+import sys
+import timeit
+from collections import OrderedDict
+from itertools import islice
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import six
+from django.utils.encoding import force_str, force_text
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+from reservation.serializers import ReservationBatch
+
+FORMATS = ('csv', 'jsonl')
+
+
+def read_csv(stream):
+    """
+    :param stream: binary file object of CSV with a header line
+    :return: generator of (line number, row dict, None)
+    """
+    if six.PY2:
+        reader = csv.DictReader(stream)
+    else:
+        reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8', newline=''))
+    for row in reader:
+        yield reader.line_num, OrderedDict((force_text(name), force_text(row[name]) if row[name] is not None else None)
+                                           for name in reader.fieldnames), None
+
+
+def read_jsonl(stream):
+    """
+    :param stream: binary file object holding one JSON object per line
+    :return: generator of (line number, row dict, None), or (line number, {'line': raw line}, errors) for the lines
+        which are not a JSON object
+    """
+    for line_number, line in enumerate(stream, 1):
+        line = force_text(line).strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            row = None
+            message = 'Invalid JSON: {0}'.format(exc)
+        else:
+            message = 'Expected a JSON object.'
+        if isinstance(row, dict):
+            yield line_number, row, None
+        else:
+            yield line_number, {'line': line}, {api_settings.NON_FIELD_ERRORS_KEY: [message]}
+
+
+class RejectWriter(object):
+    """
+    Writes the rejected rows in the format of the input, each with its line number and the errors as JSON, so that
+    the file can be fixed and imported again. The file is only created once there is a row to reject.
+    """
+
+    def __init__(self, path, input_format):
+        self.path = path
+        self.input_format = input_format
+        self.count = 0
+        self.file = None
+        self.writer = None
+
+    def write(self, line_number, row, errors):
+        errors = json.dumps(errors, cls=JSONEncoder)
+        if self.input_format == 'csv':
+            if self.writer is None:
+                self.file = io.open(self.path, 'wb' if six.PY2 else 'w', **({} if six.PY2 else {'newline': ''}))
+                self.writer = csv.writer(self.file)
+                self.columns = [column for column in row if column not in ('line', 'errors')]
+                self.writer.writerow([self.value(column) for column in self.columns+['line', 'errors']])
+            self.writer.writerow([self.value(row.get(column)) for column in self.columns] +
+                                 [line_number, self.value(errors)])
+        else:
+            if self.file is None:
+                self.file = io.open(self.path, 'w', encoding='utf-8')
+            rejected = dict(row, line=line_number, errors=json.loads(errors))
+            self.file.write(force_text(json.dumps(rejected, cls=JSONEncoder))+u'\n')
+        self.count += 1
+
+    def value(self, value):
+        if value is None:
+            return ''
+        # The csv module of python 2 only writes bytes
+        return force_str(value) if six.PY2 else value
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class Command(BaseCommand):
+    """
+    Import reservations from a CSV file (with a header line) or a JSON lines file, holding the guest_name,
+    guest_email, hotel (id), arrival_date and departure_date of each reservation.
+
+    The input is streamed in chunks of --chunk-size rows and each chunk goes through ReservationBatch, like a request
+    to /api/reservations/bulk: the rows are validated and their dates normalized, the hotels are read once per chunk
+    and the capacity of each hotel is checked with an in-memory sweep over its occupancy ledger, read once per chunk,
+    rows earlier in the import counting against the later ones. The accepted rows of a chunk are booked in the ledger
+    and written with a single bulk insert, in one transaction per chunk.
+
+    Rejected rows, invalid or without room left in their hotel, are written to the --rejects file with their line
+    number and errors, in the format of the input.
+    """
+    help = 'Bulk import reservations from a CSV or JSON lines file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, - to read the standard input')
+        parser.add_argument('--format', choices=FORMATS,
+                            help='Format of the input, guessed from the file extension by default (.csv or .jsonl)')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Number of rows validated and written at once')
+        parser.add_argument('--rejects', help='File the rejected rows are written to, <path>.rejects.<format> by '
+                                              'default')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        input_format = options['format']
+        if input_format is None:
+            extension = os.path.splitext(path)[1].lstrip('.').lower()
+            input_format = {'csv': 'csv', 'jsonl': 'jsonl', 'ndjson': 'jsonl', 'json': 'jsonl'}.get(extension)
+            if input_format is None:
+                raise CommandError('Can not guess the format of {0}, give --format'.format(path))
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size should be at least 1')
+        rejects_path = options['rejects'] or '{0}.rejects.{1}'.format('import' if path == '-' else path, input_format)
+
+        if path == '-':
+            stream = getattr(sys.stdin, 'buffer', sys.stdin)
+        else:
+            try:
+                stream = io.open(path, 'rb')
+            except IOError as exc:
+                raise CommandError('Can not open {0}: {1}'.format(path, exc))
+
+        rejects = RejectWriter(rejects_path, input_format)
+        rows = read_csv(stream) if input_format == 'csv' else read_jsonl(stream)
+        read = imported = 0
+        started = timeit.default_timer()
+        try:
+            while True:
+                chunk = list(islice(rows, options['chunk_size']))
+                if not chunk:
+                    break
+                read += len(chunk)
+                imported += self.import_chunk(chunk, rejects)
+                if options['verbosity'] > 1:
+                    self.stdout.write('Line {0}: {1} rows read, {2} imported, {3} rejected'.format(
+                        chunk[-1][0], read, imported, rejects.count))
+        finally:
+            rejects.close()
+            if stream is not getattr(sys.stdin, 'buffer', sys.stdin):
+                stream.close()
+
+        elapsed = timeit.default_timer()-started
+        self.stdout.write('Imported {0} of {1} rows in {2:.2f}s, {3:.0f} rows/s'.format(
+            imported, read, elapsed, read/elapsed if elapsed else 0))
+        if rejects.count:
+            self.stdout.write('Rejected {0} rows, written to {1}'.format(rejects.count, rejects_path))
+
+    def import_chunk(self, chunk, rejects):
+        """
+        Validate a chunk of rows and write the accepted ones, in one transaction.
+        :param chunk: list of (line number, row, errors) tuples, rows with errors are rejected as they are
+        :return: number of reservations imported
+        """
+        for line_number, row, errors in chunk:
+            if errors:
+                rejects.write(line_number, row, errors)
+        lines = [(line_number, row) for line_number, row, errors in chunk if not errors]
+
+        batch = ReservationBatch([row for line_number, row in lines])
+        with transaction.atomic():
+            if batch.is_valid():
+                try:
+                    batch.save()
+                except serializers.ValidationError as exc:
+                    # Concurrent bookings kept taking the slots of the chunk, nothing of it was saved
+                    for line_number, row in lines:
+                        rejects.write(line_number, row, exc.detail)
+                    return 0
+
+        for result in batch.results:
+            if result['status'] == 'rejected':
+                line_number, row = lines[result['index']]
+                rejects.write(line_number, row, result['errors'])
+        return len(batch.accepted)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from reservation.models import HotelOccupancy
+
+
+class Command(BaseCommand):
+    """
+    Recompute the per night hotel occupancy ledger from the Reservation rows.
+    Needed after reservations were changed with bulk queryset operations that bypass Reservation.save()/delete().
+    """
+    help = 'Rebuild the per night hotel occupancy ledger from the reservations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hotel', type=int, action='append', dest='hotel_ids',
+                            help='Only rebuild the given hotel id, can be repeated')
+
+    def handle(self, *args, **options):
+        HotelOccupancy.rebuild(hotel_ids=options['hotel_ids'])
+        self.stdout.write('Rebuilt the occupancy ledger for {0}'.format(
+            'hotels {0}'.format(options['hotel_ids']) if options['hotel_ids'] else 'all hotels'))
@@ -0,0 +1,109 @@
+import datetime
+import json
+import random
+import threading
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, OperationalError
+from django.core.urlresolvers import resolve
+from django.test import RequestFactory
+from rest_framework.reverse import reverse
+from reservation.models import Hotel
+
+
+class Command(BaseCommand):
+    """
+    Stress the reservation create API with concurrent clients competing for the same nights, and check no hotel ends
+    up with more reservations than its capacity.
+
+    Every thread posts one night stays to /api/reservations for the same night, spread over the hotels, so that the
+    bookings of one hotel race each other while the hotels race in parallel. The hotels are created for the run and
+    deleted afterwards unless --keep is given.
+    """
+    help = 'Concurrent booking stress test, fails if any hotel is oversold'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Number of concurrent clients')
+        parser.add_argument('--requests', type=int, default=400, help='Total number of booking requests')
+        parser.add_argument('--hotels', type=int, default=4, help='Number of hotels the requests are spread over')
+        parser.add_argument('--capacity', type=int, default=20, help='Room capacity of every hotel')
+        parser.add_argument('--retries', type=int, default=100,
+                            help='Times a request failing on a database lock (sqlite) is retried')
+        parser.add_argument('--keep', action='store_true', default=False, help='Keep the hotels and reservations')
+
+    def handle(self, *args, **options):
+        hotels = [Hotel.objects.create(name='stress hotel {0}'.format(i), room_capacity=options['capacity'],
+                                       over_booking_capacity=0) for i in range(options['hotels'])]
+        arrival_date = datetime.datetime(2030, 1, 1)
+        departure_date = arrival_date+datetime.timedelta(1)
+
+        self.lock = threading.Lock()
+        self.pending = options['requests']
+        self.statuses = {}
+        self.lock_retries = 0
+
+        def client():
+            # The test Client reports request exceptions through a global signal, which mixes them up across threads.
+            http = RequestFactory(SERVER_NAME='localhost')
+            url = reverse('reservation:reservation-list')
+            try:
+                while True:
+                    with self.lock:
+                        if not self.pending:
+                            return
+                        self.pending -= 1
+                        hotel = hotels[self.pending % len(hotels)]
+
+                    data = {'guest_name': 'stress', 'guest_email': 'stress@stress.com', 'hotel': hotel.id,
+                            'arrival_date': arrival_date.isoformat(), 'departure_date': departure_date.isoformat()}
+                    status = self.post(http, url, data, options['retries'])
+                    with self.lock:
+                        self.statuses[status] = self.statuses.get(status, 0)+1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=client) for i in range(options['threads'])]
+        started = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time()-started
+
+        booked = dict((hotel.id, hotel.hotel_reservations.count()) for hotel in hotels)
+        oversold = [hotel_id for hotel_id, count in booked.items() if count > options['capacity']]
+        bookings = sum(booked.values())
+
+        self.stdout.write('{0} requests from {1} threads in {2:.2f}s: {3:.1f} requests/s, {4:.1f} bookings/s'.format(
+            options['requests'], options['threads'], elapsed, options['requests']/elapsed, bookings/elapsed))
+        self.stdout.write('Responses: {0}'.format(', '.join('{0}={1}'.format(status, count)
+                                                             for status, count in sorted(self.statuses.items()))))
+        self.stdout.write('Requests retried after a database lock error: {0}'.format(self.lock_retries))
+        self.stdout.write('Booked per hotel (capacity {0}): {1}'.format(options['capacity'], sorted(booked.values())))
+
+        if not options['keep']:
+            for hotel in hotels:
+                hotel.delete()
+
+        if oversold:
+            raise CommandError('Hotels {0} were oversold'.format(oversold))
+
+    def post(self, http, url, data, retries):
+        """
+        Post a booking, retrying it when the database failed to take a lock. sqlite refuses concurrent writers instead
+        of queueing them.
+        :return: the status code of the response, or the name of the exception raised for it
+        """
+        view = resolve(url).func
+        for attempt in range(retries+1):
+            try:
+                return view(http.post(url, json.dumps(data), content_type='application/json')).status_code
+            except OperationalError as exc:
+                if 'locked' not in str(exc) or attempt == retries:
+                    return exc.__class__.__name__
+            except Exception as exc:
+                return exc.__class__.__name__
+
+            with self.lock:
+                self.lock_retries += 1
+            time.sleep(random.random()*0.01*(attempt+1))
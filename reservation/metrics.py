@@ -0,0 +1,256 @@
+"""
+Per request performance instrumentation.
+
+While a request is served, RequestTimings (one per thread) adds up the time spent in a few phases: database queries
+(counted as well), building the response representation in the serializers, availability checks and rendering.
+reservation.middleware.MetricsMiddleware sends them back in a Server-Timing header and adds them to per endpoint
+histograms, which /api/metrics exposes in the Prometheus text format.
+
+The histograms live in the memory of the process, with several server processes each one reports its own requests.
+Measuring costs a few clock reads per phase and one lock per request, cheap enough to stay on in production.
+"""
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from django.db.backends.utils import CursorWrapper, CursorDebugWrapper
+
+# Upper bounds in seconds of the histogram buckets, the Prometheus client defaults
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+# Phases measured during a request, in the order of the Server-Timing header
+PHASES = ('db', 'serializer', 'availability', 'render')
+
+_local = threading.local()
+
+
+class RequestTimings(object):
+    """
+    Time spent in each phase by the request being served on this thread, in seconds.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.durations = dict((phase, 0.0) for phase in PHASES)
+        self.queries = 0
+        self.active = set()
+
+    def add(self, phase, duration):
+        self.durations[phase] += duration
+
+    def get_server_timing(self, total):
+        """
+        :return: value of the Server-Timing header, durations in milliseconds
+        """
+        metrics = ['{0};dur={1:.2f}'.format(phase, self.durations[phase]*1000) for phase in PHASES]
+        metrics[0] += ';desc="{0} queries"'.format(self.queries)
+        metrics.append('total;dur={0:.2f}'.format(total*1000))
+        return ', '.join(metrics)
+
+
+def start_request():
+    _local.timings = RequestTimings()
+    return _local.timings
+
+
+def end_request():
+    timings, _local.timings = getattr(_local, 'timings', None), None
+    return timings
+
+
+def get_timings():
+    """
+    :return: RequestTimings of the request served on this thread, None outside of a request
+    """
+    return getattr(_local, 'timings', None)
+
+
+@contextmanager
+def timed(phase):
+    """
+    Add the time spent inside the block to a phase of the current request. Nested blocks of the same phase (a
+    serializer inside another one) are only counted once.
+    """
+    timings = get_timings()
+    if timings is None or phase in timings.active:
+        yield
+        return
+
+    timings.active.add(phase)
+    started = time.time()
+    try:
+        yield
+    finally:
+        timings.add(phase, time.time()-started)
+        timings.active.discard(phase)
+
+
+def timed_method(phase):
+    """
+    Decorator counting the time spent in a function in a phase, see timed()
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with timed(phase):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TimedCursorMixin(object):
+    """
+    Cursor wrapper counting the queries of the current request and the time they take.
+    """
+
+    def execute(self, sql, params=None):
+        with timed('db'):
+            self.count()
+            return super(TimedCursorMixin, self).execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        with timed('db'):
+            self.count()
+            return super(TimedCursorMixin, self).executemany(sql, param_list)
+
+    def count(self):
+        timings = get_timings()
+        if timings is not None:
+            timings.queries += 1
+
+
+class TimedCursorWrapper(TimedCursorMixin, CursorWrapper):
+    pass
+
+
+class TimedCursorDebugWrapper(TimedCursorMixin, CursorDebugWrapper):
+    pass
+
+
+def instrument_connection(connection):
+    """
+    Make the cursors of a database connection count their queries, once per connection object.
+    """
+    if getattr(connection, 'metrics_instrumented', False):
+        return
+    connection.make_cursor = lambda cursor: TimedCursorWrapper(cursor, connection)
+    connection.make_debug_cursor = lambda cursor: TimedCursorDebugWrapper(cursor, connection)
+    connection.metrics_instrumented = True
+
+
+class Histogram(object):
+    """
+    Cumulative histogram of observed values, as Prometheus reports them.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0]*(len(buckets)+1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def get_samples(self):
+        """
+        :return: list of (suffix, extra labels, value) of the _bucket, _sum and _count samples
+        """
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets+(float('inf'),), self.counts):
+            cumulative += count
+            samples.append(('_bucket', (('le', format_float(bound)),), cumulative))
+        samples.append(('_sum', (), self.sum))
+        samples.append(('_count', (), cumulative))
+        return samples
+
+
+class Registry(object):
+    """
+    Metrics of the requests served by this process.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.request_durations = OrderedDict()
+        self.phase_durations = OrderedDict()
+        self.requests = OrderedDict()
+        self.queries = OrderedDict()
+
+    def observe(self, endpoint, method, status_code, total, timings):
+        with self.lock:
+            self.request_durations.setdefault((endpoint, method), Histogram()).observe(total)
+            for phase in PHASES:
+                self.phase_durations.setdefault((endpoint, method, phase), Histogram()).observe(
+                    timings.durations[phase])
+            key = (endpoint, method, str(status_code))
+            self.requests[key] = self.requests.get(key, 0)+1
+            self.queries[(endpoint, method)] = self.queries.get((endpoint, method), 0)+timings.queries
+
+    def get_families(self):
+        """
+        :return: list of (name, type, help, samples), samples being lists of (labels, value)
+        """
+        with self.lock:
+            return [
+                ('hotel_http_request_duration_seconds', 'histogram', 'Time to serve a request, by endpoint',
+                 histogram_samples(self.request_durations, ('endpoint', 'method'))),
+                ('hotel_http_request_phase_duration_seconds', 'histogram',
+                 'Time spent in a phase of a request (db, serializer, availability, render), by endpoint',
+                 histogram_samples(self.phase_durations, ('endpoint', 'method', 'phase'))),
+                ('hotel_http_requests_total', 'counter', 'Requests served, by endpoint and status code',
+                 [(zip(('endpoint', 'method', 'status'), key), value) for key, value in self.requests.items()]),
+                ('hotel_db_queries_total', 'counter', 'Database queries made while serving requests, by endpoint',
+                 [(zip(('endpoint', 'method'), key), value) for key, value in self.queries.items()]),
+            ]
+
+    def clear(self):
+        with self.lock:
+            self.request_durations.clear()
+            self.phase_durations.clear()
+            self.requests.clear()
+            self.queries.clear()
+
+
+def histogram_samples(histograms, label_names):
+    samples = []
+    for key, histogram in histograms.items():
+        labels = list(zip(label_names, key))
+        for suffix, extra_labels, value in histogram.get_samples():
+            samples.append((labels+list(extra_labels), value, suffix))
+    return samples
+
+
+def format_float(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def escape_label(value):
+    return u'{0}'.format(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def render_families(families):
+    """
+    :param families: list of (name, type, help, samples) as returned by Registry.get_families(), samples being lists
+        of (labels, value) or (labels, value, name suffix)
+    :return: the metrics in the Prometheus text exposition format
+    """
+    lines = []
+    for name, metric_type, help_text, samples in families:
+        lines.append(u'# HELP {0} {1}'.format(name, help_text))
+        lines.append(u'# TYPE {0} {1}'.format(name, metric_type))
+        for sample in samples:
+            labels, value = sample[0], sample[1]
+            suffix = sample[2] if len(sample) > 2 else ''
+            label_text = u','.join(u'{0}="{1}"'.format(key, escape_label(label)) for key, label in labels)
+            lines.append(u'{0}{1}{2} {3}'.format(name, suffix, u'{' + label_text + u'}' if label_text else u'',
+                                                 format_float(value) if isinstance(value, float) else value))
+    return u'\n'.join(lines)+u'\n'
+
+
+registry = Registry()
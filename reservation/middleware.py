@@ -0,0 +1,38 @@
+import time
+from django.db import connections
+from reservation import metrics
+
+
+class MetricsMiddleware(object):
+    """
+    Measure every request (see reservation.metrics), send the timings back in a Server-Timing header and add them to
+    the histograms of the endpoint, named after its url. Listed first in MIDDLEWARE_CLASSES so that the total covers
+    the other middlewares too.
+    """
+
+    def process_request(self, request):
+        for connection in connections.all():
+            metrics.instrument_connection(connection)
+        metrics.start_request()
+
+    def process_template_response(self, request, response):
+        # Rendering happens after the view returned, it is timed from here to the end of response.render()
+        timings = metrics.get_timings()
+        if timings is not None:
+            started = time.time()
+            response.add_post_render_callback(lambda rendered: timings.add('render', time.time()-started))
+        return response
+
+    def process_response(self, request, response):
+        timings = metrics.end_request()
+        if timings is None:
+            return response
+
+        total = time.time()-timings.started
+        response['Server-Timing'] = timings.get_server_timing(total)
+
+        resolver_match = getattr(request, 'resolver_match', None)
+        endpoint = resolver_match.view_name if resolver_match else 'unmatched'
+        if endpoint != 'reservation:metrics':
+            metrics.registry.observe(endpoint, request.method, response.status_code, total, timings)
+        return response
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from collections import defaultdict
+from django.db import migrations, models
+from reservation.utilities import stay_nights
+
+
+def build_occupancy(apps, schema_editor):
+    """
+    Fill the occupancy ledger from the reservations that already exist.
+    """
+    Reservation = apps.get_model('reservation', 'Reservation')
+    HotelOccupancy = apps.get_model('reservation', 'HotelOccupancy')
+    db_alias = schema_editor.connection.alias
+
+    counts = defaultdict(int)
+    for hotel_id, arrival_date, departure_date in Reservation.objects.using(db_alias).values_list(
+            'hotel_id', 'arrival_date', 'departure_date').iterator():
+        for night in stay_nights(arrival_date, departure_date):
+            counts[(hotel_id, night)] += 1
+
+    HotelOccupancy.objects.using(db_alias).bulk_create([
+        HotelOccupancy(hotel_id=hotel_id, night=night, occupied=occupied)
+        for (hotel_id, night), occupied in counts.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservation', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HotelOccupancy',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('night', models.DateField()),
+                ('occupied', models.IntegerField(default=0)),
+                ('hotel', models.ForeignKey(related_name='hotel_occupancy', to='reservation.Hotel')),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='reservation',
+            name='hotel',
+            field=models.ForeignKey(related_name='hotel_reservations', to='reservation.Hotel'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='hoteloccupancy',
+            unique_together=set([('hotel', 'night')]),
+        ),
+        migrations.RunPython(build_occupancy, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservation', '0002_hotel_occupancy'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='reservation',
+            index_together=set([('hotel', 'arrival_date', 'departure_date')]),
+        ),
+    ]
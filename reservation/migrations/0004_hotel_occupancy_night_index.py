@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservation', '0003_reservation_overlap_index'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='hoteloccupancy',
+            index_together=set([('night', 'hotel', 'occupied')]),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservation', '0004_hotel_occupancy_night_index'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='reservation',
+            index_together=set([('arrival_date', 'id'), ('created_time', 'id'), ('hotel', 'arrival_date', 'departure_date')]),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservation', '0005_reservation_cursor_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hotel',
+            name='created_time',
+            field=models.DateTimeField(default=django.utils.timezone.now, auto_now_add=True),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='hotel',
+            name='last_modified_time',
+            field=models.DateTimeField(default=django.utils.timezone.now, auto_now=True),
+            preserve_default=False,
+        ),
+    ]
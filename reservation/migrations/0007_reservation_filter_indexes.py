@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservation', '0006_hotel_timestamps'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='reservation',
+            name='departure_date',
+            field=models.DateTimeField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='reservation',
+            name='guest_email',
+            field=models.EmailField(max_length=254, db_index=True),
+        ),
+    ]
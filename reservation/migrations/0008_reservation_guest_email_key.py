@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models.functions import Lower
+import reservation.models
+
+
+def fill_guest_email_key(apps, schema_editor):
+    # A single UPDATE, before the index exists. The addresses were stripped on the way in, only their case is folded.
+    Reservation = apps.get_model('reservation', 'Reservation')
+    Reservation.objects.update(guest_email_key=Lower('guest_email'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservation', '0007_reservation_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reservation',
+            name='guest_email_key',
+            field=reservation.models.FoldedEmailField(default='', source='guest_email', max_length=254, editable=False),
+        ),
+        migrations.RunPython(fill_guest_email_key, migrations.RunPython.noop),
+        migrations.AlterIndexTogether(
+            name='reservation',
+            index_together=set([('arrival_date', 'id'), ('hotel', 'arrival_date', 'departure_date'), ('created_time', 'id'), ('guest_email_key', 'departure_date', 'id')]),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import reservation.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservation', '0008_reservation_guest_email_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedReservation',
+            fields=[
+                ('id', models.IntegerField(serialize=False, primary_key=True)),
+                ('guest_name', models.CharField(max_length=255)),
+                ('guest_email', models.EmailField(max_length=254, db_index=True)),
+                ('guest_email_key', reservation.models.FoldedEmailField(default='', source='guest_email', max_length=254, editable=False)),
+                ('arrival_date', models.DateTimeField()),
+                ('departure_date', models.DateTimeField(db_index=True)),
+                ('created_time', models.DateTimeField()),
+                ('last_modified_time', models.DateTimeField()),
+                ('archived_time', models.DateTimeField(auto_now_add=True)),
+                ('hotel', models.ForeignKey(related_name='archived_reservations', to='reservation.Hotel')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='archivedreservation',
+            index_together=set([('arrival_date', 'id'), ('guest_email_key', 'departure_date', 'id'), ('created_time', 'id'), ('hotel', 'arrival_date', 'departure_date')]),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+ACTIVE_INDEXES = (
+    ('reservation_reservation_active_hotel_stay', ('hotel_id', 'arrival_date', 'departure_date')),
+    ('reservation_reservation_active_created', ('created_time', 'id')),
+    ('reservation_reservation_active_arrival', ('arrival_date', 'id')),
+    ('reservation_reservation_active_guest', ('guest_email_key', 'departure_date', 'id')),
+)
+
+# Backends with partial indexes, the others get the same indexes over every row, led by the status column
+PARTIAL_INDEX_VENDORS = ('sqlite', 'postgresql')
+
+
+def create_active_indexes(apps, schema_editor):
+    """
+    Index the confirmed reservations, which Django can not declare, see ReservationQuerySet.active()
+    """
+    table = apps.get_model('reservation', 'Reservation')._meta.db_table
+    quote_name = schema_editor.quote_name
+    partial = schema_editor.connection.vendor in PARTIAL_INDEX_VENDORS
+    for name, columns in ACTIVE_INDEXES:
+        if not partial:
+            columns = ('status',)+columns
+        schema_editor.execute(schema_editor.sql_create_index % {
+            'name': quote_name(name),
+            'table': quote_name(table),
+            'columns': ', '.join(quote_name(column) for column in columns),
+            'extra': " WHERE {0} = 'confirmed'".format(quote_name('status')) if partial else '',
+        })
+
+
+def drop_active_indexes(apps, schema_editor):
+    table = apps.get_model('reservation', 'Reservation')._meta.db_table
+    for name, columns in ACTIVE_INDEXES:
+        schema_editor.execute(schema_editor.sql_delete_index % {
+            'name': schema_editor.quote_name(name),
+            'table': schema_editor.quote_name(table),
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservation', '0009_archived_reservation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedreservation',
+            name='status',
+            field=models.CharField(default='confirmed', max_length=16, choices=[('confirmed', 'Confirmed'), ('cancelled', 'Cancelled'), ('no_show', 'No show')]),
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='status',
+            field=models.CharField(default='confirmed', max_length=16, choices=[('confirmed', 'Confirmed'), ('cancelled', 'Cancelled'), ('no_show', 'No show')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='reservation',
+            index_together=set([]),
+        ),
+        # Indexes of the confirmed reservations, partial where the backend has them
+        migrations.RunPython(create_active_indexes, drop_active_indexes),
+    ]
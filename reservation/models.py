@@ -1,12 +1,61 @@
 # coding=utf-8
 import datetime
-from django.db import models
-from django.db.models import Q
+import heapq
+from collections import defaultdict, deque
+from django.conf import settings
+from django.db import connections, models, transaction, IntegrityError
+from django.db.models import F
 from django.core.validators import MinValueValidator
 from django.core.exceptions import ValidationError
-from reservation.utilities import normalize_date
+from django.utils import timezone
+from reservation import availability_cache, engine, hotel_cache, metrics
+from reservation.transactions import on_commit
+from reservation.utilities import fold_email, normalize_date, stay_nights
+
+NO_AVAILABILITY_MESSAGE = 'Sorry, no reservations available between the following dates {0} and {1}'
+
+
+def delete_batch(queryset, batch_size, fields=()):
+    """
+    Delete up to batch_size rows of a queryset, lowest ids first, with a single DELETE of their ids. Meant to run in a
+    transaction, the rows are locked before they are read.
+    :param fields: names of the fields returned for every deleted row, after its id
+    :return: list of (id,)+fields tuples of the deleted rows, empty once there are none left
+    """
+    rows = list(queryset.select_for_update().order_by('id').values_list('id', *fields)[:batch_size])
+    if rows:
+        queryset.model.objects.filter(id__in=[row[0] for row in rows]).delete()
+    return rows
+
 
 # Create your models here.
+class FoldedEmailField(models.CharField):
+    """
+    Holds the case folded copy of the email address of another field of the model, see utilities.fold_email. It is
+    computed whenever the row is saved, bulk_create included, and not meant to be set directly. QuerySet.update()
+    bypasses it, an update of the source field must set it too.
+
+    Attributes:
+        source: Name of the field holding the email address
+    """
+
+    def __init__(self, source=None, *args, **kwargs):
+        self.source = source
+        kwargs.setdefault('max_length', 254)
+        kwargs.setdefault('editable', False)
+        super(FoldedEmailField, self).__init__(*args, **kwargs)
+
+    def pre_save(self, model_instance, add):
+        value = fold_email(getattr(model_instance, self.source))
+        setattr(model_instance, self.attname, value)
+        return value
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(FoldedEmailField, self).deconstruct()
+        kwargs['source'] = self.source
+        return name, path, args, kwargs
+
+
 class TimeStampedModel(models.Model):
     """
     Base class for any model which needs to maintain created and last_modified time of the objects.
@@ -22,7 +71,7 @@ class TimeStampedModel(models.Model):
     last_modified_time = models.DateTimeField(auto_now=True)
 
 
-class Hotel(models.Model):
+class Hotel(TimeStampedModel):
     """
     Hotel class which maintains attributes of a hotel
     """
@@ -47,64 +96,518 @@ class Hotel(models.Model):
         """
         return (self.room_capacity*self.over_booking_capacity)//100
 
-    def get_available_reservation_slots(self, start_date, end_date):
+    def get_total_capacity(self):
         """
-            Given a start date, get the number of reservation slots available till the end date
+            Get the number of reservations the hotel can hold on a night.
         """
-
         # total capacity is the sum of room_capacity and the number of over bookings allowed.
-        total_capacity = self.room_capacity+self.get_over_booking_capacity()
+        return self.room_capacity+self.get_over_booking_capacity()
+
+    def delete_in_batches(self, batch_size=1000):
+        """
+            Delete the hotel with its reservations, archived reservations and occupancy ledger a batch of rows at a
+            time. delete() would load every related row in memory for the cascade and delete them all in one
+            transaction; here each batch is a single DELETE in its own short transaction, and the hotel row goes
+            last, so a deletion stopped halfway can be run again.
+            The ledger rows are only deleted once the reservations are gone: until then they count more rooms than
+            are held and refuse bookings rather than oversell.
+            :return: generator of (model name, rows of this model deleted so far) after every batch
+        """
+        hotel_id = self.pk
+        for model in (Reservation, ArchivedReservation, HotelOccupancy):
+            deleted = 0
+            while True:
+                with transaction.atomic():
+                    count = len(delete_batch(model.objects.filter(hotel_id=hotel_id), batch_size))
+                if not count:
+                    break
+                deleted += count
+                yield model._meta.model_name, deleted
+
+        self.delete()
+        # Nothing is left to count, this resets the nights of the hotel in the availability engine and cache
+        HotelOccupancy.rebuild(hotel_ids=[hotel_id])
+
+    @classmethod
+    def get_cached(cls, hotel_id):
+        """
+            Get a hotel through the in-process hotel cache, read from the database on a miss.
+            :return: Hotel object, Exception Hotel.DoesNotExist if there is none with this id
+        """
+        return hotel_cache.get_hotel_cache().get(hotel_id)
 
+    @classmethod
+    @metrics.timed_method('availability')
+    def get_available_hotels(cls, start_date, end_date, min_slots=1):
+        """
+            Get the hotels with at least min_slots reservation slots available between the start and end date.
+            The slots are computed and filtered in the query: the total capacity of every hotel less its busiest night,
+            read from the (hotel, night) index of the occupancy ledger. Only the matching hotels are fetched, and a
+            slice of the queryset limits the query.
+            :return: QuerySet of the hotels ordered by id, with the number of slots in their available_slots attribute
+        """
         start_date = normalize_date(start_date, type='arrival')
         end_date = normalize_date(end_date, type='departure')
 
         if not start_date or not end_date:
             raise ValidationError('Arrival or departure dates format is not correct')
 
+        hotels = cls.objects.order_by('id')
+        connection = connections[hotels.db]
+        qn = connection.ops.quote_name
+        hotel_table, ledger_table = qn(cls._meta.db_table), qn(HotelOccupancy._meta.db_table)
+
+        # Same integer division as get_over_booking_capacity(), / of two integers is a decimal on MySQL
+        total_capacity = '{0}.{1}+({0}.{1}*{0}.{2}) {3} 100'.format(
+            hotel_table, qn('room_capacity'), qn('over_booking_capacity'), 'DIV' if connection.vendor == 'mysql' else '/')
+        nights = stay_nights(start_date, end_date)
+        if nights:
+            night_field = HotelOccupancy._meta.get_field('night')
+            busiest_night = 'COALESCE((SELECT MAX({0}.{1}) FROM {0} WHERE {0}.{2} = {3}.{4} AND {0}.{5} >= %s AND ' \
+                            '{0}.{5} <= %s), 0)'.format(ledger_table, qn('occupied'), qn('hotel_id'), hotel_table,
+                                                        qn('id'), qn('night'))
+            params = [night_field.get_db_prep_value(night, connection) for night in (nights[0], nights[-1])]
+        else:
+            busiest_night, params = '0', []
+
+        available_slots = '{0}-{1}'.format(total_capacity, busiest_night)
+        return hotels.extra(select={'available_slots': available_slots}, select_params=params,
+                            where=['{0} >= %s'.format(available_slots)], params=params+[min_slots])
+
+    @metrics.timed_method('availability')
+    def get_available_reservation_slots(self, start_date, end_date, exclude=None):
+        """
+            Given a start date, get the number of reservation slots available till the end date
+            :param exclude: Reservation whose stored stay should not be counted, used when it is being updated
+        """
+
+        total_capacity = self.get_total_capacity()
+
+        start_date = normalize_date(start_date, type='arrival')
+        end_date = normalize_date(end_date, type='departure')
+
+        if not start_date or not end_date:
+            raise ValidationError('Arrival or departure dates format is not correct')
 
-        # Reservation count between specific start and end dates. Filtering the existing reservations based on the given
-        #  start and end date.
-        # Below are the following possibilities. Only one of the below condition will be true for each reservation.
-        # 1. Arrival date is same as start date filter that reservation (or)
-        # 2. Departure date is same as end date filter that reservation (or)
-        # 3. Arrival date < start date and Departure date > start date and departure date < end date (or)
-        # 4. Arrival date < end date and Departure date > end date and Arrival date > start date (or)
-        # 5. Arrival date > start date and Departure date < end date (or)
-        # 6. Arrival date < start date and Departyre date > end date
-        reservation_count = self.hotel_reservations.filter(Q(arrival_date=start_date) |
-                                                           Q(departure_date=end_date) |
-                                                      Q(arrival_date__lt=start_date, departure_date__gt=start_date,
-                                                        departure_date__lt=end_date) |
-                                                      Q(arrival_date__lt=end_date,
-                                                        departure_date__gt=end_date, arrival_date__gt=start_date) |
-                                                      Q(arrival_date__gt=start_date, departure_date__lt=end_date) |
-                                                      Q(arrival_date__lt=start_date, departure_date__gt=end_date)
-                                                      ).count()
+        # A slot is free only if it is free on every night of the stay, so the busiest night in the range decides.
+        occupied = HotelOccupancy.max_occupied(self.pk, start_date, end_date, exclude=exclude)
 
         # gives the total vacancy available for the given range.
-        return total_capacity-reservation_count
+        return total_capacity-occupied
+
+    @metrics.timed_method('availability')
+    def suggest_stays(self, start_date, end_date, count, horizon, min_slots=1, exclude=None):
+        """
+            Find the stays with as many nights as the one between the start and end date, closest to it, which have at
+            least min_slots reservation slots available.
+            Reads the ledger of the hotel once over the horizon and slides the stay over it a night at a time, keeping
+            the busiest night of the stay in a deque of decreasing occupancy: a single pass, whatever the horizon.
+            :param count: maximum number of stays returned
+            :param horizon: number of days the arrival may move earlier or later, never before today
+            :param exclude: Reservation whose stored stay should not be counted, used when it is being updated
+            :return: list of up to count (arrival_date, departure_date, available slots) tuples, closest first and
+                earlier first at the same distance. The stay asked for is left out.
+        """
+        start_date = normalize_date(start_date, type='arrival')
+        end_date = normalize_date(end_date, type='departure')
+
+        if not start_date or not end_date:
+            raise ValidationError('Arrival or departure dates format is not correct')
+
+        arrival_day = start_date.date()
+        length = (end_date.date()-arrival_day).days
+        first_arrival = max(arrival_day-datetime.timedelta(horizon), timezone.now().date())
+        last_arrival = arrival_day+datetime.timedelta(horizon)
+        if length <= 0 or last_arrival < first_arrival:
+            return []
+
+        # Every night a suggested stay may hold, from the first night of the earliest one to the last of the latest
+        nights = stay_nights(first_arrival, last_arrival+datetime.timedelta(length))
+        ledger = HotelOccupancy.get_nights(self.pk, nights[0], nights[-1])
+        excluded_stay = exclude.get_stored_stay() if exclude is not None else None
+        if excluded_stay and excluded_stay[0] == self.pk:
+            for night in stay_nights(excluded_stay[1], excluded_stay[2]):
+                if night in ledger:
+                    ledger[night] -= 1
+        occupancy = [ledger.get(night, 0) for night in nights]
+
+        total_capacity = self.get_total_capacity()
+        candidates = []
+        # Indexes of the nights of the current stay which may still be its busiest one, busiest first
+        busiest = deque()
+        for index, occupied in enumerate(occupancy):
+            while busiest and occupancy[busiest[-1]] <= occupied:
+                busiest.pop()
+            busiest.append(index)
+
+            first_night = index-length+1
+            if first_night < 0:
+                continue
+            if busiest[0] < first_night:
+                busiest.popleft()
+
+            available = total_capacity-occupancy[busiest[0]]
+            arrival = nights[first_night]
+            if available >= min_slots and arrival != arrival_day:
+                candidates.append((abs((arrival-arrival_day).days), arrival, available))
+
+        stays = []
+        for distance, arrival, available in heapq.nsmallest(count, candidates):
+            arrival_date = normalize_date(datetime.datetime.combine(arrival, datetime.time()))
+            departure_date = normalize_date(arrival_date+datetime.timedelta(length), type='departure')
+            if settings.USE_TZ:
+                arrival_date, departure_date = timezone.make_aware(arrival_date), timezone.make_aware(departure_date)
+            stays.append((arrival_date, departure_date, available))
+        return stays
+
+    def get_vacancy_calendar(self, start_date, end_date):
+        """
+            Get the occupancy and vacancy of every night between the start and end date.
+            Reads the overlapping reservations once and sweeps their arrival and departure changes over the nights.
+            Past nights count the reservations archived since as well.
+            :return: list of (night, occupied, available) tuples, one for each night
+        """
+        total_capacity = self.get_total_capacity()
+        reservations = [self.get_overlapping_reservations(start_date, end_date)]
+        if ArchivedReservation.departed_after(normalize_date(start_date, type='arrival')):
+            reservations.append(self.archived_reservations.active().overlapping(
+                normalize_date(start_date, type='arrival'), normalize_date(end_date, type='departure')))
+        nights = stay_nights(normalize_date(start_date), normalize_date(end_date, type='departure'))
+        if not nights:
+            return []
+
+        # changes[i] is the number of stays starting minus the number of stays ending on the i-th night.
+        changes = [0]*(len(nights)+1)
+        for queryset in reservations:
+            for arrival_date, departure_date in queryset.values_list('arrival_date', 'departure_date').iterator():
+                changes[max((arrival_date.date()-nights[0]).days, 0)] += 1
+                changes[min((departure_date.date()-nights[0]).days, len(nights))] -= 1
+
+        calendar = []
+        occupied = 0
+        for night, change in zip(nights, changes):
+            occupied += change
+            calendar.append((night, occupied, total_capacity-occupied))
+        return calendar
+
+    def get_overlapping_reservations(self, start_date, end_date):
+        """
+            Get the reservations of this hotel staying at some point between the start and end date
+        """
+        start_date = normalize_date(start_date, type='arrival')
+        end_date = normalize_date(end_date, type='departure')
+
+        if not start_date or not end_date:
+            raise ValidationError('Arrival or departure dates format is not correct')
+
+        return self.hotel_reservations.active().overlapping(start_date, end_date)
+
+
+class HotelOccupancy(models.Model):
+    """
+    Ledger of the number of reservations holding a room of a hotel on a given night.
+
+    Rows are maintained by Reservation.save(), cancel() and delete(), bulk queryset operations bypass them and
+    must go through HotelOccupancy.apply_stays() (or rebuild the ledger with the rebuild_occupancy command).
+    Both also keep the shared availability engine (reservation/engine.py) in step when it is enabled. Only confirmed
+    reservations hold rooms.
+
+    Attributes:
+        hotel: The hotel the rooms belong to
+        night: The date on which the night starts
+        occupied: Number of reservations staying over that night
+    """
+    class Meta:
+        unique_together = (('hotel', 'night'),)
+        # Covers the cross hotel lookups of a range of nights.
+        index_together = [['night', 'hotel', 'occupied']]
+
+    hotel = models.ForeignKey(Hotel, null=False, blank=False, related_name='hotel_occupancy')
+
+    night = models.DateField(null=False, blank=False)
+
+    occupied = models.IntegerField(null=False, blank=False, default=0)
+
+    def __unicode__(self):
+        """
+        :return: Unicode representation of the HotelOccupancy object
+        """
+        return u'{0} {1}'.format(self.hotel_id, self.night)
+
+    @classmethod
+    def max_occupied(cls, hotel_id, start_date, end_date, exclude=None):
+        """
+        Get the number of rooms held on the busiest night between the start and end date.
+        :param exclude: Reservation whose stored stay is taken out of the counts
+        :return: an integer, 0 when nothing is booked in the range
+        """
+        nights = stay_nights(start_date, end_date)
+        if not nights:
+            return 0
+
+        excluded_nights = []
+        excluded_stay = exclude.get_stored_stay() if exclude is not None else None
+        if excluded_stay and excluded_stay[0] == hotel_id:
+            excluded_nights = stay_nights(excluded_stay[1], excluded_stay[2])
+
+        availability_engine = engine.get_engine()
+        if availability_engine is not None and availability_engine.covers(hotel_id, nights):
+            return availability_engine.max_occupied(hotel_id, nights, excluded_nights)
+
+        cache = availability_cache.get_availability_cache()
+        if cache is not None:
+            occupancy, token = cache.get(hotel_id, nights[0], nights[-1])
+            if occupancy is None:
+                occupancy = cls.get_nights(hotel_id, nights[0], nights[-1])
+                cache.set(hotel_id, nights[0], nights[-1], occupancy, token)
+            # Cached dicts are shared, the exclusion below must not change them
+            occupancy = dict(occupancy)
+        else:
+            occupancy = cls.get_nights(hotel_id, nights[0], nights[-1])
+
+        for night in excluded_nights:
+            if night in occupancy:
+                occupancy[night] -= 1
+
+        return max(occupancy.values()) if occupancy else 0
+
+    @classmethod
+    def get_nights(cls, hotel_id, first_night, last_night):
+        """
+        Get the ledger of a hotel between two nights, both included.
+        :return: dict of datetime.date to the number of rooms held that night, nights without a row are left out
+        """
+        return dict(cls.objects.filter(hotel_id=hotel_id, night__gte=first_night, night__lte=last_night)
+                    .values_list('night', 'occupied'))
+
+    @classmethod
+    def get_changes(cls, stays, delta=1, changes=None):
+        """
+        Get the change in rooms held per hotel and night when the stays are booked (or released).
+        :param stays: iterable of (hotel_id, arrival_date, departure_date) tuples
+        :param delta: 1 when the stays are booked, -1 when they are released
+        :param changes: optional changes to add to, as returned by an earlier call
+        :return: dict of hotel_id to a dict of datetime.date to the change in rooms held that night
+        """
+        if changes is None:
+            changes = defaultdict(lambda: defaultdict(int))
+        for hotel_id, arrival_date, departure_date in stays:
+            for night in stay_nights(arrival_date, departure_date):
+                changes[hotel_id][night] += delta
+        return changes
+
+    @classmethod
+    def apply_stays(cls, stays, delta=1, capacities=None):
+        """
+        Add (or with a negative delta, remove) stays to the ledger.
+        :param stays: iterable of (hotel_id, arrival_date, departure_date) tuples
+        :param delta: 1 when the stays are booked, -1 when they are released
+        :param capacities: see apply_changes()
+        """
+        cls.apply_changes(cls.get_changes(stays, delta), capacities=capacities)
+
+    @classmethod
+    def apply_changes(cls, changes, capacities=None):
+        """
+        Apply changes in rooms held to the ledger, in one transaction.
+        :param changes: dict of hotel_id to a dict of datetime.date to the change in rooms held that night
+        :param capacities: optional dict of hotel_id to the total capacity of the hotel. When given, a night only takes
+            more rooms if it stays within the capacity and ValidationError is raised, with nothing applied, if any
+            night can not. The check is part of the UPDATE, so concurrent bookings of the same nights wait on each
+            other's row locks and can not oversell, while other hotels and nights proceed in parallel.
+        """
+        with transaction.atomic():
+            for hotel_id, nights in changes.items():
+                booked_nights = [night for night, change in nights.items() if change > 0]
+                if booked_nights:
+                    cls._add_missing_nights(hotel_id, booked_nights)
+
+                # Nights sharing the same change are updated together, a single stay needs one UPDATE.
+                by_change = defaultdict(list)
+                for night, change in nights.items():
+                    if change:
+                        by_change[change].append(night)
+                for change, changed_nights in by_change.items():
+                    ledger = cls.objects.filter(hotel_id=hotel_id, night__in=changed_nights)
+                    if capacities is not None and change > 0:
+                        ledger = ledger.filter(occupied__lte=capacities[hotel_id]-change)
+                    updated = ledger.update(occupied=F('occupied')+change)
+
+                    if capacities is not None and change > 0 and updated != len(changed_nights):
+                        raise ValidationError(NO_AVAILABILITY_MESSAGE.format(min(changed_nights),
+                                                                             max(changed_nights)+datetime.timedelta(1)),
+                                              code='no_availability')
+
+        availability_engine = engine.get_engine()
+        if availability_engine is not None:
+            # Other workers read the engine without a transaction, they must not see changes which may roll back
+            on_commit(lambda: availability_engine.apply(changes))
+
+        cache = availability_cache.get_availability_cache()
+        if cache is not None:
+            changed_nights = dict((hotel_id, [night for night, change in nights.items() if change])
+                                  for hotel_id, nights in changes.items())
+            cache.invalidate(changed_nights)
+            # Readers of the former counts between now and the commit may have cached them again
+            on_commit(lambda: cache.invalidate(changed_nights))
+
+    @classmethod
+    def _add_missing_nights(cls, hotel_id, nights):
+        """
+        Create empty ledger rows for the nights the hotel does not have one yet.
+        """
+        nights = sorted(nights)
+        existing = set(cls.objects.filter(hotel_id=hotel_id, night__gte=nights[0], night__lte=nights[-1])
+                       .values_list('night', flat=True))
+        missing = [cls(hotel_id=hotel_id, night=night) for night in nights if night not in existing]
+        if not missing:
+            return
+
+        try:
+            with transaction.atomic():
+                cls.objects.bulk_create(missing)
+        except IntegrityError:
+            # A concurrent booking created some of these nights first.
+            for row in missing:
+                cls.objects.get_or_create(hotel_id=hotel_id, night=row.night)
+
+    @classmethod
+    def count_nights(cls, hotel_ids=None):
+        """
+        Count the confirmed reservations staying over each night from the Reservation rows.
+        :param hotel_ids: optional list of hotel ids to count, all hotels otherwise
+        :return: dict of (hotel_id, datetime.date) to the number of reservations staying that night
+        """
+        reservations = Reservation.objects.active()
+        if hotel_ids is not None:
+            reservations = reservations.filter(hotel_id__in=hotel_ids)
+
+        counts = defaultdict(int)
+        for hotel_id, arrival_date, departure_date in reservations.values_list(
+                'hotel_id', 'arrival_date', 'departure_date').iterator():
+            for night in stay_nights(arrival_date, departure_date):
+                counts[(hotel_id, night)] += 1
+        return counts
+
+    @classmethod
+    def rebuild(cls, hotel_ids=None, batch_size=None):
+        """
+        Recompute the ledger, and the availability engine when it is enabled, from the Reservation rows.
+        :param hotel_ids: optional list of hotel ids to rebuild, all hotels otherwise
+        """
+        counts = cls.count_nights(hotel_ids)
+
+        ledger = cls.objects.all()
+        if hotel_ids is not None:
+            ledger = ledger.filter(hotel_id__in=hotel_ids)
+
+        with transaction.atomic():
+            ledger.delete()
+            cls.objects.bulk_create([cls(hotel_id=hotel_id, night=night, occupied=occupied)
+                                     for (hotel_id, night), occupied in counts.items()], batch_size=batch_size)
+
+        availability_engine = engine.get_engine()
+        if availability_engine is not None:
+            # Counted again under the lock of the engine, bookings committed since the first count are not lost
+            availability_engine.rebuild(lambda: cls.count_nights(hotel_ids), hotel_ids)
+
+        cache = availability_cache.get_availability_cache()
+        if cache is not None:
+            cache.invalidate_hotels(hotel_ids)
+            on_commit(lambda: cache.invalidate_hotels(hotel_ids))
+
+
+class ReservationQuerySet(models.QuerySet):
+    """
+    QuerySet for Reservation with the date range lookups used across the project
+    """
+
+    def overlapping(self, start_date, end_date):
+        """
+        Reservations holding a room at some point between the start and end date.
+
+        Two stays overlap when each starts before the other one ends. Stays touching only at the edges (departure at
+        10AM, next arrival at 11AM the same day) do not overlap. Backed by the (hotel, arrival_date, departure_date)
+        index when filtered on a hotel.
+        """
+        return self.filter(arrival_date__lt=end_date, departure_date__gt=start_date)
+
+    def of_guest(self, email):
+        """
+        Reservations made under an email address, whatever its case. Backed by the (guest_email_key, departure_date,
+        id) index.
+        """
+        return self.filter(guest_email_key=fold_email(email))
+
+    def active(self):
+        """
+        Reservations holding their rooms, the confirmed ones. Backed by the partial indexes of the reservation table
+        on its confirmed rows (migration 0010). The condition is written out in the SQL as in the indexes: the query
+        planners only use a partial index when the query holds its condition, which a bound parameter does not.
+        """
+        quote_name = connections[self.db].ops.quote_name
+        return self.extra(where=["{0}.{1} = '{2}'".format(quote_name(self.model._meta.db_table), quote_name('status'),
+                                                          Reservation.CONFIRMED)])
+
+    def cancel_in_batches(self, batch_size=1000, status=None):
+        """
+        Cancel the confirmed reservations a batch at a time, each batch with a single UPDATE in its own short
+        transaction locking only its rows, so that bookings go on in between. The nights of a batch are released from
+        the occupancy ledger in the same transaction, and its last modified time is set for the conditional requests.
+        :param status: status the reservations are moved to, Reservation.CANCELLED by default
+        :return: generator of the number of reservations cancelled by every batch, exhausted once there are none left
+        """
+        while True:
+            with transaction.atomic():
+                rows = list(self.active().select_for_update().order_by('id').values_list(
+                    'id', 'hotel_id', 'arrival_date', 'departure_date')[:batch_size])
+                if rows:
+                    Reservation.objects.filter(id__in=[row[0] for row in rows]).update(
+                        status=status or Reservation.CANCELLED, last_modified_time=timezone.now())
+                    HotelOccupancy.apply_stays([row[1:] for row in rows], delta=-1)
+            if not rows:
+                return
+            yield len(rows)
 
 
 class Reservation(TimeStampedModel):
     """
     Reservation class to keep track of reservations made by a Guest
+
+    The (hotel, arrival_date, departure_date), (created_time, id), (arrival_date, id) and (guest_email_key,
+    departure_date, id) indexes only hold the confirmed rows. Django can not declare partial indexes, migration 0010
+    creates them, led by the status column over every row on backends without partial indexes: a later migration
+    remaking the table on sqlite drops them and must create them again. The (field, id)
+    ones back the cursor pagination of the reservation list, the guest_email_key one the upcoming and past stays of a
+    guest, see ReservationQuerySet.active().
     """
+    CONFIRMED = 'confirmed'
+    CANCELLED = 'cancelled'
+    NO_SHOW = 'no_show'
+    STATUS_CHOICES = ((CONFIRMED, 'Confirmed'), (CANCELLED, 'Cancelled'), (NO_SHOW, 'No show'))
+
+    objects = ReservationQuerySet.as_manager()
 
     # Guest's Name for whom the reservation was made
     guest_name = models.CharField(max_length=255, null=False, blank=False)
 
-    # Guest's email address
-    guest_email = models.EmailField(null=False, blank=False)
+    # Guest's email address, indexed for the guest_email filter of the reservation list
+    guest_email = models.EmailField(null=False, blank=False, db_index=True)
+
+    # Case folded guest_email, for the lookups of a guest's reservations whatever case the address was typed in
+    guest_email_key = FoldedEmailField(source='guest_email', default='')
 
     # Arrival date
     arrival_date = models.DateTimeField(null=False, blank=False)
 
-    # Departure date
-    departure_date = models.DateTimeField(null=False, blank=False)
+    # Departure date, indexed for the departure range and date window filters of the reservation list
+    departure_date = models.DateTimeField(null=False, blank=False, db_index=True)
 
     # Each reservation should be mapped to a hotel
     hotel = models.ForeignKey(Hotel, null=False, blank=False, related_name='hotel_reservations')
 
+    # Only confirmed reservations hold a room, cancelled and no-show ones are kept for the record
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=CONFIRMED)
 
     def __unicode__(self):
         """
@@ -112,4 +615,166 @@ class Reservation(TimeStampedModel):
         """
         return unicode(self.pk)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remember the stay as it is stored, so that save() knows which nights to release from the ledger.
+        """
+        instance = super(Reservation, cls).from_db(db, field_names, values)
+        if set(('hotel_id', 'arrival_date', 'departure_date', 'status')).issubset(field_names):
+            instance._stored_stay = instance.get_stay()
+        return instance
+
+    def get_stay(self):
+        """
+        :return: (hotel_id, arrival_date, departure_date) tuple of the current field values, None if the reservation
+            is not confirmed and holds no room
+        """
+        if self.status != self.CONFIRMED:
+            return None
+        return self.hotel_id, self.arrival_date, self.departure_date
+
+    def get_stored_stay(self):
+        """
+        :return: (hotel_id, arrival_date, departure_date) tuple as stored in the database, None if not saved yet or
+            not confirmed
+        """
+        if not hasattr(self, '_stored_stay'):
+            self._stored_stay = None
+            if self.pk:
+                self._stored_stay = Reservation.objects.active().filter(pk=self.pk).values_list(
+                    'hotel_id', 'arrival_date', 'departure_date').first()
+        return self._stored_stay
+
+    def save(self, *args, **kwargs):
+        """
+        Save the reservation and move its nights in the hotel occupancy ledger in the same transaction.
+        :param check_availability: when True, raise ValidationError and save nothing if the hotel does not have a
+            slot left on every new night of the stay. Safe against concurrent bookings, see HotelOccupancy.apply_changes
+        """
+        check_availability = kwargs.pop('check_availability', False)
+
+        with transaction.atomic():
+            stored_stay = self.get_stored_stay()
+            super(Reservation, self).save(*args, **kwargs)
+
+            # Nights the reservation keeps cancel out, only released and newly taken nights change the ledger.
+            stay = self.get_stay()
+            changes = HotelOccupancy.get_changes([stay] if stay else [])
+            if stored_stay:
+                HotelOccupancy.get_changes([stored_stay], delta=-1, changes=changes)
+
+            capacities = {self.hotel_id: self.hotel.get_total_capacity()} if check_availability else None
+            HotelOccupancy.apply_changes(changes, capacities=capacities)
+            self._stored_stay = stay
+
+    def delete(self, *args, **kwargs):
+        """
+        Delete the reservation and release its nights from the hotel occupancy ledger in the same transaction.
+        """
+        with transaction.atomic():
+            stored_stay = self.get_stored_stay()
+            super(Reservation, self).delete(*args, **kwargs)
+
+            if stored_stay:
+                HotelOccupancy.apply_stays([stored_stay], delta=-1)
+            self._stored_stay = None
+
+    def cancel(self, status=None):
+        """
+        Cancel the reservation with a single row UPDATE of its status and last modified time, and release its nights
+        from the hotel occupancy ledger in the same transaction. The row is kept.
+        :param status: status the reservation is moved to, CANCELLED by default, NO_SHOW for a guest who did not come
+        :return: True, False if the reservation was not confirmed any more and nothing changed
+        """
+        status = status or self.CANCELLED
+        now = timezone.now()
+        with transaction.atomic():
+            stored_stay = self.get_stored_stay()
+            # Only one of two concurrent cancellations finds the row still confirmed and releases the nights
+            cancelled = Reservation.objects.active().filter(pk=self.pk).update(status=status, last_modified_time=now)
+            if cancelled and stored_stay:
+                HotelOccupancy.apply_stays([stored_stay], delta=-1)
+        if cancelled:
+            self.status, self.last_modified_time = status, now
+            self._stored_stay = None
+        return bool(cancelled)
+
+
+class ArchivedReservation(models.Model):
+    """
+    Reservation which departed long ago, moved out of the Reservation table by the archive_reservations command so
+    that the lists and availability counts only go through current stays. Mirrors the fields and indexes of
+    Reservation, the indexes over every row whatever its status, and keeps its id, created and last modified times.
+    Archived reservations are read only, they no longer hold a room in the occupancy ledger.
+
+    Attributes:
+        archived_time: The time when the reservation was moved to the archive
+    """
+    class Meta:
+        index_together = [['hotel', 'arrival_date', 'departure_date'], ['created_time', 'id'], ['arrival_date', 'id'],
+                          ['guest_email_key', 'departure_date', 'id']]
+
+    objects = ReservationQuerySet.as_manager()
+
+    id = models.IntegerField(primary_key=True)
+
+    guest_name = models.CharField(max_length=255, null=False, blank=False)
+
+    guest_email = models.EmailField(null=False, blank=False, db_index=True)
+
+    guest_email_key = FoldedEmailField(source='guest_email', default='')
+
+    arrival_date = models.DateTimeField(null=False, blank=False)
+
+    departure_date = models.DateTimeField(null=False, blank=False, db_index=True)
+
+    hotel = models.ForeignKey(Hotel, null=False, blank=False, related_name='archived_reservations')
+
+    status = models.CharField(max_length=16, choices=Reservation.STATUS_CHOICES, default=Reservation.CONFIRMED)
+
+    # Copied from the reservation, not set on save
+    created_time = models.DateTimeField()
+
+    last_modified_time = models.DateTimeField()
+
+    archived_time = models.DateTimeField(auto_now_add=True)
+
+    # Reservation fields copied to the archive
+    copied_fields = ('id', 'guest_name', 'guest_email', 'arrival_date', 'departure_date', 'hotel_id', 'status',
+                     'created_time', 'last_modified_time')
+
+    def __unicode__(self):
+        """
+        :return: Unicode representation of the ArchivedReservation object
+        """
+        return unicode(self.pk)
+
+    @classmethod
+    def departed_after(cls, date):
+        """
+        Tell if some archived reservation departs after a date, a single lookup on the departure_date index. Reads of
+        the stays overlapping a range which starts before it must read the archive too.
+        """
+        return cls.objects.filter(departure_date__gt=date).exists()
+
+    @classmethod
+    def archive(cls, departed_before, batch_size=1000):
+        """
+        Move a batch of the reservations which departed before a date to the archive, and release their nights from
+        the occupancy ledger, in one short transaction. Only the rows of the batch are locked.
+        :param departed_before: datetime, reservations departing strictly before it are archived
+        :param batch_size: maximum number of reservations moved
+        :return: the number of reservations moved, 0 once there are none left to archive
+        """
+        with transaction.atomic():
+            rows = list(Reservation.objects.select_for_update().filter(departure_date__lt=departed_before)
+                        .order_by('departure_date', 'id').values(*cls.copied_fields)[:batch_size])
+            if not rows:
+                return 0
 
+            cls.objects.bulk_create([cls(**row) for row in rows])
+            Reservation.objects.filter(id__in=[row['id'] for row in rows]).delete()
+            HotelOccupancy.apply_stays([(row['hotel_id'], row['arrival_date'], row['departure_date']) for row in rows
+                                        if row['status'] == Reservation.CONFIRMED], delta=-1)
+        return len(rows)
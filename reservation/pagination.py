@@ -0,0 +1,97 @@
+import base64
+import json
+from collections import OrderedDict
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.utils import six
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination ordered by (ordering field, id), without a total count.
+
+    The cursor is an opaque token holding the key of the last row of the previous page, the next page is read from
+    that key on with an index range scan on (ordering field, id), so every page costs the same as the first one.
+    Clients pick the ordering field with the order_by query parameter and follow the next links.
+    """
+    cursor_query_param = 'cursor'
+    order_query_param = 'order_by'
+    orderings = ('created_time', 'arrival_date')
+
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = api_settings.PAGE_SIZE
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = request.query_params.get(self.order_query_param, self.orderings[0])
+        if self.ordering not in self.orderings:
+            raise ValidationError({self.order_query_param: ['Invalid ordering, expected one of {0}'.format(
+                ', '.join(self.orderings))]})
+
+        queryset = queryset.order_by(self.ordering, 'id')
+        key = self.decode_cursor(request)
+        if key is not None:
+            value, pk = key
+            try:
+                value = queryset.model._meta.get_field(self.ordering).to_python(value)
+            except (DjangoValidationError, TypeError, ValueError):
+                value = None
+            if value is None:
+                raise ValidationError({self.cursor_query_param: [self.invalid_cursor_message]})
+            # Start the range scan at the last value, then skip the rows of that value already returned.
+            queryset = queryset.filter(**{self.ordering+'__gte': value})\
+                .exclude(**{self.ordering: value, 'id__lte': pk})
+
+        # Reading one extra row tells whether there is a next page, no COUNT(*) is needed.
+        results = list(queryset[:self.page_size+1])
+        self.has_next = len(results) > self.page_size
+        results = results[:self.page_size]
+        self.last_key = (getattr(results[-1], self.ordering), results[-1].pk) if results else None
+        return results
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data)
+        ]))
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(request.query_params[self.page_size_query_param], strict=True,
+                                 cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.last_key))
+
+    def encode_cursor(self, key):
+        value, pk = key
+        token = json.dumps([value.isoformat() if hasattr(value, 'isoformat') else value, pk])
+        return base64.urlsafe_b64encode(token.encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, request):
+        """
+        :return: (ordering field value, id) of the last row of the previous page, None on the first page. The value is
+            the text encode_cursor() wrote, the id an integer, anything else is refused.
+        """
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii'))
+        except (TypeError, ValueError, UnicodeError):
+            value = pk = None
+        if not isinstance(value, six.string_types) or not isinstance(pk, six.integer_types) or isinstance(pk, bool):
+            raise ValidationError({self.cursor_query_param: [self.invalid_cursor_message]})
+        return value, pk
@@ -0,0 +1,73 @@
+"""
+Database routing of the read only API requests to a replica.
+
+Views decorate their read only handlers with read_from_replica. While such a handler runs, reads go to the database
+alias in settings.REPLICA_DATABASE, until anything is written: from then on the rest of the handler reads from the
+primary ('default') as well, so that it sees its own writes. Everything else always uses the primary.
+"""
+import threading
+from functools import wraps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+_state = threading.local()
+
+
+class ReplicaRouter(object):
+    """
+    Router sending the reads of a read_from_replica block to the replica, see the module docstring.
+    """
+
+    def db_for_read(self, model, **hints):
+        if getattr(_state, 'replica', None) and not getattr(_state, 'pinned', False):
+            return _state.replica
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # Reads following a write must see it, the replica may not have it yet.
+        _state.pinned = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model=None, **hints):
+        # The replica needs the schema too when it is a local database (manage.py migrate --database replica).
+        return True
+
+
+def get_replica_alias():
+    """
+    :return: the database alias read only requests are sent to, 'default' when no replica is configured
+    """
+    return getattr(settings, 'REPLICA_DATABASE', None) or DEFAULT_DB_ALIAS
+
+
+class use_replica(object):
+    """
+    Context manager routing the reads made inside of it to the replica, until the first write.
+    """
+
+    def __init__(self, alias=None):
+        self.alias = alias or get_replica_alias()
+
+    def __enter__(self):
+        self.previous = getattr(_state, 'replica', None), getattr(_state, 'pinned', False)
+        _state.replica, _state.pinned = self.alias, False
+        return self.alias
+
+    def __exit__(self, *exc_info):
+        _state.replica, _state.pinned = self.previous
+
+
+def read_from_replica(view_method):
+    """
+    Decorator for the read only handlers of a view, runs them in a transaction on the replica with use_replica.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        with use_replica() as alias:
+            with transaction.atomic(using=alias):
+                return view_method(self, request, *args, **kwargs)
+    return wrapper
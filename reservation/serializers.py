@@ -1,9 +1,46 @@
 import datetime
+from collections import defaultdict, OrderedDict
 from rest_framework import serializers
-from reservation.models import Hotel, Reservation
-from reservation.utilities import normalize_date, datetime_object
+from rest_framework.reverse import reverse
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.utils import timezone
+from rest_framework.settings import api_settings
+from reservation import hotel_cache, metrics
+from reservation.models import Hotel, HotelOccupancy, Reservation, NO_AVAILABILITY_MESSAGE
+from reservation.utilities import normalize_date, datetime_object, stay_nights
 
-class HotelSerializer(serializers.ModelSerializer):
+# Longest window of nights a vacancy calendar can be asked for.
+CALENDAR_MAX_NIGHTS = 366
+
+# Largest number of stays /api/hotels/<pk>/suggest can be asked for.
+SUGGESTION_MAX_COUNT = 10
+
+class TimedListSerializer(serializers.ListSerializer):
+    """
+    ListSerializer counting the time spent building its representation in the serializer phase of the request
+    metrics, see reservation.metrics
+    """
+
+    @property
+    def data(self):
+        with metrics.timed('serializer'):
+            return super(TimedListSerializer, self).data
+
+
+class TimedDataMixin(object):
+    """
+    Serializer mixin counting the time spent building its representation in the serializer phase of the request
+    metrics. Its Meta should set list_serializer_class to TimedListSerializer for many=True.
+    """
+
+    @property
+    def data(self):
+        with metrics.timed('serializer'):
+            return super(TimedDataMixin, self).data
+
+
+class HotelSerializer(TimedDataMixin, serializers.ModelSerializer):
     """
     Serializer class for Hotel Model
     """
@@ -12,12 +49,180 @@ class HotelSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Hotel
+        list_serializer_class = TimedListSerializer
         fields = (
             'url', 'id', 'name', 'room_capacity', 'over_booking_capacity'
         )
 
 
-class ReservationSerializer(serializers.ModelSerializer):
+class HotelAvailabilitySerializer(HotelSerializer):
+    """
+    Serializer class for a Hotel along with the reservation slots available for the requested dates
+    """
+    available_slots = serializers.IntegerField(read_only=True)
+
+    class Meta(HotelSerializer.Meta):
+        fields = HotelSerializer.Meta.fields+('available_slots',)
+
+
+class AvailabilityQuerySerializer(serializers.Serializer):
+    """
+    Serializer class for the query parameters of an availability search
+    """
+    arrival = serializers.DateTimeField()
+    departure = serializers.DateTimeField()
+    min_slots = serializers.IntegerField(min_value=1, default=1)
+
+    def validate_arrival(self, value):
+        return normalize_date(value)
+
+    def validate_departure(self, value):
+        return normalize_date(value, type='departure')
+
+    def validate(self, data):
+        if data['departure'] <= data['arrival']:
+            raise serializers.ValidationError('Departure date cannot be prior or same as the arrival date.')
+        return data
+
+
+class SuggestionQuerySerializer(AvailabilityQuerySerializer):
+    """
+    Serializer class for the query parameters of a stay suggestion, an availability search plus the number of stays
+    """
+    count = serializers.IntegerField(min_value=1, max_value=SUGGESTION_MAX_COUNT, default=settings.SUGGESTION_COUNT)
+
+
+class StaySuggestionSerializer(serializers.Serializer):
+    """
+    Serializer class for a stay suggested by Hotel.suggest_stays, given as an (arrival_date, departure_date, available)
+    tuple
+    """
+    arrival_date = serializers.DateTimeField(read_only=True)
+    departure_date = serializers.DateTimeField(read_only=True)
+    available = serializers.IntegerField(read_only=True)
+
+    def to_representation(self, instance):
+        arrival_date, departure_date, available = instance
+        return super(StaySuggestionSerializer, self).to_representation(
+            {'arrival_date': arrival_date, 'departure_date': departure_date, 'available': available})
+
+
+class CalendarQuerySerializer(serializers.Serializer):
+    """
+    Serializer class for the from and to query parameters of a vacancy calendar
+    """
+    to = serializers.DateTimeField()
+
+    def get_fields(self):
+        # "from" is a python keyword and can not be declared as a class attribute
+        fields = super(CalendarQuerySerializer, self).get_fields()
+        fields['from'] = serializers.DateTimeField()
+        return fields
+
+    def validate_from(self, value):
+        return normalize_date(value)
+
+    def validate_to(self, value):
+        return normalize_date(value, type='departure')
+
+    def validate(self, data):
+        if data['to'] <= data['from']:
+            raise serializers.ValidationError('To date cannot be prior or same as the from date.')
+        if (data['to'].date()-data['from'].date()).days > CALENDAR_MAX_NIGHTS:
+            raise serializers.ValidationError('Calendar can not span more than {0} nights.'.format(CALENDAR_MAX_NIGHTS))
+        return data
+
+
+class OccupancyQuerySerializer(CalendarQuerySerializer):
+    """
+    Serializer class for the query parameters of the occupancy report of several hotels, the from and to of a
+    calendar and optional hotel ids, every hotel when there are none
+    """
+    hotel = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False)
+
+
+class ExportQuerySerializer(serializers.Serializer):
+    """
+    Serializer class for the query parameters of a reservation export, every filter is optional
+    """
+    output = serializers.ChoiceField(choices=('ndjson', 'csv'), default='ndjson')
+    hotel = serializers.IntegerField(required=False)
+    to = serializers.DateTimeField(required=False)
+
+    def get_fields(self):
+        # "from" is a python keyword and can not be declared as a class attribute
+        fields = super(ExportQuerySerializer, self).get_fields()
+        fields['from'] = serializers.DateTimeField(required=False)
+        return fields
+
+    def validate_from(self, value):
+        return normalize_date(value)
+
+    def validate_to(self, value):
+        return normalize_date(value, type='departure')
+
+    def validate(self, data):
+        if 'from' in data and 'to' in data and data['to'] <= data['from']:
+            raise serializers.ValidationError('To date cannot be prior or same as the from date.')
+        return data
+
+
+class CancelQuerySerializer(serializers.Serializer):
+    """
+    Serializer class for the status query parameter of a reservation cancellation, no_show for a guest who did not come
+    """
+    status = serializers.ChoiceField(choices=(Reservation.CANCELLED, Reservation.NO_SHOW), default=Reservation.CANCELLED)
+
+
+class GuestReservationsQuerySerializer(serializers.Serializer):
+    """
+    Serializer class for the email and limit of a guest reservations lookup
+    """
+    email = serializers.EmailField()
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
+
+
+class CachedHotelField(serializers.PrimaryKeyRelatedField):
+    """
+    Hotel primary key field resolved through the in-process hotel cache, see Hotel.get_cached
+    """
+
+    def to_internal_value(self, data):
+        try:
+            return Hotel.get_cached(int(data))
+        except Hotel.DoesNotExist:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
+class BulkCancelSerializer(serializers.Serializer):
+    """
+    Serializer class for the body of a bulk cancellation, the reservations of a hotel holding a room between the from
+    and to dates
+    """
+    hotel = CachedHotelField(queryset=Hotel.objects.all())
+    to = serializers.DateTimeField()
+
+    def get_fields(self):
+        # "from" is a python keyword and can not be declared as a class attribute
+        fields = super(BulkCancelSerializer, self).get_fields()
+        fields['from'] = serializers.DateTimeField()
+        return fields
+
+    def validate_from(self, value):
+        return normalize_date(value)
+
+    def validate_to(self, value):
+        return normalize_date(value, type='departure')
+
+    def validate(self, data):
+        if data['to'] <= data['from']:
+            raise serializers.ValidationError('To date cannot be prior or same as the from date.')
+        return data
+
+
+class ReservationSerializer(TimedDataMixin, serializers.ModelSerializer):
     """
     Serializer class for Reservation Model
     """
@@ -26,10 +231,13 @@ class ReservationSerializer(serializers.ModelSerializer):
     # Including the nested serializer for hotel, we always want to show hotel information along with the reservation
     hotel_data = HotelSerializer(source='hotel', read_only=True)
 
+    hotel = CachedHotelField(queryset=Hotel.objects.all())
+
     select_related_fields = ['hotel', 'hotel__name', 'hotel__room_capacity', 'hotel__over_booking_capacity']
 
     class Meta:
         model = Reservation
+        list_serializer_class = TimedListSerializer
         fields = (
             'url', 'id', 'guest_name', 'guest_email', 'arrival_date', 'departure_date',
             'hotel', 'hotel_data'
@@ -69,27 +277,316 @@ class ReservationSerializer(serializers.ModelSerializer):
     #     return value
 
 
-    def validate(self, data):
+    def create(self, validated_data):
+        reservation = Reservation(**validated_data)
+        self.book(reservation)
+        return reservation
+
+    def update(self, instance, validated_data):
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        self.book(instance)
+        return instance
+
+    def book(self, reservation):
         """
-        Validate on the Reservation Serializer data
-        :param instance: instance of Reservation serializer data
-        :return: Exception if validation fails else return validated data
+        Save the reservation, taking its nights only if the hotel still has a slot left on each of them.
+        validate() already checked the availability, this catches concurrent bookings which took the last slot since.
+        :param reservation: Reservation object to save
+        :return: Exception if there is no availability left
+        """
+        try:
+            reservation.save(check_availability=True)
+        except DjangoValidationError:
+            raise self.no_availability(reservation.hotel, reservation.arrival_date, reservation.departure_date,
+                                       exclude=reservation)
+
+    def no_availability(self, hotel, start_date, end_date, exclude=None):
+        """
+        Get the error refusing a stay for lack of room, with the closest stays of the same length the hotel can still
+        take in its suggestions, see Hotel.suggest_stays.
+        :param exclude: Reservation being updated, its stored stay does not count against the suggestions
+        :return: serializers.ValidationError to raise
+        """
+        stays = hotel.suggest_stays(start_date, end_date, settings.SUGGESTION_COUNT, settings.SUGGESTION_HORIZON_DAYS,
+                                    exclude=exclude)
+        # The number of slots is left out, error details are all turned into strings
+        suggestions = [OrderedDict((name, value) for name, value in suggestion.items() if name != 'available')
+                       for suggestion in StaySuggestionSerializer(stays, many=True).data]
+        return serializers.ValidationError({
+            api_settings.NON_FIELD_ERRORS_KEY: [NO_AVAILABILITY_MESSAGE.format(start_date, end_date)],
+            'suggestions': suggestions
+        })
+
+    def get_stay_dates(self, data):
+        """
+        Get the arrival and departure dates of the reservation, falling back to the instance ones on partial updates
+        :return: (arrival_date, departure_date) tuple, Exception if the departure is not after the arrival
         """
-        error_list = []
         start_date = data.get('arrival_date', datetime_object(self.instance.arrival_date) if self.instance else None)
         end_date = data.get('departure_date', datetime_object(self.instance.departure_date) if self.instance else None)
 
         if end_date <= start_date:
             raise serializers.ValidationError('Departure date cannot be prior or same as the arrival date.')
 
+        return start_date, end_date
+
+    def validate(self, data):
+        """
+        Validate on the Reservation Serializer data
+        :param instance: instance of Reservation serializer data
+        :return: Exception if validation fails else return validated data
+        """
+        start_date, end_date = self.get_stay_dates(data)
+
         if self.instance:
-            reservation_availability = self.instance.hotel.get_available_reservation_slots(start_date, end_date)
+            # The reservation being updated should not compete with itself for the nights it already holds.
+            hotel = self.instance.hotel
+            reservation_availability = hotel.get_available_reservation_slots(start_date, end_date,
+                                                                             exclude=self.instance)
         else:
-            hotel = self.initial_data.get('hotel')
-            hotel = Hotel.objects.get(id=hotel)
+            # Already resolved by the hotel field
+            hotel = data['hotel']
             reservation_availability = hotel.get_available_reservation_slots(start_date, end_date)
 
         if reservation_availability <= 0:
-            raise serializers.ValidationError('Sorry, no reservations available between the following dates {0} and {1}'.format(start_date, end_date))
+            raise self.no_availability(hotel, start_date, end_date, exclude=self.instance)
+
+        return data
+
+
+class ReservationReadSerializer(TimedDataMixin, serializers.BaseSerializer):
+    """
+    Read only serializer for Reservation, giving the same representation as ReservationSerializer for a fraction of
+    its cost. Used by the list and detail GETs.
+
+    The urls are built from templates reversed once per response instead of once per row, and the hotel_data of a
+    hotel is built once per response and shared by all of its reservations. With many=True one instance of this class
+    serializes every row, so both caches last for the whole response.
+    """
+    # Stands in for the primary key while reversing the url templates
+    pk_placeholder = 7777777777
+
+    class Meta:
+        list_serializer_class = TimedListSerializer
+
+    def __init__(self, *args, **kwargs):
+        super(ReservationReadSerializer, self).__init__(*args, **kwargs)
+        self.url_templates = {}
+        self.hotels = {}
+        self.datetime_field = serializers.DateTimeField()
+
+    def get_url(self, view_name, pk):
+        if view_name not in self.url_templates:
+            url = reverse(view_name, kwargs={'pk': self.pk_placeholder}, request=self.context.get('request'),
+                          format=self.context.get('format'))
+            self.url_templates[view_name] = url.rpartition(str(self.pk_placeholder))[::2]
+        prefix, suffix = self.url_templates[view_name]
+        return '{0}{1}{2}'.format(prefix, pk, suffix)
+
+    def get_hotel_data(self, hotel):
+        if hotel.pk not in self.hotels:
+            self.hotels[hotel.pk] = OrderedDict([
+                ('url', self.get_url('reservation:hotel-detail', hotel.pk)),
+                ('id', hotel.pk),
+                ('name', hotel.name),
+                ('room_capacity', hotel.room_capacity),
+                ('over_booking_capacity', hotel.over_booking_capacity)
+            ])
+        return self.hotels[hotel.pk]
+
+    def to_representation(self, instance):
+        return OrderedDict([
+            ('url', self.get_url('reservation:reservation-detail', instance.pk)),
+            ('id', instance.pk),
+            ('guest_name', instance.guest_name),
+            ('guest_email', instance.guest_email),
+            ('arrival_date', self.datetime_field.to_representation(instance.arrival_date)),
+            ('departure_date', self.datetime_field.to_representation(instance.departure_date)),
+            ('hotel', instance.hotel_id),
+            ('hotel_data', self.get_hotel_data(instance.hotel))
+        ])
+
+
+class ArchivedReservationReadSerializer(ReservationReadSerializer):
+    """
+    Read only serializer for ArchivedReservation, the representation of ReservationReadSerializer with the status of
+    the reservation and the time it was archived, its url pointing to the archive.
+    """
+
+    def to_representation(self, instance):
+        data = super(ArchivedReservationReadSerializer, self).to_representation(instance)
+        data['url'] = '{0}?archived=true'.format(data['url'])
+        data['status'] = instance.status
+        data['archived_time'] = self.datetime_field.to_representation(instance.archived_time)
+        return data
+
+
+class BatchHotelField(serializers.PrimaryKeyRelatedField):
+    """
+    Hotel primary key field resolved from the hotels fetched once for a whole batch, context['hotels'] maps the ids
+    to the Hotel objects.
+    """
+
+    def to_internal_value(self, data):
+        try:
+            return self.context['hotels'][int(data)]
+        except (KeyError, TypeError, ValueError):
+            self.fail('does_not_exist', pk_value=data)
+
+
+class BulkReservationItemSerializer(ReservationSerializer):
+    """
+    Serializer class for one reservation of a batch, availability is checked for the whole batch by ReservationBatch
+    """
+    hotel = BatchHotelField(queryset=Hotel.objects.all())
+
+    def validate(self, data):
+        self.get_stay_dates(data)
+        return data
+
+
+class ReservationBatch(object):
+    """
+    Validates a batch of reservations together and creates the accepted ones with a single bulk insert.
+
+    Hotels are fetched once for the whole batch and the occupancy ledger is read once per hotel, reservations earlier
+    in the batch count against the availability of the later ones. Each item is accepted or rejected on its own.
+    """
+
+    def __init__(self, data, context=None):
+        self.initial_data = data
+        self.context = context or {}
+        self.results = []
+        self.accepted = []
+
+    def is_valid(self):
+        """
+        Validate every item of the batch.
+        :return: True if at least one reservation was accepted
+        """
+        self.results = []
+        self.accepted = []
+
+        hotel_ids = set()
+        for item in self.initial_data:
+            try:
+                hotel_ids.add(int(item.get('hotel')))
+            except (AttributeError, TypeError, ValueError):
+                pass
+
+        # A single serializer validates every item, building the DRF fields once per batch instead of once per item.
+        hotels = hotel_cache.get_hotel_cache().get_many(hotel_ids)
+        item_serializer = BulkReservationItemSerializer(context=dict(self.context, hotels=hotels))
+        items = []
+        for item in self.initial_data:
+            try:
+                items.append((item_serializer.run_validation(item), None))
+            except serializers.ValidationError as exc:
+                items.append((None, exc.detail))
+
+        # Read the occupancy of every hotel once, over all the nights its reservations in the batch ask for.
+        nights_by_hotel = defaultdict(set)
+        for data, errors in items:
+            if data is None:
+                continue
+            nights_by_hotel[data['hotel'].id].update(stay_nights(data['arrival_date'], data['departure_date']))
+        occupancy = dict((hotel_id, HotelOccupancy.get_nights(hotel_id, min(nights), max(nights)))
+                         for hotel_id, nights in nights_by_hotel.items())
+
+        for index, (data, errors) in enumerate(items):
+            if errors:
+                self.results.append({'index': index, 'status': 'rejected', 'errors': errors})
+                continue
+
+            hotel = data['hotel']
+            nights = stay_nights(data['arrival_date'], data['departure_date'])
+            busiest_night = max(occupancy[hotel.id].get(night, 0) for night in nights)
+            if hotel.get_total_capacity()-busiest_night <= 0:
+                self.results.append({'index': index, 'status': 'rejected', 'errors': {'non_field_errors': [
+                    NO_AVAILABILITY_MESSAGE.format(data['arrival_date'], data['departure_date'])]}})
+                continue
+
+            for night in nights:
+                occupancy[hotel.id][night] = occupancy[hotel.id].get(night, 0)+1
+            reservation = Reservation(**data)
+            self.accepted.append(reservation)
+            self.results.append({'index': index, 'status': 'created', 'reservation': reservation})
+
+        return bool(self.accepted)
+
+    def save(self, retries=3):
+        """
+        Create the accepted reservations with one bulk insert and book their nights in the occupancy ledger.
+        The created rows are read back within the same transaction, the accepted reservations carry their ids.
+
+        Nights are only booked if they are still within capacity. When concurrent bookings took slots since the batch
+        was validated nothing is saved, the batch is validated again against the new occupancy and saving is retried.
+        :param retries: number of times the batch is validated again before giving up
+        """
+        for attempt in range(retries+1):
+            capacities = dict((reservation.hotel.id, reservation.hotel.get_total_capacity())
+                              for reservation in self.accepted)
+            try:
+                HotelOccupancy.apply_stays([reservation.get_stay() for reservation in self.accepted],
+                                           capacities=capacities)
+            except DjangoValidationError:
+                if attempt == retries:
+                    raise serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [
+                        'Reservations of the batch kept conflicting with concurrent bookings, please retry.']})
+                self.is_valid()
+                continue
+
+            Reservation.objects.bulk_create(self.accepted)
+            self.read_created()
+            return
+
+    def read_created(self):
+        """
+        Replace the accepted reservations by the rows the bulk insert created, which the database backend does not hand
+        back the primary keys of. They are read with a single query on their hotels and creation times.
+        """
+        if not self.accepted:
+            return
+
+        def aware_date(value):
+            # Stays are validated as naive datetimes of the default time zone, rows are read back aware
+            if timezone.is_naive(value):
+                return timezone.make_aware(value, timezone.get_default_timezone())
+            return value
+
+        def key(reservation):
+            return (reservation.hotel_id, reservation.guest_name, reservation.guest_email, reservation.created_time,
+                    aware_date(reservation.arrival_date), aware_date(reservation.departure_date))
+
+        created_times = [reservation.created_time for reservation in self.accepted]
+        rows = defaultdict(list)
+        for row in Reservation.objects.active().filter(
+                hotel_id__in=set(reservation.hotel_id for reservation in self.accepted),
+                created_time__gte=min(created_times), created_time__lte=max(created_times)).order_by('id'):
+            rows[key(row)].append(row)
+
+        created = {}
+        for reservation in self.accepted:
+            row = rows[key(reservation)].pop(0)
+            row.hotel = reservation.hotel
+            created[id(reservation)] = row
+        self.accepted = [created[id(reservation)] for reservation in self.accepted]
+        for result in self.results:
+            if 'reservation' in result:
+                result['reservation'] = created[id(result['reservation'])]
+
+    @property
+    def data(self):
+        created = iter(ReservationReadSerializer(self.accepted, many=True, context=self.context).data)
+        results = []
+        for result in self.results:
+            if 'reservation' in result:
+                result = {'index': result['index'], 'status': result['status'], 'data': next(created)}
+            results.append(result)
 
-        return data
\ No newline at end of file
+        return {
+            'created': len(self.accepted),
+            'rejected': len(self.results)-len(self.accepted),
+            'results': results
+        }
@@ -1,12 +1,36 @@
+import base64
+import csv
 import datetime
+import importlib
 import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
 from rest_framework.reverse import reverse
 from rest_framework import status
+from rest_framework.request import Request
 from rest_framework.test import APITestCase
 from copy import deepcopy, copy
 from unittest import TestCase
-from django.test import TestCase
-from reservation.models import Hotel, Reservation
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.cache import caches
+from django.http import QueryDict
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework.serializers import ValidationError as SerializerValidationError
+from six import StringIO
+from reservation import analytics, availability_cache, engine, export, hotel_cache, metrics
+from reservation.filters import ReservationFilter
+from reservation.log_handlers import AsyncHandler
+from reservation.management.commands import bench
+from reservation.models import ArchivedReservation, Hotel, HotelOccupancy, Reservation
+from reservation.routers import ReplicaRouter, use_replica
+from reservation.serializers import ReservationSerializer, ReservationReadSerializer
+from reservation.views import ReservationList
 from reservation.utilities import normalize_date
 from rest_framework.test import APITestCase
 
@@ -61,6 +85,345 @@ class TestHotel(TestCase):
         self.reservation4 = Reservation.objects.create(guest_name="test name", guest_email="test.name@smth.com",
             arrival_date=self.start_date, departure_date=self.end_date, hotel=self.hotel2)
 
+    def test_get_overlapping_reservations(self):
+        # Both reservations stay over the first night of the range
+        self.assertEqual(self.hotel2.get_overlapping_reservations(self.start_date, self.end_date).count(), 2)
+
+        # A range covering exactly the stay of reservation2 overlaps both reservations
+        self.assertEqual(self.hotel2.get_overlapping_reservations(self.start_date2, self.end_date2).count(), 2)
+
+        # A range starting on the departure day of reservation1 only touches it at the edge
+        self.assertEqual(self.hotel2.get_overlapping_reservations(self.end_date,
+                                                                  self.end_date+datetime.timedelta(1)).count(), 0)
+
+
+class TestHotelOccupancy(TestCase):
+    def setUp(self):
+        self.hotel = Hotel.objects.create(name='test hotel', room_capacity=2, over_booking_capacity=0)
+
+        # Eg: start_date: 2018-03-26T11:00:00, end_date: 2018-03-28T10:00:00, i.e. the nights of the 26th and 27th
+        self.start_date = normalize_date(datetime.datetime.now())
+        self.end_date = normalize_date(self.start_date+datetime.timedelta(2), type="departure")
+
+        self.reservation = Reservation.objects.create(guest_name="test name", guest_email="test_name@smth.com",
+            arrival_date=self.start_date, departure_date=self.end_date, hotel=self.hotel)
+
+    def occupancy(self):
+        return dict(HotelOccupancy.objects.filter(hotel=self.hotel, occupied__gt=0).values_list('night', 'occupied'))
+
+    def test_create(self):
+        # Creating a reservation books one room on each night of the stay, not on the departure day
+        self.assertEqual(self.occupancy(), {self.start_date.date(): 1,
+                                            self.start_date.date()+datetime.timedelta(1): 1})
+
+    def test_update(self):
+        # Moving the stay by a day releases the first night and books the new last night
+        reservation = Reservation.objects.get(pk=self.reservation.pk)
+        reservation.arrival_date += datetime.timedelta(1)
+        reservation.departure_date += datetime.timedelta(1)
+        reservation.save()
+
+        self.assertEqual(self.occupancy(), {self.start_date.date()+datetime.timedelta(1): 1,
+                                            self.start_date.date()+datetime.timedelta(2): 1})
+
+    def test_delete(self):
+        # Deleting the reservation releases all of its nights
+        Reservation.objects.get(pk=self.reservation.pk).delete()
+        self.assertEqual(self.occupancy(), {})
+
+    def test_non_overlapping_reservations(self):
+        # A second stay starting on the departure day of the first one does not compete for the same room
+        Reservation.objects.create(guest_name="test name", guest_email="test_name@smth.com",
+            arrival_date=normalize_date(self.end_date), departure_date=self.end_date+datetime.timedelta(2),
+            hotel=self.hotel)
+
+        # Only one room is held on any night of the four nights, so one room is still available for all of them
+        self.assertEqual(self.hotel.get_available_reservation_slots(self.start_date,
+                                                                    self.end_date+datetime.timedelta(2)), 1)
+
+    def test_exclude(self):
+        # The reservation being updated does not count against its own nights
+        self.assertEqual(self.hotel.get_available_reservation_slots(self.start_date, self.end_date), 1)
+        self.assertEqual(self.hotel.get_available_reservation_slots(self.start_date, self.end_date,
+                                                                    exclude=self.reservation), 2)
+
+    def test_rebuild(self):
+        # Bulk deletes bypass the ledger, rebuilding it brings it back in sync with the reservations
+        Reservation.objects.filter(hotel=self.hotel).delete()
+        HotelOccupancy.rebuild(hotel_ids=[self.hotel.id])
+        self.assertEqual(self.occupancy(), {})
+
+
+class TestAvailabilityEngine(TransactionTestCase):
+    # Changes reach the engine when their transaction commits, which TestCase never does
+    def setUp(self):
+        self.path = tempfile.mktemp(suffix='.bin')
+        self.config = {'ENABLED': True, 'PATH': self.path, 'START_DATE': datetime.date(2015, 1, 1), 'DAYS': 365*15,
+                       'MAX_HOTELS': 16}
+        self.settings = override_settings(AVAILABILITY_ENGINE=self.config)
+        self.settings.enable()
+
+        self.hotel = Hotel.objects.create(name='test hotel', room_capacity=2, over_booking_capacity=0)
+        self.start_date = normalize_date(datetime.datetime.now())
+        self.end_date = normalize_date(self.start_date+datetime.timedelta(2), type="departure")
+        self.nights = [self.start_date.date(), self.start_date.date()+datetime.timedelta(1)]
+        engine.startup()
+
+    def tearDown(self):
+        self.settings.disable()
+        os.remove(self.path)
+
+    def create_reservation(self):
+        return Reservation.objects.create(guest_name="test name", guest_email="test_name@smth.com",
+            arrival_date=self.start_date, departure_date=self.end_date, hotel=self.hotel)
+
+    def test_engine(self):
+        self.reservation = self.create_reservation()
+
+        # The booking was written to the engine, which answers for the nights it holds
+        self.assertEqual(engine.get_engine().max_occupied(self.hotel.id, self.nights), 1)
+        self.assertEqual(self.hotel.get_available_reservation_slots(self.start_date, self.end_date), 1)
+
+        # The reservation being updated does not count against its own nights
+        self.assertEqual(self.hotel.get_available_reservation_slots(self.start_date, self.end_date,
+                                                                    exclude=self.reservation), 2)
+
+        # Deleting the reservation releases its nights from the engine
+        Reservation.objects.get(pk=self.reservation.pk).delete()
+        self.assertEqual(engine.get_engine().max_occupied(self.hotel.id, self.nights), 0)
+
+    def test_rollback(self):
+        # A booking rolled back never reaches the engine
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                self.create_reservation()
+                self.assertEqual(engine.get_engine().max_occupied(self.hotel.id, self.nights), 0)
+                raise ValueError
+        self.assertEqual(engine.get_engine().max_occupied(self.hotel.id, self.nights), 0)
+
+        # Nor does one rolled back to a savepoint, while the rest of the transaction does once it commits
+        with transaction.atomic():
+            self.create_reservation()
+            try:
+                with transaction.atomic():
+                    self.create_reservation()
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertEqual(engine.get_engine().max_occupied(self.hotel.id, self.nights), 1)
+
+    def test_startup(self):
+        # Starting a worker on a filled file keeps its counts, bookings other workers applied since are not lost
+        self.create_reservation()
+        engine.get_engine().apply({self.hotel.id: {self.nights[0]: 1}})
+        engine.startup()
+        self.assertEqual(engine.get_engine().max_occupied(self.hotel.id, self.nights), 2)
+
+        # Reservations created behind the engine's back are picked up by a rebuild
+        Reservation.objects.bulk_create([Reservation(guest_name="test name", guest_email="test_name@smth.com",
+            arrival_date=self.start_date, departure_date=self.end_date, hotel=self.hotel)])
+        HotelOccupancy.rebuild()
+        self.assertEqual(self.hotel.get_available_reservation_slots(self.start_date, self.end_date), 0)
+
+    def test_new_file(self):
+        # A file of other settings is started over, and answers nothing until it is filled
+        self.create_reservation()
+        self.settings.disable()
+        self.settings = override_settings(AVAILABILITY_ENGINE=dict(self.config, MAX_HOTELS=32))
+        self.settings.enable()
+        self.assertFalse(engine.get_engine().filled)
+        self.assertFalse(engine.get_engine().covers(self.hotel.id, self.nights))
+        self.assertEqual(self.hotel.get_available_reservation_slots(self.start_date, self.end_date), 1)
+
+        engine.startup()
+        self.assertTrue(engine.get_engine().covers(self.hotel.id, self.nights))
+        self.assertEqual(engine.get_engine().max_occupied(self.hotel.id, self.nights), 1)
+
+
+class TestAvailabilityCache(TestCase):
+    backend = 'reservation.availability_cache.LocMemAvailabilityCache'
+
+    def setUp(self):
+        self.settings = override_settings(
+            AVAILABILITY_CACHE={'BACKEND': self.backend, 'MAX_ENTRIES': 100, 'TIMEOUT': 300, 'CACHE_ALIAS': 'default'},
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                'LOCATION': 'test-availability-cache'}})
+        self.settings.enable()
+        self.cache = availability_cache.get_availability_cache()
+
+        self.hotel = Hotel.objects.create(name='test hotel', room_capacity=3, over_booking_capacity=0)
+
+        # Eg: 2018-03-26T11:00:00 to 2018-03-28T10:00:00, the nights of the 26th and 27th
+        self.start_date = normalize_date(datetime.datetime(2018, 03, 26))
+        self.end_date = normalize_date(self.start_date+datetime.timedelta(2), type='departure')
+        self.reservation = Reservation.objects.create(guest_name="test name", guest_email="test_name@smth.com",
+            arrival_date=self.start_date, departure_date=self.end_date, hotel=self.hotel)
+
+    def tearDown(self):
+        self.settings.disable()
+
+    def slots(self, start_date=None, end_date=None, **kwargs):
+        return self.hotel.get_available_reservation_slots(start_date or self.start_date, end_date or self.end_date,
+                                                          **kwargs)
+
+    def test_hit(self):
+        self.assertEqual(self.slots(), 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.slots(), 2)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+        # The reservation being updated is taken out of the cached counts, which are left as they are
+        self.assertEqual(self.slots(exclude=self.reservation), 3)
+        self.assertEqual(self.slots(), 2)
+
+    def test_invalidate(self):
+        self.slots()
+
+        # A stay starting on the departure day does not overlap the cached range, which is still used
+        Reservation.objects.create(guest_name="test name", guest_email="test_name@smth.com",
+            arrival_date=normalize_date(self.end_date), departure_date=self.end_date+datetime.timedelta(1),
+            hotel=self.hotel)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.slots(), 2)
+
+        # An overlapping one evicts it
+        reservation = Reservation.objects.create(guest_name="test name", guest_email="test_name@smth.com",
+            arrival_date=self.start_date+datetime.timedelta(1), departure_date=self.end_date, hotel=self.hotel)
+        self.assertEqual(self.slots(), 1)
+
+        # So do changing and deleting reservations
+        reservation.arrival_date += datetime.timedelta(1)
+        reservation.departure_date += datetime.timedelta(1)
+        reservation.save()
+        self.assertEqual(self.slots(), 2)
+
+        self.reservation.delete()
+        self.assertEqual(self.slots(), 3)
+
+        # And rebuilding the ledger of the hotel, after a bulk insert which bypassed it
+        self.slots()
+        Reservation.objects.bulk_create([Reservation(guest_name="test name", guest_email="test_name@smth.com",
+            arrival_date=self.start_date, departure_date=self.end_date, hotel=self.hotel)])
+        HotelOccupancy.rebuild(hotel_ids=[self.hotel.id])
+        self.assertEqual(self.slots(), 2)
+        self.assertEqual(self.cache.hits, 2)
+
+
+class TestDjangoAvailabilityCache(TestAvailabilityCache):
+    backend = 'reservation.availability_cache.DjangoAvailabilityCache'
+
+
+class TestAvailabilityCacheCommit(TransactionTestCase):
+    # The ranges are evicted again when the change commits, which TestCase never does
+    backend = 'reservation.availability_cache.LocMemAvailabilityCache'
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db(connection.settings_dict['NAME']) and \
+                not connection.features.can_share_in_memory_db:
+            self.skipTest('Threads can not share this in-memory sqlite test database')
+        self.settings = override_settings(
+            AVAILABILITY_CACHE={'BACKEND': self.backend, 'MAX_ENTRIES': 100, 'TIMEOUT': 300, 'CACHE_ALIAS': 'default'},
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                'LOCATION': 'test-availability-cache-commit'}})
+        self.settings.enable()
+        self.hotel = Hotel.objects.create(name='test hotel', room_capacity=3, over_booking_capacity=0)
+        self.start_date = normalize_date(datetime.datetime(2018, 03, 26))
+        self.end_date = normalize_date(self.start_date+datetime.timedelta(2), type='departure')
+
+    def tearDown(self):
+        self.settings.disable()
+
+    def read_slots(self):
+        # Another request, on its own connection, which only sees what was committed
+        slots = []
+
+        def read():
+            try:
+                slots.append(self.hotel.get_available_reservation_slots(self.start_date, self.end_date))
+            finally:
+                connection.close()
+        thread = threading.Thread(target=read)
+        thread.start()
+        thread.join()
+        return slots[0]
+
+    def test_read_before_commit(self):
+        with transaction.atomic():
+            Reservation.objects.create(guest_name="test name", guest_email="test_name@smth.com",
+                arrival_date=self.start_date, departure_date=self.end_date, hotel=self.hotel)
+            # Read between the eviction and the commit, the former counts are cached again
+            self.assertEqual(self.read_slots(), 3)
+
+        # The commit evicted them
+        self.assertEqual(self.read_slots(), 2)
+        self.assertEqual(self.hotel.get_available_reservation_slots(self.start_date, self.end_date), 2)
+
+
+class TestDjangoAvailabilityCacheCommit(TestAvailabilityCacheCommit):
+    backend = 'reservation.availability_cache.DjangoAvailabilityCache'
+
+
+class TestHotelCache(TestCase):
+    def setUp(self):
+        self.hotel = Hotel.objects.create(name='test hotel', room_capacity=2, over_booking_capacity=0)
+        self.hotel2 = Hotel.objects.create(name='test hotel2', room_capacity=4, over_booking_capacity=50)
+        self.cache = hotel_cache.HotelCache(max_size=1, timeout=300)
+
+    def test_get(self):
+        self.assertEqual(self.cache.get(self.hotel.id).get_total_capacity(), 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cache.get(self.hotel.id).name, 'test hotel')
+        self.assertRaises(Hotel.DoesNotExist, self.cache.get, 0)
+
+        # Only max_size hotels are kept, hotel is evicted by hotel2
+        self.cache.get(self.hotel2.id)
+        with self.assertNumQueries(1):
+            self.cache.get(self.hotel.id)
+
+    def test_replica(self):
+        # Hotels are read from the primary inside a read only block too, the replica (none in the tests) is not used
+        with use_replica('replica'):
+            self.assertEqual(self.cache.get(self.hotel.id).name, 'test hotel')
+
+    def test_invalidate(self):
+        # Saving and deleting a hotel evicts it from the cache of the process
+        cache = hotel_cache.get_hotel_cache()
+        cache.get(self.hotel.id)
+        self.hotel.room_capacity = 3
+        self.hotel.save()
+        self.assertEqual(cache.get(self.hotel.id).room_capacity, 3)
+
+        self.hotel.delete()
+        self.assertRaises(Hotel.DoesNotExist, cache.get, self.hotel.id)
+
+    def test_version_cache(self):
+        # Two processes sharing a version stamp, a change made by one drops the cache of the other
+        version_cache = caches['default']
+        other = hotel_cache.HotelCache(max_size=10, timeout=300, version_cache=version_cache)
+        cache = hotel_cache.HotelCache(max_size=10, timeout=300, version_cache=version_cache)
+        other.get(self.hotel.id)
+
+        Hotel.objects.filter(id=self.hotel.id).update(room_capacity=3)
+        cache.invalidate(self.hotel.id)
+        self.assertEqual(other.get(self.hotel.id).room_capacity, 3)
+
+    def test_booking(self):
+        # Once the hotel is cached, booking it does not read it from the database any more
+        url = reverse('reservation:reservation-list')
+        data = {"guest_name": "tester", "guest_email": "tester@foo.com", "arrival_date": "2018-03-26T00:00:00",
+                "departure_date": "2018-03-27T00:00:00", "hotel": self.hotel.id}
+        self.client.post(url, data, format='json')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'FROM "reservation_hotel"' in query['sql']])
+
+        response = self.client.post(url, dict(data, hotel=0), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('hotel', response.data)
+
 
 class TestHotelList(APITestCase):
 
@@ -194,6 +557,118 @@ class TestHotelDetail(TestCase):
         self.assertTrue(response.status_code, status.HTTP_404_NOT_FOUND)
 
 
+class TestAvailabilityList(TestCase):
+    def setUp(self):
+        self.hotel = Hotel.objects.create(name='test hotel', room_capacity=1, over_booking_capacity=0)
+        self.hotel2 = Hotel.objects.create(name='test hotel2', room_capacity=2, over_booking_capacity=50)
+        self.url = reverse('reservation:availability')
+
+        # Eg: 2018-03-26T11:00:00 to 2018-03-28T10:00:00
+        self.start_date = normalize_date(datetime.datetime.now())
+        self.end_date = normalize_date(self.start_date+datetime.timedelta(2), type="departure")
+        Reservation.objects.create(guest_name="test name", guest_email="test_name@smth.com",
+            arrival_date=self.start_date, departure_date=self.end_date, hotel=self.hotel)
+        self.data = {'arrival': self.start_date.strftime('%Y-%m-%dT%H:%M:%S'),
+                     'departure': self.end_date.strftime('%Y-%m-%dT%H:%M:%S')}
+
+    def test_get(self):
+        response = self.client.get(self.url, self.data, accept='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # The only room of hotel is taken, hotel2 has two rooms and one over booking available
+        self.assertEqual([(hotel['id'], hotel['available_slots']) for hotel in response.data['results']],
+                         [(self.hotel2.id, 3)])
+
+        # Both hotels are available starting on the departure day of the reservation
+        self.data['arrival'] = self.data['departure']
+        self.data['departure'] = (self.end_date+datetime.timedelta(1)).strftime('%Y-%m-%dT%H:%M:%S')
+        response = self.client.get(self.url, self.data, accept='application/json')
+        self.assertEqual(len(response.data['results']), 2)
+
+        # Only hotel2 has at least 2 slots available
+        self.data['min_slots'] = 2
+        response = self.client.get(self.url, self.data, accept='application/json')
+        self.assertEqual([hotel['id'] for hotel in response.data['results']], [self.hotel2.id])
+
+    def test_get_available_hotels(self):
+        # Hotels are filtered in the query, a slice limits it to the hotels of the page
+        for index in range(5):
+            Hotel.objects.create(name='test hotel {0}'.format(index), room_capacity=1, over_booking_capacity=0)
+        hotels = Hotel.get_available_hotels(self.start_date, self.end_date)
+        self.assertEqual(hotels.count(), 6)
+        with CaptureQueriesContext(connection) as queries:
+            page = list(hotels[:2])
+        self.assertEqual(len(queries), 1)
+        self.assertIn('LIMIT 2', queries[0]['sql'])
+        self.assertEqual([(hotel.id, hotel.available_slots) for hotel in page],
+                         [(self.hotel2.id, 3), (self.hotel2.id+1, 1)])
+
+    def test_get_invalid(self):
+        # Departure date is required
+        response = self.client.get(self.url, {'arrival': self.data['arrival']}, accept='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('departure', response.data)
+
+        # Departure date cannot be prior to the arrival date
+        response = self.client.get(self.url, {'arrival': self.data['departure'], 'departure': self.data['arrival']},
+                                   accept='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('non_field_errors', response.data)
+
+
+class TestHotelCalendar(TestCase):
+    def setUp(self):
+        self.hotel = Hotel.objects.create(name='test hotel', room_capacity=2, over_booking_capacity=50)
+        self.url = reverse('reservation:hotel-calendar', kwargs={'pk': self.hotel.id})
+
+        # Eg: reservation1 stays the nights of 2018-03-26 and 27th, reservation2 the nights of 25th and 26th
+        self.start_date = normalize_date(datetime.datetime.now())
+        Reservation.objects.create(guest_name="test name", guest_email="test_name@smth.com",
+            arrival_date=self.start_date, departure_date=self.start_date+datetime.timedelta(2), hotel=self.hotel)
+        Reservation.objects.create(guest_name="test name", guest_email="test_name@smth.com",
+            arrival_date=self.start_date-datetime.timedelta(1), departure_date=self.start_date+datetime.timedelta(1),
+            hotel=self.hotel)
+
+    def test_get(self):
+        data = {'from': self.start_date.strftime('%Y-%m-%dT%H:%M:%S'),
+                'to': (self.start_date+datetime.timedelta(3)).strftime('%Y-%m-%dT%H:%M:%S')}
+        response = self.client.get(self.url, data, accept='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('max-age', response['Cache-Control'])
+
+        # Three nights, two rooms and one over booking: both reservations on the first night, one on the second
+        self.assertEqual([(night['occupied'], night['available']) for night in response.data['nights']],
+                         [(2, 1), (1, 2), (0, 3)])
+
+        # The calendar agrees with the availability of each single night
+        for night in response.data['nights']:
+            start_date = normalize_date(datetime.datetime.combine(night['night'], datetime.time()))
+            self.assertEqual(night['available'], self.hotel.get_available_reservation_slots(
+                start_date, start_date+datetime.timedelta(1)))
+
+    def test_archive(self):
+        # Reservations moved to the archive still count on the nights they held
+        nights = self.hotel.get_vacancy_calendar(self.start_date-datetime.timedelta(1),
+                                                 self.start_date+datetime.timedelta(3))
+        ArchivedReservation.archive(self.start_date+datetime.timedelta(10))
+        self.assertFalse(Reservation.objects.exists())
+        self.assertEqual(self.hotel.get_vacancy_calendar(self.start_date-datetime.timedelta(1),
+                                                         self.start_date+datetime.timedelta(3)), nights)
+        self.assertEqual([occupied for night, occupied, available in nights], [1, 2, 1, 0])
+
+    def test_get_invalid(self):
+        # A calendar can not span more than a year
+        data = {'from': self.start_date.strftime('%Y-%m-%dT%H:%M:%S'),
+                'to': (self.start_date+datetime.timedelta(400)).strftime('%Y-%m-%dT%H:%M:%S')}
+        response = self.client.get(self.url, data, accept='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # There is no hotel with id 10000
+        response = self.client.get(reverse('reservation:hotel-calendar', kwargs={'pk': 10000}), data,
+                                   accept='application/json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
 class TestReservationList(TestCase):
     def setUp(self):
         self.hotel = Hotel.objects.create(name='test hotel', room_capacity=1, over_booking_capacity=50)
@@ -281,6 +756,860 @@ class TestReservationList(TestCase):
                                                             " following dates {0} and {1}".format(start_date, end_date)])
 
 
+class TestStaySuggestions(TestCase):
+    def setUp(self):
+        self.hotel = Hotel.objects.create(name='test hotel', room_capacity=1, over_booking_capacity=0)
+        self.base = normalize_date(datetime.datetime.now()+datetime.timedelta(10))
+        # The only room is held on the nights base to base+2 and base+5
+        self.reservation = self.book(0, 3)
+        self.book(5, 1)
+
+    def book(self, offset, nights):
+        arrival_date = self.base+datetime.timedelta(offset)
+        return Reservation.objects.create(guest_name='tester', guest_email='tester@foo.com', hotel=self.hotel,
+                                          arrival_date=arrival_date, departure_date=normalize_date(
+                                              arrival_date+datetime.timedelta(nights), type='departure'))
+
+    def day(self, offset):
+        return (self.base+datetime.timedelta(offset)).date()
+
+    def stay(self, offset, nights):
+        arrival_date = self.base+datetime.timedelta(offset)
+        return arrival_date, normalize_date(arrival_date+datetime.timedelta(nights), type='departure')
+
+    def test_suggest_stays(self):
+        with CaptureQueriesContext(connection) as queries:
+            stays = self.hotel.suggest_stays(*self.stay(1, 2), count=3, horizon=30)
+        # The ledger is read once, whatever the horizon
+        self.assertEqual(len([query for query in queries.captured_queries if 'SELECT' in query['sql']]), 1)
+        # Closest first, two nights each, the busy nights avoided
+        self.assertEqual([(arrival.date(), departure.date(), available) for arrival, departure, available in stays],
+                         [(self.day(3), self.day(5), 1), (self.day(-2), self.day(0), 1), (self.day(-3), self.day(-1), 1)])
+        self.assertEqual((stays[0][0].hour, stays[0][1].hour), (11, 10))
+
+    def test_horizon_and_exclude(self):
+        self.assertEqual([arrival.date() for arrival, departure, available in
+                          self.hotel.suggest_stays(*self.stay(1, 2), count=3, horizon=2)], [self.day(3)])
+        # Never before today
+        self.assertEqual(self.hotel.suggest_stays(*self.stay(-30, 2), count=3, horizon=5), [])
+        # Nights of the excluded reservation are free again, earlier first at the same distance
+        stays = self.hotel.suggest_stays(*self.stay(1, 2), count=2, horizon=30, exclude=self.reservation)
+        self.assertEqual([arrival.date() for arrival, departure, available in stays], [self.day(0), self.day(2)])
+
+    def test_rejection(self):
+        arrival_date, departure_date = self.stay(1, 2)
+        data = {'guest_name': 'tester', 'guest_email': 'tester@foo.com', 'hotel': self.hotel.id,
+                'arrival_date': arrival_date.isoformat(), 'departure_date': departure_date.isoformat()}
+        response = self.client.post(reverse('reservation:reservation-list'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('non_field_errors', response.data)
+        self.assertEqual([(stay['arrival_date'][:10], stay['departure_date'][:10])
+                          for stay in response.data['suggestions']],
+                         [(self.day(3).isoformat(), self.day(5).isoformat()),
+                          (self.day(-2).isoformat(), self.day(0).isoformat()),
+                          (self.day(-3).isoformat(), self.day(-1).isoformat())])
+
+    def test_suggest(self):
+        url = reverse('reservation:hotel-suggest', kwargs={'pk': self.hotel.id})
+        arrival_date, departure_date = self.stay(1, 2)
+        data = {'arrival': arrival_date.isoformat(), 'departure': departure_date.isoformat(), 'count': 1}
+        response = self.client.get(url, data, format='json', accept='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['hotel'], self.hotel.id)
+        self.assertEqual(response.data['available_slots'], 0)
+        self.assertEqual(len(response.data['suggestions']), 1)
+        self.assertEqual(response.data['suggestions'][0]['arrival_date'][:10], self.day(3).isoformat())
+        self.assertEqual(response.data['suggestions'][0]['available'], 1)
+
+        # More slots than the hotel has, too many stays, departure before arrival, unknown hotel
+        for params in ({'min_slots': 2}, {'count': 11}, {'departure': arrival_date.isoformat()}):
+            response = self.client.get(url, dict(data, **params), format='json', accept='application/json')
+            if 'min_slots' in params:
+                self.assertEqual(response.data['suggestions'], [])
+            else:
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('reservation:hotel-suggest', kwargs={'pk': 10000}), data,
+                                   format='json', accept='application/json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class TestOccupancyReport(TestCase):
+    def setUp(self):
+        self.hotel = Hotel.objects.create(name='test hotel', room_capacity=2, over_booking_capacity=50)
+        self.hotel2 = Hotel.objects.create(name='test hotel2', room_capacity=1, over_booking_capacity=0)
+        self.base = normalize_date(datetime.datetime.now()+datetime.timedelta(20))
+        now = datetime.datetime.now()
+        for hotel, offset, nights, booked in ((self.hotel, 0, 2, now+datetime.timedelta(10)), (self.hotel, 1, 2, now),
+                                              (self.hotel, 1, 1, now), (self.hotel, 1, 1, now), (self.hotel2, 3, 1, now)):
+            arrival_date = self.base+datetime.timedelta(offset)
+            reservation = Reservation.objects.create(
+                guest_name='tester', guest_email='tester@foo.com', hotel=hotel, arrival_date=arrival_date,
+                departure_date=normalize_date(arrival_date+datetime.timedelta(nights), type='departure'))
+            Reservation.objects.filter(pk=reservation.pk).update(created_time=booked)
+        # Cancelled reservations do not count
+        reservation.cancel()
+        Reservation.objects.filter(hotel=self.hotel).latest('id').cancel()
+        # Nights base-1 to base+3
+        self.params = {'from': (self.base-datetime.timedelta(1)).isoformat(),
+                       'to': (self.base+datetime.timedelta(4)).isoformat()}
+
+    def test_get_occupancy(self):
+        first_night = (self.base-datetime.timedelta(1)).date()
+        last_night = (self.base+datetime.timedelta(3)).date()
+        series = analytics.get_occupancy(Hotel.objects.all(), first_night, last_night)[self.hotel.id]
+        self.assertEqual(series['occupied'], [0, 1, 3, 1, 0])
+        # The same counts as the ledger the availability checks read
+        ledger = HotelOccupancy.get_nights(self.hotel.id, first_night, last_night)
+        self.assertEqual(series['occupied'], [ledger.get(first_night+datetime.timedelta(day), 0) for day in range(5)])
+        self.assertEqual(series['occupancy_rate'], [0.0, 0.5, 1.5, 0.5, 0.0])
+        self.assertEqual(series['overbooked'], [0, 0, 1, 0, 0])
+        self.assertEqual(series['overbooking_usage'], [0.0, 0.0, 1.0, 0.0, 0.0])
+        # Booked 10 days ahead for the first stay, 20 for the others
+        self.assertEqual(series['pickup']['7'], [0, 1, 3, 1, 0])
+        self.assertEqual(series['pickup']['14'], [0, 0, 2, 1, 0])
+        self.assertEqual(series['pickup']['30'], [0, 0, 0, 0, 0])
+
+    def test_archive(self):
+        # Nights of the reservations moved to the archive keep their occupancy and pickup
+        first_night = (self.base-datetime.timedelta(1)).date()
+        last_night = (self.base+datetime.timedelta(3)).date()
+        expected = analytics.get_occupancy(Hotel.objects.all(), first_night, last_night)
+        ArchivedReservation.archive(self.base+datetime.timedelta(10), batch_size=10)
+        self.assertFalse(Reservation.objects.exists())
+        self.assertEqual(analytics.get_occupancy(Hotel.objects.all(), first_night, last_night), expected)
+
+    def test_hotel_occupancy(self):
+        url = reverse('reservation:hotel-occupancy', kwargs={'pk': self.hotel.id})
+        response = self.client.get(url, self.params, format='json', accept='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['hotel'], self.hotel.id)
+        self.assertEqual(len(response.data['nights']), 5)
+        self.assertEqual(response.data['occupied'], [0, 1, 3, 1, 0])
+        self.assertEqual(response.data['summary'], {'room_nights': 5, 'occupancy_rate': 0.5, 'peak_occupied': 3,
+                                                    'overbooked_nights': 1})
+
+        response = self.client.get(url, {'from': self.params['to'], 'to': self.params['from']}, format='json',
+                                   accept='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('reservation:hotel-occupancy', kwargs={'pk': 10000}), self.params,
+                                   format='json', accept='application/json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_occupancy(self):
+        url = reverse('reservation:occupancy')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, self.params, format='json', accept='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # The hotels and their reservations are read once, however many hotels there are, after checking whether the
+        # window reaches back to archived reservations
+        self.assertEqual(len([query for query in queries.captured_queries if 'SELECT' in query['sql']]), 3)
+        self.assertEqual([(hotel['hotel'], hotel['occupied']) for hotel in response.data['hotels']],
+                         [(self.hotel.id, [0, 1, 3, 1, 0]), (self.hotel2.id, [0, 0, 0, 0, 0])])
+
+        response = self.client.get(url, dict(self.params, hotel=[self.hotel2.id]), format='json',
+                                   accept='application/json')
+        self.assertEqual([hotel['hotel'] for hotel in response.data['hotels']], [self.hotel2.id])
+        response = self.client.get(url, dict(self.params, hotel='x'), format='json', accept='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestReservationFilter(TestCase):
+    def setUp(self):
+        self.hotel = Hotel.objects.create(name='test hotel', room_capacity=10, over_booking_capacity=0)
+        self.hotel2 = Hotel.objects.create(name='test hotel2', room_capacity=10, over_booking_capacity=0)
+        self.url = reverse('reservation:reservation-list')
+
+        first_day = datetime.datetime(2018, 3, 1)
+        self.reservations = {}
+        for name, hotel, arrival, nights in (('a', self.hotel, 0, 2), ('b', self.hotel, 3, 2), ('c', self.hotel2, 1, 5)):
+            arrival_date = normalize_date(first_day+datetime.timedelta(arrival))
+            departure_date = normalize_date(arrival_date+datetime.timedelta(nights), type='departure')
+            self.reservations[name] = Reservation.objects.create(
+                guest_name=name, guest_email='{0}@guest.com'.format(name), hotel=hotel, arrival_date=arrival_date,
+                departure_date=departure_date)
+
+    def get_names(self, params):
+        response = self.client.get(self.url, params, format='json', accept='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(reservation['guest_name'] for reservation in response.data['results'])
+
+    def test_filters(self):
+        self.assertEqual(self.get_names({}), ['a', 'b', 'c'])
+        self.assertEqual(self.get_names({'hotel': self.hotel.id}), ['a', 'b'])
+        self.assertEqual(self.get_names({'arrival_after': '2018-03-02T00:00:00'}), ['b', 'c'])
+        self.assertEqual(self.get_names({'arrival_after': '2018-03-02T00:00:00',
+                                         'arrival_before': '2018-03-03T00:00:00'}), ['c'])
+        self.assertEqual(self.get_names({'departure_after': '2018-03-07T00:00:00'}), ['c'])
+        self.assertEqual(self.get_names({'departure_before': '2018-03-04T00:00:00'}), ['a'])
+        self.assertEqual(self.get_names({'guest_email': 'b@guest.com'}), ['b'])
+        self.assertEqual(self.get_names({'guest_email': ' B@Guest.COM'}), ['b'])
+        self.assertEqual(self.get_names({'guest_email': 'x@guest.com'}), [])
+
+        # Reservations holding a room on the night of March 3rd, a leaves on the morning of the 3rd
+        self.assertEqual(self.get_names({'from': '2018-03-03T00:00:00', 'to': '2018-03-04T00:00:00'}), ['c'])
+        self.assertEqual(self.get_names({'from': '2018-03-03T00:00:00', 'to': '2018-03-05T00:00:00'}), ['b', 'c'])
+        self.assertEqual(self.get_names({'hotel': self.hotel.id, 'to': '2018-03-02T00:00:00'}), ['a'])
+
+        # Filters combine with the cursor pagination
+        response = self.client.get(self.url, {'pagination': 'cursor', 'hotel': self.hotel2.id},
+                                   format='json', accept='application/json')
+        self.assertEqual([reservation['guest_name'] for reservation in response.data['results']], ['c'])
+
+    def test_invalid(self):
+        response = self.client.get(self.url, {'from': 'yesterday'}, format='json', accept='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('from', response.data)
+
+    def test_query_plans(self):
+        # Every filter reads the reservations through an index, never with a full table scan
+        if connection.vendor != 'sqlite':
+            self.skipTest('Query plans are only checked on sqlite')
+
+        for params in ('hotel=1', 'arrival_after=2018-03-01T00:00:00&arrival_before=2018-04-01T00:00:00',
+                       'departure_after=2018-03-01T00:00:00', 'departure_before=2018-03-01T00:00:00',
+                       'from=2018-03-01T00:00:00', 'to=2018-03-05T00:00:00',
+                       'from=2018-03-01T00:00:00&to=2018-03-05T00:00:00', 'guest_email=a@guest.com',
+                       'hotel=1&from=2018-03-01T00:00:00&to=2018-03-05T00:00:00'):
+            queryset = ReservationFilter(QueryDict(params), queryset=ReservationList.queryset).qs
+            sql, sql_params = queryset.query.sql_with_params()
+            cursor = connection.cursor()
+            cursor.execute('EXPLAIN QUERY PLAN '+sql, sql_params)
+            steps = [row[-1] for row in cursor.fetchall() if 'reservation_reservation' in row[-1]]
+            self.assertTrue(steps, params)
+            for step in steps:
+                self.assertTrue(step.startswith('SEARCH') and 'INDEX' in step, '{0}: {1}'.format(params, step))
+
+
+class TestGuestReservations(TestCase):
+    def setUp(self):
+        self.hotel = Hotel.objects.create(name='test hotel', room_capacity=10, over_booking_capacity=0)
+        today = normalize_date(datetime.datetime.now())
+        for name, email, arrival in (('past', 'Guest@Example.com', -10), ('older', 'guest@example.com', -20),
+                                     ('current', 'GUEST@example.com', -1), ('next', 'guest@Example.COM', 5),
+                                     ('later', 'guest@example.com', 30), ('other', 'other@example.com', 5)):
+            arrival_date = today+datetime.timedelta(arrival)
+            Reservation.objects.create(guest_name=name, guest_email=email, hotel=self.hotel, arrival_date=arrival_date,
+                                       departure_date=normalize_date(arrival_date+datetime.timedelta(3), type='departure'))
+
+    def get(self, email, **params):
+        url = reverse('reservation:guest-reservations', kwargs={'email': email})
+        return self.client.get(url, params, format='json', accept='application/json')
+
+    def test_get(self):
+        response = self.get('Guest@EXAMPLE.com')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['email'], 'guest@example.com')
+        # Whatever the case of the address, upcoming soonest first (a stay not over yet is upcoming), past latest first
+        self.assertEqual([stay['guest_name'] for stay in response.data['upcoming']['results']],
+                         ['current', 'next', 'later'])
+        self.assertEqual([stay['guest_name'] for stay in response.data['past']['results']], ['past', 'older'])
+        self.assertFalse(response.data['upcoming']['more'])
+        self.assertIn('url', response.data['past']['results'][0])
+
+    def test_limit(self):
+        response = self.get('guest@example.com', limit=2)
+        self.assertEqual([stay['guest_name'] for stay in response.data['upcoming']['results']], ['current', 'next'])
+        self.assertTrue(response.data['upcoming']['more'])
+        self.assertFalse(response.data['past']['more'])
+
+        self.assertEqual(self.get('guest@example.com', limit=0).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.get('guest@example.com', limit=101).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.get('not an email').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_archived(self):
+        # The older stay moves to the archive, it is still listed among the past ones
+        ArchivedReservation.archive(normalize_date(datetime.datetime.now())-datetime.timedelta(15))
+        self.assertEqual(list(ArchivedReservation.objects.values_list('guest_name', flat=True)), ['older'])
+        response = self.get('GUEST@example.com')
+        self.assertEqual([stay['guest_name'] for stay in response.data['past']['results']], ['past', 'older'])
+        self.assertTrue(response.data['past']['results'][1]['url'].endswith('?archived=true'))
+        self.assertFalse(response.data['past']['more'])
+
+        response = self.get('guest@example.com', limit=1)
+        self.assertEqual([stay['guest_name'] for stay in response.data['past']['results']], ['past'])
+        self.assertTrue(response.data['past']['more'])
+
+    def test_unknown_guest(self):
+        response = self.get('nobody@example.com')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['upcoming']['results'], response.data['past']['results']), ([], []))
+
+    def test_guest_email_key(self):
+        # Folded on every save, bulk_create included
+        reservation = Reservation.objects.get(guest_name='next')
+        self.assertEqual(reservation.guest_email_key, 'guest@example.com')
+        reservation.guest_email = 'Someone@Else.com'
+        reservation.save()
+        self.assertEqual(Reservation.objects.of_guest('someone@else.COM').get(), reservation)
+
+        Reservation.objects.bulk_create([Reservation(guest_name='bulk', guest_email=' Bulk@Example.com',
+                                                     hotel=self.hotel, arrival_date=reservation.arrival_date,
+                                                     departure_date=reservation.departure_date)])
+        self.assertEqual(Reservation.objects.get(guest_name='bulk').guest_email_key, 'bulk@example.com')
+
+    def test_query_plan(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Query plans are only checked on sqlite')
+        queryset = Reservation.objects.active().of_guest('guest@example.com').filter(
+            departure_date__gt=datetime.datetime(2018, 1, 1)).order_by('departure_date', 'id')[:11]
+        sql, params = queryset.query.sql_with_params()
+        cursor = connection.cursor()
+        cursor.execute('EXPLAIN QUERY PLAN '+sql, params)
+        steps = [row[-1] for row in cursor.fetchall()]
+        # An index range read already in order, no table scan and no sort
+        self.assertEqual(len(steps), 1, steps)
+        self.assertTrue(steps[0].startswith('SEARCH') and 'guest_email_key=? AND departure_date>?' in steps[0], steps)
+
+
+class TestArchiveReservations(TestCase):
+    def setUp(self):
+        self.hotel = Hotel.objects.create(name='test hotel', room_capacity=10, over_booking_capacity=0)
+        today = normalize_date(datetime.datetime.now())
+        self.reservations = {}
+        for name, arrival in (('oldest', -800), ('old', -500), ('recent', -30), ('upcoming', 10)):
+            arrival_date = today+datetime.timedelta(arrival)
+            self.reservations[name] = Reservation.objects.create(
+                guest_name=name, guest_email='{0}@guest.com'.format(name), hotel=self.hotel, arrival_date=arrival_date,
+                departure_date=normalize_date(arrival_date+datetime.timedelta(2), type='departure'))
+
+    def archive(self, **options):
+        out = StringIO()
+        call_command('archive_reservations', stdout=out, **options)
+        return out.getvalue()
+
+    def test_archive(self):
+        old = Reservation.objects.get(pk=self.reservations['old'].pk)
+        self.assertIn('Archived 2 reservations', self.archive(batch_size=1))
+        self.assertEqual(sorted(Reservation.objects.values_list('guest_name', flat=True)), ['recent', 'upcoming'])
+
+        # Same id, fields and times, and the nights are released from the ledger
+        archived = ArchivedReservation.objects.get(pk=old.pk)
+        self.assertEqual((archived.guest_name, archived.hotel_id, archived.arrival_date, archived.departure_date,
+                          archived.created_time, archived.last_modified_time),
+                         (old.guest_name, old.hotel_id, old.arrival_date, old.departure_date, old.created_time,
+                          old.last_modified_time))
+        self.assertEqual(archived.guest_email_key, 'old@guest.com')
+        self.assertEqual(HotelOccupancy.max_occupied(self.hotel.id, old.arrival_date, old.departure_date), 0)
+        self.assertEqual(HotelOccupancy.count_nights(), dict(
+            ((hotel_id, night), occupied) for hotel_id, night, occupied in
+            HotelOccupancy.objects.filter(occupied__gt=0).values_list('hotel_id', 'night', 'occupied')))
+
+        # Nothing left to archive
+        self.assertIn('Archived 0 reservations', self.archive())
+
+    def test_archive_before(self):
+        cutoff = (self.reservations['oldest'].departure_date+datetime.timedelta(1)).strftime('%Y-%m-%d')
+        self.assertIn('Archived 1 reservations', self.archive(before=cutoff))
+        self.assertEqual(list(ArchivedReservation.objects.values_list('guest_name', flat=True)), ['oldest'])
+
+    def test_api(self):
+        self.archive()
+        url = reverse('reservation:reservation-list')
+        response = self.client.get(url, format='json', accept='application/json')
+        self.assertEqual(sorted(reservation['guest_name'] for reservation in response.data['results']),
+                         ['recent', 'upcoming'])
+
+        response = self.client.get(url, {'archived': 'true'}, format='json', accept='application/json')
+        self.assertEqual(sorted(reservation['guest_name'] for reservation in response.data['results']),
+                         ['old', 'oldest'])
+        reservation = response.data['results'][0]
+        self.assertIn('archived_time', reservation)
+        self.assertTrue(reservation['url'].endswith('?archived=true'))
+
+        # Filters and cursors work on the archive too
+        response = self.client.get(url, {'archived': 'true', 'guest_email': 'old@guest.com', 'pagination': 'cursor'},
+                                   format='json', accept='application/json')
+        self.assertEqual([stay['guest_name'] for stay in response.data['results']], ['old'])
+
+        detail_url = reverse('reservation:reservation-detail', args=[self.reservations['old'].pk])
+        self.assertEqual(self.client.get(detail_url, format='json').status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(detail_url, {'archived': 'true'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['guest_name'], 'old')
+        self.assertIn('ETag', response)
+
+        # The archive is read only
+        self.assertEqual(self.client.delete(detail_url+'?archived=true').status_code,
+                         status.HTTP_405_METHOD_NOT_ALLOWED)
+        self.assertEqual(self.client.post(url+'?archived=true', {}, format='json').status_code,
+                         status.HTTP_405_METHOD_NOT_ALLOWED)
+        self.assertTrue(ArchivedReservation.objects.filter(pk=self.reservations['old'].pk).exists())
+
+
+class TestBulkDelete(TestCase):
+    def setUp(self):
+        self.hotel = Hotel.objects.create(name='test hotel', room_capacity=10, over_booking_capacity=0)
+        self.hotel2 = Hotel.objects.create(name='test hotel2', room_capacity=10, over_booking_capacity=0)
+        self.today = normalize_date(datetime.datetime.now())
+        for hotel, arrival in ((self.hotel, 0), (self.hotel, 1), (self.hotel, 2), (self.hotel, 10), (self.hotel, 20),
+                               (self.hotel2, 1)):
+            arrival_date = self.today+datetime.timedelta(arrival)
+            Reservation.objects.create(guest_name='tester', guest_email='tester@foo.com', hotel=hotel,
+                                       arrival_date=arrival_date, departure_date=normalize_date(
+                                           arrival_date+datetime.timedelta(2), type='departure'))
+        reservation = Reservation.objects.filter(hotel=self.hotel).latest('id')
+        ArchivedReservation.objects.create(**dict((field, getattr(reservation, field))
+                                                  for field in ArchivedReservation.copied_fields))
+
+    def assertLedgerInSync(self):
+        self.assertEqual(HotelOccupancy.count_nights(), dict(
+            ((hotel_id, night), occupied) for hotel_id, night, occupied in
+            HotelOccupancy.objects.filter(occupied__gt=0).values_list('hotel_id', 'night', 'occupied')))
+
+    def test_cancel_in_batches(self):
+        reservations = Reservation.objects.filter(hotel=self.hotel).overlapping(
+            self.today, self.today+datetime.timedelta(5))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(list(reservations.cancel_in_batches(batch_size=2)), [2, 1])
+        # One UPDATE per batch, whatever its size, and the rows are kept
+        self.assertEqual(len([query for query in queries.captured_queries
+                              if 'UPDATE "reservation_reservation"' in query['sql']]), 2)
+        self.assertEqual(Reservation.objects.filter(hotel=self.hotel, status=Reservation.CANCELLED).count(), 3)
+        self.assertEqual(Reservation.objects.active().filter(hotel=self.hotel).count(), 2)
+        self.assertLedgerInSync()
+
+    def test_hotel_delete_in_batches(self):
+        nights = HotelOccupancy.objects.filter(hotel=self.hotel).count()
+        progress = list(self.hotel.delete_in_batches(batch_size=3))
+        self.assertEqual(progress, [('reservation', 3), ('reservation', 5), ('archivedreservation', 1)] +
+                         [('hoteloccupancy', min(deleted, nights)) for deleted in range(3, nights+3, 3)])
+        self.assertFalse(Hotel.objects.filter(name='test hotel').exists())
+        self.assertEqual(ArchivedReservation.objects.count(), 0)
+        self.assertEqual(Reservation.objects.count(), 1)
+        self.assertLedgerInSync()
+
+    def test_hotel_delete_view(self):
+        response = self.client.delete(reverse('reservation:hotel-detail', kwargs={'pk': self.hotel.id}))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(list(Reservation.objects.values_list('hotel_id', flat=True)), [self.hotel2.id])
+        self.assertFalse(HotelOccupancy.objects.filter(hotel_id=self.hotel.id).exists())
+
+    def test_cancel(self):
+        url = reverse('reservation:reservation-cancel')
+        data = {'hotel': self.hotel.id, 'from': self.today.isoformat(),
+                'to': (self.today+datetime.timedelta(5)).isoformat()}
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'hotel': self.hotel.id, 'cancelled': 3, 'batches': 1})
+        self.assertEqual(Reservation.objects.active().filter(hotel=self.hotel).count(), 2)
+        self.assertLedgerInSync()
+
+        for params in ({'hotel': 10000}, {'to': data['from']}, {'from': None}):
+            response = self.client.post(url, dict(data, **params), format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('cancel_reservations', str(self.hotel.id), batch_size=1, verbosity=2, stdout=out,
+                     **{'from': (self.today+datetime.timedelta(9)).strftime('%Y-%m-%d'),
+                        'to': (self.today+datetime.timedelta(30)).strftime('%Y-%m-%d')})
+        self.assertIn('Cancelled 1 reservations\nCancelled 2 reservations\n', out.getvalue())
+        self.assertIn('Cancelled 2 reservations of the hotel {0} in 2 batches'.format(self.hotel.id), out.getvalue())
+        self.assertLedgerInSync()
+
+        with self.assertRaises(CommandError):
+            call_command('cancel_reservations', str(self.hotel.id), stdout=out)
+        call_command('cancel_reservations', str(self.hotel.id), delete_hotel=True, stdout=out)
+        self.assertFalse(Hotel.objects.filter(pk=self.hotel.id).exists())
+        with self.assertRaises(CommandError):
+            call_command('cancel_reservations', str(self.hotel.id), delete_hotel=True, stdout=out)
+
+
+class TestHotelDeleteLocking(TransactionTestCase):
+    # Out of the transaction TestCase runs every test in, as the DELETE of a hotel is served
+    def setUp(self):
+        # SELECT ... FOR UPDATE as Postgres and MySQL run it, refused outside of a transaction. The clause itself is
+        # left out, sqlite has no such syntax.
+        connection.features.has_select_for_update = True
+        connection.ops.for_update_sql = lambda nowait=False: ''
+        self.addCleanup(delattr, connection.features, 'has_select_for_update')
+        self.addCleanup(delattr, connection.ops, 'for_update_sql')
+
+        self.hotel = Hotel.objects.create(name='test hotel', room_capacity=10, over_booking_capacity=0)
+        arrival_date = normalize_date(datetime.datetime.now())
+        Reservation.objects.create(guest_name='tester', guest_email='tester@foo.com', hotel=self.hotel,
+                                   arrival_date=arrival_date, departure_date=normalize_date(
+                                       arrival_date+datetime.timedelta(2), type='departure'))
+        self.url = reverse('reservation:hotel-detail', kwargs={'pk': self.hotel.id})
+
+    def test_delete(self):
+        etag = self.client.get(self.url, accept='application/json')['ETag']
+        response = self.client.delete(self.url, HTTP_IF_MATCH='"other"')
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+        response = self.client.delete(self.url, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Hotel.objects.filter(pk=self.hotel.id).exists())
+        self.assertFalse(Reservation.objects.exists())
+
+
+class TestReservationReadSerializer(TestCase):
+    def setUp(self):
+        self.hotel = Hotel.objects.create(name='test hotel', room_capacity=10, over_booking_capacity=0)
+        self.hotel2 = Hotel.objects.create(name='test hotel2', room_capacity=10, over_booking_capacity=0)
+
+        start_date = normalize_date(datetime.datetime(2018, 03, 26))
+        end_date = normalize_date(start_date+datetime.timedelta(2), type='departure')
+        for hotel in (self.hotel, self.hotel2, self.hotel):
+            Reservation.objects.create(guest_name=u"t\xe9st name", guest_email="test_name@smth.com",
+                                       arrival_date=start_date, departure_date=end_date, hotel=hotel)
+
+    def test_same_representation(self):
+        reservations = Reservation.objects.select_related('hotel').order_by('id')
+        request = self.client.get(reverse('reservation:reservation-list')).wsgi_request
+        context = {'request': Request(request), 'format': None}
+
+        expected = ReservationSerializer(reservations, many=True, context=context).data
+        self.assertEqual(ReservationReadSerializer(reservations, many=True, context=context).data, expected)
+        self.assertEqual(ReservationReadSerializer(reservations[0], context=context).data, expected[0])
+
+    def test_get(self):
+        # The list and detail GETs answer with the same fields as before
+        response = self.client.get(reverse('reservation:reservation-list'), accept='application/json')
+        self.assertEqual(list(response.data['results'][0].keys()), list(ReservationSerializer.Meta.fields))
+        self.assertEqual(response.data['results'][0]['hotel_data']['url'],
+                         'http://testserver'+reverse('reservation:hotel-detail', kwargs={'pk': self.hotel.id}))
+
+        reservation = response.data['results'][1]
+        response = self.client.get(reservation['url'], accept='application/json')
+        self.assertEqual(response.data, reservation)
+
+
+class TestReservationCursorPagination(TestCase):
+    def setUp(self):
+        self.hotel = Hotel.objects.create(name='test hotel', room_capacity=10, over_booking_capacity=0)
+        self.url = reverse('reservation:reservation-list')
+
+        # Two reservations per arrival day, so that pages break inside a run of equal arrival dates
+        start_date = normalize_date(datetime.datetime(2018, 03, 26))
+        self.reservations = []
+        for i in range(5):
+            arrival_date = start_date+datetime.timedelta(2-i/2)
+            self.reservations.append(Reservation.objects.create(
+                guest_name="test name", guest_email="test_name@smth.com", arrival_date=arrival_date,
+                departure_date=normalize_date(arrival_date+datetime.timedelta(1), type='departure'), hotel=self.hotel))
+
+    def get_all_pages(self, params):
+        """
+        :return: ids of the reservations of every page, following the next links
+        """
+        pages = []
+        response = self.client.get(self.url, params, accept='application/json')
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            # No total count in cursor pagination
+            self.assertNotIn('count', response.data)
+            pages.append([reservation['id'] for reservation in response.data['results']])
+            if response.data['next'] is None:
+                return pages
+            response = self.client.get(response.data['next'], accept='application/json')
+
+    def test_created_time_order(self):
+        pages = self.get_all_pages({'pagination': 'cursor', 'page_size': 2})
+        self.assertEqual(pages, [[r.id for r in self.reservations[i:i+2]] for i in range(0, 5, 2)])
+
+    def test_arrival_date_order(self):
+        pages = self.get_all_pages({'pagination': 'cursor', 'order_by': 'arrival_date', 'page_size': 2})
+        expected = [r.id for r in sorted(self.reservations, key=lambda r: (r.arrival_date, r.id))]
+        self.assertEqual(sum(pages, []), expected)
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+
+    def test_invalid(self):
+        # Malformed parameters are a bad request
+        response = self.client.get(self.url, {'cursor': 'not a cursor'}, accept='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('cursor', response.data)
+
+        # Well formed cursors holding a value which is not a date, or an id which is not an integer
+        for key in (['not a date', 1], [None, 1], [{'x': 1}, 1], [[1], 1], [1.5, 1], ['', 1],
+                    ['2018-03-26T11:00:00+00:00', '1'], ['2018-03-26T11:00:00+00:00', None],
+                    ['2018-03-26T11:00:00+00:00', 1.5], ['2018-03-26T11:00:00+00:00'], {'x': 1}, 'x'):
+            cursor = base64.urlsafe_b64encode(json.dumps(key).encode('ascii')).decode('ascii')
+            response = self.client.get(self.url, {'cursor': cursor}, accept='application/json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, key)
+            self.assertIn('cursor', response.data)
+
+        response = self.client.get(self.url, {'pagination': 'cursor', 'order_by': 'guest_name'},
+                                   accept='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('order_by', response.data)
+
+    def test_page_number_pagination(self):
+        # Without the cursor parameters the list keeps its page number pagination
+        response = self.client.get(self.url, accept='application/json')
+        self.assertEqual(response.data['count'], 5)
+
+
+class TestReservationExport(TestCase):
+    def setUp(self):
+        self.hotel = Hotel.objects.create(name='test hotel', room_capacity=10, over_booking_capacity=0)
+        self.hotel2 = Hotel.objects.create(name='test hotel2', room_capacity=10, over_booking_capacity=0)
+        self.url = reverse('reservation:reservation-export')
+
+        # Eg: 2018-03-26T11:00:00 to 2018-03-27T10:00:00, 2018-03-27T11:00:00 to 2018-03-28T10:00:00 ...
+        self.start_date = normalize_date(datetime.datetime(2018, 03, 26))
+        for i in range(5):
+            arrival_date = self.start_date+datetime.timedelta(i)
+            Reservation.objects.create(guest_name=u"t\xe9st name {0}".format(i), guest_email="test_name@smth.com",
+                                       arrival_date=arrival_date, hotel=self.hotel if i < 3 else self.hotel2,
+                                       departure_date=normalize_date(arrival_date+datetime.timedelta(1),
+                                                                     type='departure'))
+
+    def get_content(self, params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_ndjson(self):
+        rows = [json.loads(line) for line in self.get_content({}).splitlines()]
+        self.assertEqual([row['id'] for row in rows], list(Reservation.objects.order_by('id').values_list('id', flat=True)))
+
+        # Same fields as the reservation list
+        response = self.client.get(reverse('reservation:reservation-list'), accept='application/json')
+        self.assertEqual(rows[0], json.loads(json.dumps(response.data['results'][0])))
+
+    def test_filters(self):
+        rows = [json.loads(line) for line in self.get_content({'hotel': self.hotel2.id}).splitlines()]
+        self.assertEqual([row['guest_name'] for row in rows], [u"t\xe9st name 3", u"t\xe9st name 4"])
+
+        # Stays holding a room between the second and the fourth day
+        params = {'from': (self.start_date+datetime.timedelta(1)).strftime('%Y-%m-%dT%H:%M:%S'),
+                  'to': (self.start_date+datetime.timedelta(3)).strftime('%Y-%m-%dT%H:%M:%S')}
+        rows = [json.loads(line) for line in self.get_content(params).splitlines()]
+        self.assertEqual([row['guest_name'] for row in rows], [u"t\xe9st name 1", u"t\xe9st name 2"])
+
+        response = self.client.get(self.url, {'output': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_csv(self):
+        lines = self.get_content({'output': 'csv', 'hotel': self.hotel.id}).splitlines()
+        self.assertEqual(lines[0].split(','), ['url', 'id', 'guest_name', 'guest_email', 'arrival_date',
+                                               'departure_date', 'hotel', 'hotel_data.url', 'hotel_data.id',
+                                               'hotel_data.name', 'hotel_data.room_capacity',
+                                               'hotel_data.over_booking_capacity'])
+        self.assertEqual(len(lines), 4)
+        self.assertIn(u"t\xe9st name 0", lines[1])
+
+        # Only the header when nothing matches
+        self.assertEqual(len(self.get_content({'output': 'csv', 'hotel': 0}).splitlines()), 1)
+
+    def test_iter_chunks(self):
+        chunks = list(export.iter_chunks(Reservation.objects.all(), chunk_size=2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        self.assertEqual([reservation.id for chunk in chunks for reservation in chunk],
+                         list(Reservation.objects.order_by('id').values_list('id', flat=True)))
+
+
+class TestReservationBulkCreate(TestCase):
+    def setUp(self):
+        self.hotel = Hotel.objects.create(name='test hotel', room_capacity=1, over_booking_capacity=100)
+        self.hotel2 = Hotel.objects.create(name='test hotel2', room_capacity=1, over_booking_capacity=0)
+        self.url = reverse('reservation:reservation-bulk')
+        self.data = {"guest_name": "tester", "guest_email": "tester@foo.com", "arrival_date": "2018-03-26T00:00:00",
+                     "departure_date": "2018-03-28T00:00:00", "hotel": self.hotel.id}
+
+    def test_post(self):
+        invalid = dict(self.data, hotel=1000)
+        other_hotel = dict(self.data, hotel=self.hotel2.id)
+        data = [self.data, invalid, self.data, other_hotel, self.data]
+        response = self.client.post(self.url, json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # hotel takes two reservations for the same nights, the third one conflicts with the first two in the batch
+        self.assertEqual([result['status'] for result in response.data['results']],
+                         ['created', 'rejected', 'created', 'created', 'rejected'])
+        self.assertIn('hotel', response.data['results'][1]['errors'])
+        self.assertIn('non_field_errors', response.data['results'][4]['errors'])
+        self.assertEqual(response.data['created'], 3)
+        self.assertEqual(Reservation.objects.filter(hotel=self.hotel).count(), 2)
+
+        # The nights of the batch were booked in the occupancy ledger
+        self.assertEqual(self.hotel.get_available_reservation_slots(normalize_date(datetime.datetime(2018, 3, 26)),
+                                                                    normalize_date(datetime.datetime(2018, 3, 28))), 0)
+
+        # Nothing is available anymore, the whole batch is rejected
+        response = self.client.post(self.url, json.dumps([other_hotel]), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['created'], 0)
+
+    def test_post_created_ids(self):
+        other_hotel = dict(self.data, hotel=self.hotel2.id)
+        response = self.client.post(self.url, json.dumps([self.data, other_hotel, self.data]),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # Every created reservation is returned as it is read back, with its id, url and dates in UTC
+        ids = set()
+        for result in response.data['results']:
+            created = result['data']
+            ids.add(created['id'])
+            detail = self.client.get(reverse('reservation:reservation-detail', args=[created['id']]))
+            self.assertEqual(detail.status_code, status.HTTP_200_OK)
+            self.assertEqual(json.loads(json.dumps(created)), json.loads(detail.content.decode('utf-8')))
+            self.assertTrue(created['arrival_date'].endswith('Z'))
+        self.assertEqual(len(ids), 3)
+
+    def test_post_invalid(self):
+        # The body must be a list of reservations
+        response = self.client.post(self.url, json.dumps(self.data), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('non_field_errors', response.data)
+
+
+class TestConcurrentBooking(TestCase):
+    def setUp(self):
+        self.hotel = Hotel.objects.create(name='test hotel', room_capacity=1, over_booking_capacity=0)
+        self.data = {"guest_name": "tester", "guest_email": "tester@foo.com", "arrival_date": "2018-03-26T00:00:00",
+                     "departure_date": "2018-03-28T00:00:00", "hotel": self.hotel.id}
+
+    def test_last_slot(self):
+        # Two requests both validate while the last slot is still free
+        first = ReservationSerializer(data=self.data)
+        second = ReservationSerializer(data=self.data)
+        self.assertTrue(first.is_valid())
+        self.assertTrue(second.is_valid())
+
+        # The first one to save takes the slot, the second one is refused instead of overselling
+        first.save()
+        with self.assertRaises(SerializerValidationError):
+            second.save()
+
+        self.assertEqual(Reservation.objects.count(), 1)
+        self.assertEqual(HotelOccupancy.objects.get(hotel=self.hotel, night=datetime.date(2018, 3, 26)).occupied, 1)
+
+
+class TestConcurrentBookingStress(TransactionTestCase):
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db(connection.settings_dict['NAME']) and \
+                not connection.features.can_share_in_memory_db:
+            self.skipTest('Threads can not share this in-memory sqlite test database')
+
+    def test_stress(self):
+        # Threads racing for the same night of two hotels never book more than the capacity, the command fails if so
+        out = StringIO()
+        call_command('stress_booking', threads=4, requests=40, hotels=2, capacity=5, stdout=out)
+        self.assertIn('Responses: 201=10, 400=30', out.getvalue())
+
+
+class TestImportReservations(TestCase):
+    def setUp(self):
+        self.hotel = Hotel.objects.create(name='test hotel', room_capacity=1, over_booking_capacity=0)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as import_file:
+            import_file.write(content)
+        return path
+
+    def import_file(self, path, **options):
+        out = StringIO()
+        call_command('import_reservations', path, stdout=out, **options)
+        return out.getvalue()
+
+    def test_csv(self):
+        path = self.write('reservations.csv', '\n'.join([
+            'guest_name,guest_email,hotel,arrival_date,departure_date',
+            'first,First@Guest.com,{0},2030-01-01T00:00:00,2030-01-03T00:00:00',
+            # No room left on the night of January 2nd
+            'second,second@guest.com,{0},2030-01-02T00:00:00,2030-01-04T00:00:00',
+            'third,third@guest.com,{0},2030-01-03T00:00:00,2030-01-04T00:00:00',
+            'fourth,fourth@guest.com,{0},someday,2030-01-04T00:00:00',
+            'fifth,fifth@guest.com,0,2030-02-01T00:00:00,2030-02-02T00:00:00',
+        ]).format(self.hotel.id)+'\n')
+
+        # Chunks of 2 rows, earlier chunks count against the availability of the later ones
+        out = self.import_file(path, chunk_size=2)
+        self.assertIn('Imported 2 of 5 rows', out)
+        self.assertIn('Rejected 3 rows', out)
+
+        reservations = Reservation.objects.order_by('arrival_date')
+        self.assertEqual([reservation.guest_name for reservation in reservations], ['first', 'third'])
+        # Dates normalized as the API does, emails folded
+        self.assertEqual((reservations[0].arrival_date.hour, reservations[0].departure_date.hour), (11, 10))
+        self.assertEqual(reservations[0].guest_email_key, 'first@guest.com')
+        self.assertEqual(HotelOccupancy.count_nights(), dict(
+            ((hotel_id, night), occupied) for hotel_id, night, occupied in
+            HotelOccupancy.objects.filter(occupied__gt=0).values_list('hotel_id', 'night', 'occupied')))
+
+        with open(path+'.rejects.csv') as rejects_file:
+            rejects = list(csv.DictReader(rejects_file))
+        self.assertEqual([(reject['guest_name'], reject['line']) for reject in rejects],
+                         [('second', '3'), ('fourth', '5'), ('fifth', '6')])
+        self.assertIn('non_field_errors', json.loads(rejects[0]['errors']))
+        self.assertIn('arrival_date', json.loads(rejects[1]['errors']))
+        self.assertIn('hotel', json.loads(rejects[2]['errors']))
+
+    def test_jsonl(self):
+        path = self.write('reservations.jsonl', '\n'.join([
+            json.dumps({'guest_name': 'first', 'guest_email': 'first@guest.com', 'hotel': self.hotel.id,
+                        'arrival_date': '2030-01-01T00:00:00', 'departure_date': '2030-01-03T00:00:00'}),
+            '',
+            '{"guest_name": ',
+            '[1, 2]',
+        ]))
+        rejects_path = os.path.join(self.directory, 'rejected.jsonl')
+        out = self.import_file(path, rejects=rejects_path)
+        self.assertIn('Imported 1 of 3 rows', out)
+        self.assertEqual(Reservation.objects.get().guest_name, 'first')
+
+        with open(rejects_path) as rejects_file:
+            rejects = [json.loads(line) for line in rejects_file]
+        self.assertEqual([reject['line'] for reject in rejects], [3, 4])
+        self.assertTrue(rejects[0]['errors']['non_field_errors'][0].startswith('Invalid JSON'))
+
+    def test_format(self):
+        path = self.write('reservations.txt', '')
+        self.assertRaises(CommandError, self.import_file, path)
+        self.assertIn('Imported 0 of 0 rows', self.import_file(path, format='jsonl'))
+        self.assertFalse(os.path.exists(path+'.rejects.jsonl'))
+
+
+class TestBench(TestCase):
+    def test_summarize(self):
+        result = bench.summarize([i/1000.0 for i in range(100, 0, -1)], {200: 98, 409: 1, 'OperationalError': 1}, 2.0)
+        self.assertEqual(result['requests'], 100)
+        self.assertEqual(result['errors'], 2)
+        self.assertEqual(result['throughput'], 50.0)
+        self.assertAlmostEqual(result['p50_ms'], 50)
+        self.assertAlmostEqual(result['p95_ms'], 95)
+        self.assertAlmostEqual(result['p99_ms'], 99)
+        self.assertAlmostEqual(result['max_ms'], 100)
+        self.assertEqual(bench.percentile([], 50), None)
+
+    def test_compare(self):
+        baseline = {'hotel-list': {'p95_ms': 10.0, 'throughput': 100.0}}
+        self.assertEqual(bench.compare({'hotel-list': {'p95_ms': 11.0, 'throughput': 90.0}}, baseline, 0.2), [])
+        self.assertEqual(bench.compare({'hotel-list': {'p95_ms': 13.0, 'throughput': 70.0}}, baseline, 0.2), [
+            ('hotel-list', 'p95_ms', 10.0, 13.0), ('hotel-list', 'throughput', 100.0, 70.0)])
+        # Scenarios missing from the baseline are not compared
+        self.assertEqual(bench.compare({'availability': {'p95_ms': 13.0, 'throughput': 70.0}}, baseline, 0.2), [])
+
+
+class TestBenchCommand(TransactionTestCase):
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db(connection.settings_dict['NAME']) and \
+                not connection.features.can_share_in_memory_db:
+            self.skipTest('Threads can not share this in-memory sqlite test database')
+
+    def test_bench(self):
+        output = tempfile.NamedTemporaryFile(suffix='.json', delete=False)
+        output.close()
+        self.addCleanup(os.remove, output.name)
+
+        call_command('bench', hotels=3, reservations=50, clients=2, requests=10, output=output.name, stdout=StringIO())
+        with open(output.name) as results:
+            scenarios = json.load(results)['scenarios']
+        self.assertEqual(sorted(scenarios), sorted(bench.SCENARIOS))
+        for result in scenarios.values():
+            self.assertEqual((result['requests'], result['errors']), (10, 0))
+        # The seeded rows are gone
+        self.assertFalse(Hotel.objects.exists())
+        self.assertFalse(HotelOccupancy.objects.exists())
+
+
 class TestReservationDetail(TestCase):
     def setUp(self):
         self.hotel = Hotel.objects.create(name='test hotel', room_capacity=1, over_booking_capacity=100)
@@ -367,6 +1696,368 @@ class TestReservationDetail(TestCase):
         self.assertTrue(response.status_code, status.HTTP_404_NOT_FOUND)
 
 
+class TestReservationStatus(TestCase):
+    def setUp(self):
+        self.hotel = Hotel.objects.create(name='test hotel', room_capacity=1, over_booking_capacity=0)
+        self.start_date = normalize_date(datetime.datetime.now()+datetime.timedelta(5))
+        self.end_date = normalize_date(self.start_date+datetime.timedelta(2), type='departure')
+        self.reservation = Reservation.objects.create(guest_name='tester', guest_email='tester@foo.com',
+                                                      hotel=self.hotel, arrival_date=self.start_date,
+                                                      departure_date=self.end_date)
+
+    def assertLedgerInSync(self):
+        self.assertEqual(HotelOccupancy.count_nights(), dict(
+            ((hotel_id, night), occupied) for hotel_id, night, occupied in
+            HotelOccupancy.objects.filter(occupied__gt=0).values_list('hotel_id', 'night', 'occupied')))
+
+    def test_cancel(self):
+        url = reverse('reservation:reservation-detail', kwargs={'pk': self.reservation.id})
+        self.assertEqual(self.hotel.get_available_reservation_slots(self.start_date, self.end_date), 0)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.delete(url, accept='application/json')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        # A single row UPDATE, the row is kept
+        self.assertEqual(len([query for query in queries.captured_queries
+                              if 'UPDATE "reservation_reservation"' in query['sql']]), 1)
+        reservation = Reservation.objects.get(pk=self.reservation.pk)
+        self.assertEqual(reservation.status, Reservation.CANCELLED)
+        self.assertGreater(reservation.last_modified_time, self.reservation.last_modified_time)
+
+        # Gone from the API and from the availability counts
+        self.assertEqual(self.client.get(url, accept='application/json').status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(reverse('reservation:reservation-list'), accept='application/json')
+        self.assertEqual(response.data['count'], 0)
+        self.assertEqual(self.hotel.get_available_reservation_slots(self.start_date, self.end_date), 1)
+        self.assertLedgerInSync()
+
+        # Nothing is released twice
+        self.assertFalse(reservation.cancel())
+        self.assertEqual(self.hotel.get_available_reservation_slots(self.start_date, self.end_date), 1)
+
+    def test_no_show_and_confirm(self):
+        self.assertTrue(self.reservation.cancel(status=Reservation.NO_SHOW))
+        self.assertEqual(Reservation.objects.get(pk=self.reservation.pk).status, Reservation.NO_SHOW)
+        self.assertIsNone(self.reservation.get_stored_stay())
+
+        # Saving a reservation which is not confirmed holds nothing, confirming it again takes its nights back
+        reservation = Reservation.objects.get(pk=self.reservation.pk)
+        reservation.guest_name = 'renamed'
+        reservation.save()
+        self.assertLedgerInSync()
+        reservation.status = Reservation.CONFIRMED
+        reservation.save()
+        self.assertEqual(self.hotel.get_available_reservation_slots(self.start_date, self.end_date), 0)
+        self.assertLedgerInSync()
+        HotelOccupancy.rebuild()
+        self.assertEqual(self.hotel.get_available_reservation_slots(self.start_date, self.end_date), 0)
+
+    def test_no_show_view(self):
+        url = reverse('reservation:reservation-detail', kwargs={'pk': self.reservation.id})
+        response = self.client.delete(url+'?status=unknown', accept='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('status', response.data)
+        self.assertEqual(Reservation.objects.get(pk=self.reservation.pk).status, Reservation.CONFIRMED)
+
+        response = self.client.delete(url+'?status=no_show', accept='application/json')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(Reservation.objects.get(pk=self.reservation.pk).status, Reservation.NO_SHOW)
+        self.assertEqual(self.hotel.get_available_reservation_slots(self.start_date, self.end_date), 1)
+        self.assertLedgerInSync()
+
+    def test_active_indexes(self):
+        # Migration 0010 creates the indexes with raw SQL, a later migration remaking the table drops them silently
+        migration = importlib.import_module('reservation.migrations.0010_reservation_status')
+        table = Reservation._meta.db_table
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, table)
+        partial = connection.vendor in migration.PARTIAL_INDEX_VENDORS
+        for name, columns in migration.ACTIVE_INDEXES:
+            self.assertIn(name, constraints)
+            self.assertEqual(tuple(constraints[name]['columns']), columns if partial else ('status',)+columns)
+
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = %s", [table])
+                indexes = dict(cursor.fetchall())
+            for name, columns in migration.ACTIVE_INDEXES:
+                self.assertIn("""WHERE "status" = 'confirmed'""", indexes[name])
+
+    def test_archive(self):
+        self.reservation.cancel()
+        ArchivedReservation.archive(self.end_date+datetime.timedelta(1))
+        self.assertEqual(ArchivedReservation.objects.get(pk=self.reservation.pk).status, Reservation.CANCELLED)
+        self.assertLedgerInSync()
+        response = self.client.get(reverse('reservation:reservation-list'), {'archived': 'true'},
+                                   accept='application/json')
+        self.assertEqual(response.data['results'][0]['status'], Reservation.CANCELLED)
+
+    def test_query_plans(self):
+        # Confirmed reservations are read through the partial indexes
+        if connection.vendor != 'sqlite':
+            self.skipTest('Query plans are only checked on sqlite')
+        for queryset, index in (
+                (Reservation.objects.active().filter(hotel_id=1).overlapping(self.start_date, self.end_date),
+                 'reservation_reservation_active_hotel_stay'),
+                (Reservation.objects.active().order_by('-created_time', '-id')[:10],
+                 'reservation_reservation_active_created'),
+                (Reservation.objects.active().filter(arrival_date__gt=self.start_date).order_by('arrival_date', 'id'),
+                 'reservation_reservation_active_arrival')):
+            sql, params = queryset.query.sql_with_params()
+            cursor = connection.cursor()
+            cursor.execute('EXPLAIN QUERY PLAN '+sql, params)
+            steps = [row[-1] for row in cursor.fetchall()]
+            self.assertTrue(any(index in step for step in steps), steps)
+            self.assertFalse(any('TEMP B-TREE' in step for step in steps), steps)
+
+
+class TestConditionalRequests(TestCase):
+    def setUp(self):
+        self.hotel = Hotel.objects.create(name='test hotel', room_capacity=2, over_booking_capacity=0)
+        start_date = normalize_date(datetime.datetime(2018, 03, 26))
+        self.reservation = Reservation.objects.create(guest_name="test name", guest_email="test_name@smth.com",
+            arrival_date=start_date, departure_date=normalize_date(start_date+datetime.timedelta(1), type='departure'),
+            hotel=self.hotel)
+        self.hotel_url = reverse('reservation:hotel-detail', kwargs={'pk': self.hotel.id})
+        self.reservation_url = reverse('reservation:reservation-detail', kwargs={'pk': self.reservation.id})
+
+    def test_if_none_match(self):
+        for url in (self.hotel_url, self.reservation_url, reverse('reservation:hotel-list')):
+            response = self.client.get(url, accept='application/json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIn('Last-Modified', response)
+
+            # Only the stamp of the resource is read, nothing is serialized
+            with CaptureQueriesContext(connection) as queries:
+                not_modified = self.client.get(url, accept='application/json', HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(not_modified.content, b'')
+            self.assertEqual(len([query for query in queries.captured_queries if 'SELECT' in query['sql']]), 1)
+
+            response = self.client.get(url, accept='application/json', HTTP_IF_NONE_MATCH='"other"')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_if_modified_since(self):
+        response = self.client.get(self.hotel_url, accept='application/json')
+        response = self.client.get(self.hotel_url, accept='application/json',
+                                   HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_changes(self):
+        hotel_etag = self.client.get(self.hotel_url)['ETag']
+        reservation_etag = self.client.get(self.reservation_url)['ETag']
+        list_etag = self.client.get(reverse('reservation:hotel-list'))['ETag']
+
+        # The reservation representation holds its hotel, changing the hotel changes both
+        self.hotel.name = 'new name'
+        self.hotel.save()
+        self.assertNotEqual(self.client.get(self.hotel_url)['ETag'], hotel_etag)
+        self.assertNotEqual(self.client.get(self.reservation_url)['ETag'], reservation_etag)
+
+        # So do adding and deleting hotels for the list
+        self.assertNotEqual(self.client.get(reverse('reservation:hotel-list'))['ETag'], list_etag)
+        list_etag = self.client.get(reverse('reservation:hotel-list'))['ETag']
+        Hotel.objects.create(name='test hotel2', room_capacity=2, over_booking_capacity=0)
+        self.assertNotEqual(self.client.get(reverse('reservation:hotel-list'))['ETag'], list_etag)
+        list_etag = self.client.get(reverse('reservation:hotel-list'))['ETag']
+        self.hotel.delete()
+        self.assertNotEqual(self.client.get(reverse('reservation:hotel-list'))['ETag'], list_etag)
+
+    def test_if_match(self):
+        etag = self.client.get(self.reservation_url)['ETag']
+
+        response = self.client.patch(self.reservation_url, json.dumps({'guest_name': 'new name'}),
+                                     content_type='application/json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response['ETag'], self.client.get(self.reservation_url)['ETag'])
+
+        # The ETag read before the first change is stale now
+        response = self.client.patch(self.reservation_url, json.dumps({'guest_name': 'other name'}),
+                                     content_type='application/json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(Reservation.objects.get(pk=self.reservation.pk).guest_name, 'new name')
+
+        response = self.client.delete(self.hotel_url, HTTP_IF_MATCH='"other"')
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        response = self.client.delete(self.hotel_url, HTTP_IF_MATCH='*')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+
+@override_settings(REPLICA_DATABASE='replica')
+class TestReplicaRouter(TestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+
+    def test_routing(self):
+        # Outside of a read only block everything goes to the primary
+        self.assertEqual(self.router.db_for_read(Hotel), 'default')
+
+        with use_replica():
+            # Reads of a read only block go to the replica
+            self.assertEqual(self.router.db_for_read(Hotel), 'replica')
+            self.assertEqual(self.router.db_for_read(Reservation), 'replica')
+
+            # Writes always go to the primary, and so do the reads following them
+            self.assertEqual(self.router.db_for_write(Reservation), 'default')
+            self.assertEqual(self.router.db_for_read(Reservation), 'default')
+
+        # The next read only block starts on the replica again
+        with use_replica():
+            self.assertEqual(self.router.db_for_read(Hotel), 'replica')
+
+        self.assertEqual(self.router.db_for_read(Hotel), 'default')
+
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        self.hotel = Hotel.objects.create(name='test hotel', room_capacity=4, over_booking_capacity=50)
+        metrics.registry.clear()
+
+    def test_server_timing(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('reservation:reservation-list'), accept='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        names = [metric.split(';')[0] for metric in response['Server-Timing'].split(', ')]
+        self.assertEqual(names, ['db', 'serializer', 'availability', 'render', 'total'])
+        self.assertIn('desc="{0} queries"'.format(len(queries)), response['Server-Timing'])
+
+    def test_metrics_view(self):
+        self.client.get(reverse('reservation:hotel-list'), accept='application/json')
+        self.client.get(reverse('reservation:hotel-detail', args=[self.hotel.id+100]), accept='application/json')
+
+        response = self.client.get(reverse('reservation:metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode('utf-8')
+        self.assertIn('# TYPE hotel_http_request_duration_seconds histogram', body)
+        self.assertIn('hotel_http_request_duration_seconds_bucket{endpoint="reservation:hotel-list",method="GET",'
+                      'le="+Inf"} 1', body)
+        self.assertIn('hotel_http_requests_total{endpoint="reservation:hotel-detail",method="GET",status="404"} 1',
+                      body)
+        self.assertIn('hotel_cache_hits_total', body)
+        # Scraping the metrics is not measured
+        self.assertNotIn('endpoint="reservation:metrics"', body)
+
+    def test_timed(self):
+        self.assertIsNone(metrics.get_timings())
+        timings = metrics.start_request()
+        with metrics.timed('serializer'):
+            # Counted once
+            with metrics.timed('serializer'):
+                pass
+            with metrics.timed('availability'):
+                pass
+        self.assertIs(metrics.end_request(), timings)
+        self.assertIsNone(metrics.get_timings())
+        self.assertGreater(timings.durations['serializer'], 0)
+        self.assertLessEqual(timings.durations['availability'], timings.durations['serializer'])
+
+    def test_histogram(self):
+        histogram = metrics.Histogram(buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value)
+        self.assertEqual(histogram.get_samples(), [
+            ('_bucket', (('le', '0.1'),), 2), ('_bucket', (('le', '1.0'),), 3), ('_bucket', (('le', '+Inf'),), 4),
+            ('_sum', (), 2.65), ('_count', (), 4)])
+
+        body = metrics.render_families([('requests', 'counter', 'Requests', [([('path', 'a"b')], 3)])])
+        self.assertEqual(body, '# HELP requests Requests\n# TYPE requests counter\nrequests{path="a\\"b"} 3\n')
+
+
+class BlockingHandler(logging.Handler):
+    """
+    Handler holding the writer thread of an AsyncHandler until released
+    """
+    started = threading.Event()
+    resume = threading.Event()
+
+    def __init__(self):
+        super(BlockingHandler, self).__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.started.set()
+        self.resume.wait(5)
+        self.messages.append(self.format(record))
+
+
+class TestAsyncHandler(TestCase):
+    def setUp(self):
+        self.path = tempfile.mktemp(suffix='.log')
+        self.logger = logging.getLogger('test.async')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+
+    def tearDown(self):
+        for handler in list(self.logger.handlers):
+            BlockingHandler.resume.set()
+            handler.close()
+            self.logger.removeHandler(handler)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def add_handler(self, **kwargs):
+        handler = AsyncHandler(**kwargs)
+        handler.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+        self.logger.addHandler(handler)
+        return handler
+
+    def test_write(self):
+        handler = self.add_handler(target_class='logging.handlers.RotatingFileHandler',
+                                   target_kwargs={'filename': self.path, 'maxBytes': 1000000, 'backupCount': 1})
+        for i in range(100):
+            self.logger.info('record %s', i)
+        handler.flush()
+
+        with open(self.path) as log_file:
+            self.assertEqual(log_file.read().splitlines(), ['INFO record {0}'.format(i) for i in range(100)])
+        self.assertEqual(handler.dropped, 0)
+
+    def test_drop(self):
+        BlockingHandler.started.clear()
+        BlockingHandler.resume.clear()
+        handler = self.add_handler(target_class='reservation.tests.BlockingHandler', queue_size=1)
+
+        # The writer is stuck on the first record, the second one waits in the queue and the others are dropped,
+        # without the logging thread ever waiting on the writer.
+        self.logger.info('record 0')
+        self.assertTrue(BlockingHandler.started.wait(5))
+        for i in range(1, 5):
+            self.logger.info('record %s', i)
+        self.assertEqual(handler.dropped, 3)
+
+        BlockingHandler.resume.set()
+        handler.flush()
+        self.assertEqual(handler.target.messages, ['INFO record 0', 'INFO record 1',
+                                                   'WARNING Dropped 3 log records, the logging queue was full'])
+
+    def test_drop_threads(self):
+        # Records dropped by many threads at once are all counted, and all reported
+        BlockingHandler.started.clear()
+        BlockingHandler.resume.clear()
+        handler = self.add_handler(target_class='reservation.tests.BlockingHandler', queue_size=1)
+        self.logger.info('record 0')
+        self.assertTrue(BlockingHandler.started.wait(5))
+        self.logger.info('record 1')
+
+        def drop():
+            for i in range(500):
+                handler.emit(logging.makeLogRecord({'msg': 'dropped'}))
+        threads = [threading.Thread(target=drop) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(handler.dropped, 4000)
+
+        BlockingHandler.resume.set()
+        handler.flush()
+        self.assertEqual(handler.target.messages[-1], 'WARNING Dropped 4000 log records, the logging queue was full')
+
+    def test_invalid_policy(self):
+        self.assertRaises(ValueError, AsyncHandler, target_class='logging.NullHandler', policy='wait')
+
+
 class TestNormalize_date(TestCase):
     def setUp(self):
         self.date = ''
@@ -0,0 +1,60 @@
+"""
+Callbacks run once the current transaction commits, like transaction.on_commit() of later Django versions.
+
+Work which must only follow committed changes, such as applying them to the shared availability engine, registers a
+callback with on_commit(). The callbacks of a transaction run in order right after its outermost atomic block
+commits, and are dropped when it rolls back, or when the savepoint they were registered under is rolled back.
+Outside of a transaction they run at once. Callbacks run before autocommit is restored and should not write to the
+database.
+
+Django 1.8 has no hook for this, so the first on_commit() on a connection wraps its commit, rollback,
+savepoint_rollback and close methods. Connections belong to a thread, their callbacks are never shared.
+"""
+from django.db import transaction
+
+
+def on_commit(func, using=None):
+    """
+    Call func once the transaction of the connection commits, at once when no transaction is open.
+    """
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        func()
+        return
+
+    if not hasattr(connection, 'commit_callbacks'):
+        install_hooks(connection)
+    # A rollback to any of the savepoints open now drops the callback
+    connection.commit_callbacks.append((list(connection.savepoint_ids), func))
+
+
+def install_hooks(connection):
+    """
+    Wrap the transaction methods of a connection to run or drop its commit callbacks.
+    """
+    connection.commit_callbacks = []
+    commit, rollback = connection.commit, connection.rollback
+    savepoint_rollback, close = connection.savepoint_rollback, connection.close
+
+    def commit_and_run():
+        commit()
+        callbacks, connection.commit_callbacks = connection.commit_callbacks, []
+        for sids, func in callbacks:
+            func()
+
+    def rollback_and_drop():
+        connection.commit_callbacks = []
+        rollback()
+
+    def savepoint_rollback_and_drop(sid):
+        savepoint_rollback(sid)
+        connection.commit_callbacks = [(sids, func) for sids, func in connection.commit_callbacks if sid not in sids]
+
+    def close_and_drop():
+        connection.commit_callbacks = []
+        close()
+
+    connection.commit = commit_and_run
+    connection.rollback = rollback_and_drop
+    connection.savepoint_rollback = savepoint_rollback_and_drop
+    connection.close = close_and_drop
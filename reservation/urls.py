@@ -6,15 +6,45 @@ urlpatterns = [
     # This is the api root for reservations
     url(r'^$', views.api_root, name='api'),
 
+    # Request metrics of this process in the Prometheus text format
+    url(r'^/metrics$', views.metrics_view, name='metrics'),
+
     # Api for to list and create hotels
     url(r'^/hotels$', views.HotelList.as_view(), name='hotel-list'),
 
     # Api for view, update and delete for a specific hotel
     url(r'^/hotels/(?P<pk>[0-9]+)$', views.HotelDetail.as_view(), name='hotel-detail'),
 
+    # Api for the vacancy of a specific hotel on every night between two dates
+    url(r'^/hotels/(?P<pk>[0-9]+)/calendar$', views.HotelCalendar.as_view(), name='hotel-calendar'),
+
+    # Api for the closest stays a specific hotel can take around the asked one
+    url(r'^/hotels/(?P<pk>[0-9]+)/suggest$', views.HotelSuggest.as_view(), name='hotel-suggest'),
+
+    # Api for the daily occupancy rate, overbooking usage and pickup of a specific hotel
+    url(r'^/hotels/(?P<pk>[0-9]+)/occupancy$', views.HotelOccupancyReport.as_view(), name='hotel-occupancy'),
+
+    # Api for the daily occupancy rate, overbooking usage and pickup of every hotel
+    url(r'^/occupancy$', views.OccupancyReport.as_view(), name='occupancy'),
+
+    # Api to search the hotels available between an arrival and a departure date
+    url(r'^/availability$', views.AvailabilityList.as_view(), name='availability'),
+
     # Api for to create and view the reservations
     url(r'^/reservations$', views.ReservationList.as_view(), name='reservation-list'),
 
+    # Api to create a batch of reservations in one request
+    url(r'^/reservations/bulk$', views.ReservationBulkCreate.as_view(), name='reservation-bulk'),
+
+    # Api to cancel the reservations of a hotel between two dates, in batches
+    url(r'^/reservations/cancel$', views.ReservationBulkCancel.as_view(), name='reservation-cancel'),
+
+    # Api to stream all the reservations as NDJSON or CSV
+    url(r'^/reservations/export$', views.ReservationExport.as_view(), name='reservation-export'),
+
+    # Api for the upcoming and past reservations of a guest, by email address
+    url(r'^/guests/(?P<email>[^/]+)/reservations$', views.GuestReservations.as_view(), name='guest-reservations'),
+
     # Api to view, update and delete a specific reservation
     url(r'^/reservations/(?P<pk>[0-9]+)$', views.ReservationDetail.as_view(), name='reservation-detail')
 ]
\ No newline at end of file
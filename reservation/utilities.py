@@ -40,3 +40,29 @@ def datetime_object(__date):
     if isinstance(__date, datetime.datetime):
         return datetime.datetime(__date.year, __date.month, __date.day, __date.hour, __date.minute, __date.second)
     return None
+
+
+def stay_nights(arrival_date, departure_date):
+    """
+    Nights occupied by a stay, every date from the arrival date up to (but not including) the departure date.
+    :param arrival_date: datetime.datetime or datetime.date when the stay starts
+    :param departure_date: datetime.datetime or datetime.date when the stay ends
+    :return: list of datetime.date objects, empty if the departure is not after the arrival day
+    """
+    if isinstance(arrival_date, datetime.datetime):
+        arrival_date = arrival_date.date()
+    if isinstance(departure_date, datetime.datetime):
+        departure_date = departure_date.date()
+
+    return [arrival_date+datetime.timedelta(day) for day in range((departure_date-arrival_date).days)]
+
+
+def fold_email(email):
+    """
+    Case folded form of an email address, two addresses differing only by case or surrounding spaces fold the same.
+    :param email: the email address, may be None
+    :return: the stripped, lower cased address, '' for None
+    """
+    if email is None:
+        return ''
+    return email.strip().lower()
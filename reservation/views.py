@@ -1,12 +1,31 @@
+import itertools
 import logging
+from django.conf import settings
+from django.db.models import Count, Max
 from django.shortcuts import render
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import require_GET
 from rest_framework.response import Response
-from rest_framework import filters, generics
+from rest_framework import filters, generics, status
+from rest_framework.exceptions import MethodNotAllowed
 from rest_framework.reverse import reverse
 from rest_framework.decorators import api_view
 from django.db import transaction
-from reservation.serializers import HotelSerializer, ReservationSerializer
-from reservation.models import Hotel, Reservation
+from reservation.serializers import HotelSerializer, ReservationSerializer, ReservationReadSerializer, \
+    ArchivedReservationReadSerializer, \
+    HotelAvailabilitySerializer, AvailabilityQuerySerializer, CalendarQuerySerializer, ExportQuerySerializer, \
+    GuestReservationsQuerySerializer, ReservationBatch, BulkCancelSerializer, StaySuggestionSerializer, \
+    SuggestionQuerySerializer, OccupancyQuerySerializer, CancelQuerySerializer
+from reservation import analytics, availability_cache, export, hotel_cache, metrics
+from reservation.models import ArchivedReservation, Hotel, Reservation
+from reservation.conditional import conditional, make_etag
+from reservation.filters import ArchivedReservationFilter, ReservationFilter
+from reservation.log_handlers import AsyncHandler
+from reservation.pagination import KeysetPagination
+from reservation.routers import read_from_replica
+from reservation.utilities import fold_email, stay_nights
 
 logger = logging.getLogger('restAPI')
 
@@ -20,6 +39,71 @@ def get_client_ip(request):
         ip = request.META.get('REMOTE_ADDR')
     return ip
 
+def hotel_list_stamp(view, request, for_update, *args, **kwargs):
+    """
+    Stamp of the hotel list for conditional requests: a hotel added or changed moves the latest change time, a hotel
+    deleted the count.
+    """
+    stamp = Hotel.objects.aggregate(count=Count('id'), last_modified=Max('last_modified_time'))
+    return make_etag(request, request.GET.urlencode(), stamp['count'], stamp['last_modified']), stamp['last_modified']
+
+
+def hotel_stamp(view, request, for_update, *args, **kwargs):
+    """
+    Stamp of a hotel for conditional requests, see reservation.conditional
+    """
+    hotels = Hotel.objects.select_for_update() if for_update else Hotel.objects.all()
+    last_modified = hotels.filter(pk=kwargs['pk']).values_list('last_modified_time', flat=True).first()
+    if last_modified is None:
+        return None
+    return make_etag(request, last_modified), last_modified
+
+
+def hotel_delete_stamp(view, request, for_update, *args, **kwargs):
+    """
+    Stamp of a hotel before it is deleted, read without a lock: the deletion runs in batches of their own transactions
+    and there is none to hold it in, SELECT ... FOR UPDATE is refused outside of a transaction.
+    """
+    return hotel_stamp(view, request, False, *args, **kwargs)
+
+
+def reservation_stamp(view, request, for_update, *args, **kwargs):
+    """
+    Stamp of a reservation for conditional requests, its representation holds its hotel so both change times count.
+    """
+    reservations = view.get_queryset()
+    if for_update:
+        reservations = reservations.select_for_update()
+    stamp = reservations.filter(pk=kwargs['pk']).values_list('last_modified_time', 'hotel__last_modified_time').first()
+    if stamp is None:
+        return None
+    # The archived and the current reservation lists are two tables
+    return make_etag(request, reservations.model.__name__, *stamp), max(stamp)
+
+
+class ArchiveMixin(object):
+    """
+    Mixin for the reservation views, serving the archived reservations instead of the current ones when the archived
+    query parameter is true. The archive is read only.
+    """
+    archive_queryset = ArchivedReservation.objects.select_related(*ReservationSerializer.select_related_fields).all()
+    archive_serializer_class = ArchivedReservationReadSerializer
+
+    @property
+    def archived(self):
+        return self.request.query_params.get('archived', '').lower() in ('1', 'true', 'yes')
+
+    def initial(self, request, *args, **kwargs):
+        super(ArchiveMixin, self).initial(request, *args, **kwargs)
+        if self.archived and request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            raise MethodNotAllowed(request.method, detail='Archived reservations are read only.')
+
+    def get_queryset(self):
+        if self.archived:
+            return self.archive_queryset.all()
+        return super(ArchiveMixin, self).get_queryset()
+
+
 @api_view(('GET',))
 def api_root(request):
     return Response({
@@ -28,6 +112,42 @@ def api_root(request):
     })
 
 
+def get_component_families():
+    """
+    :return: metric families of the caches and of the asynchronous log handler, see metrics.render_families()
+    """
+    cache = hotel_cache.get_hotel_cache()
+    families = [
+        ('hotel_cache_hits_total', 'counter', 'Hotel lookups answered from the in-process cache', [((), cache.hits)]),
+        ('hotel_cache_misses_total', 'counter', 'Hotel lookups read from the database', [((), cache.misses)]),
+    ]
+
+    cache = availability_cache.get_availability_cache()
+    if cache is not None:
+        stats = cache.get_stats()
+        families += [
+            ('availability_cache_hits_total', 'counter', 'Availability lookups answered from the cache',
+             [((), stats['hits'])]),
+            ('availability_cache_misses_total', 'counter', 'Availability lookups read from the ledger',
+             [((), stats['misses'])]),
+        ]
+
+    handlers = [handler for handler in logger.handlers if isinstance(handler, AsyncHandler)]
+    if handlers:
+        families.append(('log_records_dropped_total', 'counter', 'restAPI log records dropped on a full queue',
+                         [((), sum(handler.dropped for handler in handlers))]))
+    return families
+
+
+@require_GET
+def metrics_view(request):
+    """
+    Request metrics of this process in the Prometheus text format, see reservation.metrics
+    """
+    body = metrics.render_families(metrics.registry.get_families()+get_component_families())
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 class HotelList(generics.ListCreateAPIView):
     """
     List all the hotels (GET method), Create a hotel (POST method) based on Http methods.
@@ -37,7 +157,8 @@ class HotelList(generics.ListCreateAPIView):
     queryset = Hotel.objects.all()
     serializer_class = HotelSerializer
 
-    @transaction.atomic()
+    @read_from_replica
+    @conditional(hotel_list_stamp)
     def get(self, request, *args, **kwargs):
         # This gives the list of all hotels
         return super(HotelList, self).get(request, *args, **kwargs)
@@ -59,40 +180,197 @@ class HotelDetail(generics.RetrieveUpdateDestroyAPIView):
     queryset = Hotel.objects.all()
     serializer_class = HotelSerializer
 
-    @transaction.atomic()
+    @read_from_replica
+    @conditional(hotel_stamp)
     def get(self, request, *args, **kwargs):
         # Retrieves a specific hotel given a pk value
         return super(HotelDetail, self).get(request, *args, **kwargs)
 
     @transaction.atomic()
+    @conditional(hotel_stamp)
     def put(self, request, *args, **kwargs):
         # Updates a specific hotel given a pk value
         logger.info('Updating the hotel.id= {0} from the ip= {1}'.format(kwargs['pk'], get_client_ip(request)))
         return super(HotelDetail, self).put(request, *args, **kwargs)
 
     @transaction.atomic()
+    @conditional(hotel_stamp)
     def patch(self, request, *args, **kwargs):
         # Partially update a specific hotel given a pk value
         logger.info('Patching the hotel.id= {0} from the ip= {1}'.format(kwargs['pk'], get_client_ip(request)))
         return super(HotelDetail, self).patch(request, *args, **kwargs)
 
-    @transaction.atomic()
+    # Not in a transaction, the hotel and its reservations are deleted in batches of their own
+    @conditional(hotel_delete_stamp)
     def delete(self, request, *args, **kwargs):
         # deletes a hotel given a pk value
         logger.info('Deleting the hotel.id= {0} from the ip= {1}'.format(kwargs['pk'], get_client_ip(request)))
         return super(HotelDetail, self).delete(request, *args, **kwargs)
 
+    def perform_destroy(self, instance):
+        for model_name, deleted in instance.delete_in_batches(batch_size=settings.DELETE_BATCH_SIZE):
+            logger.info('Deleted {0} rows of {1} of the hotel.id= {2}'.format(deleted, model_name, instance.id))
+
+
+class HotelCalendar(generics.GenericAPIView):
+    """
+    Get the vacancy of a hotel for every night between two dates (GET method).
+    :param request: lookup_field is pk, which is taken from the url, from and to query parameters
+    :return:
+    """
+    queryset = Hotel.objects.all()
+
+    def get_object(self):
+        # Only the capacity of the hotel is needed, read it through the hotel cache
+        try:
+            return Hotel.get_cached(int(self.kwargs['pk']))
+        except Hotel.DoesNotExist:
+            raise Http404('No Hotel matches the given query.')
+
+    @transaction.atomic()
+    def get(self, request, *args, **kwargs):
+        # Retrieves the vacancy calendar of a specific hotel given a pk value
+        hotel = self.get_object()
+        query = CalendarQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+
+        calendar = hotel.get_vacancy_calendar(query.validated_data['from'], query.validated_data['to'])
+        response = Response({
+            'hotel': hotel.id,
+            'total_capacity': hotel.get_total_capacity(),
+            'nights': [{'night': night, 'occupied': occupied, 'available': available}
+                       for night, occupied, available in calendar]
+        })
+        patch_cache_control(response, max_age=settings.CALENDAR_CACHE_MAX_AGE)
+        return response
+
 
-class ReservationList(generics.ListCreateAPIView):
+class HotelSuggest(HotelCalendar):
+    """
+    Get the closest stays of the same length as the one between the arrival and departure dates which the hotel can
+    take, within settings.SUGGESTION_HORIZON_DAYS days of it (GET method).
+    :param request: lookup_field is pk, which is taken from the url, arrival, departure, optional min_slots (default 1)
+        and count (default settings.SUGGESTION_COUNT) query parameters
+    :return:
+    """
+
+    @transaction.atomic()
+    def get(self, request, *args, **kwargs):
+        hotel = self.get_object()
+        query = SuggestionQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+
+        arrival, departure = query.validated_data['arrival'], query.validated_data['departure']
+        stays = hotel.suggest_stays(arrival, departure, query.validated_data['count'],
+                                    settings.SUGGESTION_HORIZON_DAYS, min_slots=query.validated_data['min_slots'])
+        return Response({
+            'hotel': hotel.id,
+            'available_slots': hotel.get_available_reservation_slots(arrival, departure),
+            'suggestions': StaySuggestionSerializer(stays, many=True).data
+        })
+
+
+class HotelOccupancyReport(HotelCalendar):
+    """
+    Get the occupancy rate, overbooking usage and pickup of a hotel on every night between two dates (GET method),
+    see reservation.analytics.
+    :param request: lookup_field is pk, which is taken from the url, from and to query parameters
+    :return:
+    """
+
+    @read_from_replica
+    def get(self, request, *args, **kwargs):
+        hotel = self.get_object()
+        query = CalendarQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+
+        nights = stay_nights(query.validated_data['from'], query.validated_data['to'])
+        series = analytics.get_occupancy(Hotel.objects.filter(pk=hotel.pk), nights[0], nights[-1])
+        report = analytics.get_report(hotel, series[hotel.id])
+        report['nights'] = nights
+        return Response(report)
+
+
+class OccupancyReport(generics.GenericAPIView):
+    """
+    Get the occupancy rate, overbooking usage and pickup of every hotel, or of the given ones, on every night between
+    two dates (GET method). The reservations of all the hotels are read in one query, see reservation.analytics.
+    :param request: from and to query parameters, optional hotel parameters (repeated) to report on some hotels only
+    :return:
+    """
+    queryset = Hotel.objects.order_by('id')
+
+    @read_from_replica
+    def get(self, request, *args, **kwargs):
+        query = OccupancyQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+
+        hotels = self.get_queryset()
+        if query.validated_data.get('hotel'):
+            hotels = hotels.filter(pk__in=query.validated_data['hotel'])
+        nights = stay_nights(query.validated_data['from'], query.validated_data['to'])
+        series = analytics.get_occupancy(hotels, nights[0], nights[-1])
+        return Response({
+            'nights': nights,
+            'hotels': [analytics.get_report(hotel, series[hotel.id]) for hotel in hotels]
+        })
+
+
+class AvailabilityList(generics.ListAPIView):
+    """
+    List the hotels which can take a reservation between the arrival and departure dates (GET method).
+    :param request: arrival, departure and optional min_slots (default 1) query parameters
+    :return:
+    """
+    serializer_class = HotelAvailabilitySerializer
+
+    def get_queryset(self):
+        query = AvailabilityQuerySerializer(data=self.request.query_params)
+        query.is_valid(raise_exception=True)
+        return Hotel.get_available_hotels(query.validated_data['arrival'], query.validated_data['departure'],
+                                          min_slots=query.validated_data['min_slots'])
+
+    @transaction.atomic()
+    def get(self, request, *args, **kwargs):
+        # This gives the list of hotels with enough reservation slots available
+        return super(AvailabilityList, self).get(request, *args, **kwargs)
+
+
+class ReservationList(ArchiveMixin, generics.ListCreateAPIView):
     """
     List all the reservations (GET method), Create a reservation (POST method) based on Http methods.
+    The list is paginated by page number, or with cursors when the pagination=cursor or cursor query parameter is
+    given (see KeysetPagination), and can be filtered with the query parameters of ReservationFilter. With
+    archived=true, lists the archived reservations instead (see ArchiveMixin).
     :param request:
     :return:
     """
-    queryset = Reservation.objects.select_related(*ReservationSerializer.select_related_fields).all()
+    queryset = Reservation.objects.select_related(*ReservationSerializer.select_related_fields).active()
     serializer_class = ReservationSerializer
+    read_serializer_class = ReservationReadSerializer
+    cursor_pagination_class = KeysetPagination
 
-    @transaction.atomic()
+    def get_serializer_class(self):
+        # Responses to GET only read, the browsable API forms still get ReservationSerializer
+        if self.request.method == 'GET':
+            return self.archive_serializer_class if self.archived else self.read_serializer_class
+        return self.serializer_class
+
+    @property
+    def filter_class(self):
+        return ArchivedReservationFilter if self.archived else ReservationFilter
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if params.get('pagination') == 'cursor' or KeysetPagination.cursor_query_param in params:
+                self._paginator = self.cursor_pagination_class()
+            else:
+                self._paginator = super(ReservationList, self).paginator
+        return self._paginator
+
+    @read_from_replica
     def get(self, request, *args, **kwargs):
         # This gives the list of all hotels
         return super(ReservationList, self).get(request, *args, **kwargs)
@@ -104,36 +382,189 @@ class ReservationList(generics.ListCreateAPIView):
         return super(ReservationList, self).post(request, *args, **kwargs)
 
 
-class ReservationDetail(generics.RetrieveUpdateDestroyAPIView):
+class ReservationExport(generics.GenericAPIView):
+    """
+    Stream all the reservations as NDJSON or CSV (GET method), with the fields of ReservationSerializer.
+    :param request: output (ndjson or csv), and optional hotel, from and to query parameters. With from and to only
+    the reservations holding a room between these dates are exported.
+    :return:
+    """
+    queryset = Reservation.objects.select_related(*ReservationSerializer.select_related_fields).active()
+    serializer_class = ReservationSerializer
+
+    def get(self, request, *args, **kwargs):
+        # Streams the reservations chunk by chunk, see reservation.export
+        query = ExportQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        queryset = self.get_queryset()
+        if 'hotel' in params:
+            queryset = queryset.filter(hotel_id=params['hotel'])
+        if 'from' in params:
+            queryset = queryset.filter(departure_date__gt=params['from'])
+        if 'to' in params:
+            queryset = queryset.filter(arrival_date__lt=params['to'])
+
+        logger.info('Exporting reservations from the ip= {0}'.format(get_client_ip(request)))
+        rows = export.iter_rows(queryset, self.get_serializer_class(), self.get_serializer_context())
+        if params['output'] == 'csv':
+            response = StreamingHttpResponse(export.csv_lines(rows, export.get_columns(self.get_serializer())),
+                                             content_type='text/csv; charset=utf-8')
+            response['Content-Disposition'] = 'attachment; filename="reservations.csv"'
+        else:
+            response = StreamingHttpResponse(export.ndjson_lines(rows), content_type='application/x-ndjson')
+        return response
+
+
+class ReservationBulkCreate(generics.GenericAPIView):
+    """
+    Create a batch of reservations (POST method), the body is a list of reservations.
+    Each reservation is accepted or rejected on its own, the response reports the outcome of every item by index.
+    :param request:
+    :return:
+    """
+    serializer_class = ReservationSerializer
+
+    @transaction.atomic()
+    def post(self, request, *args, **kwargs):
+        # Creates the Reservation objects of the batch which are valid and have availability
+        if not isinstance(request.data, list):
+            return Response({'non_field_errors': ['Expected a list of reservations.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        if len(request.data) > settings.BULK_RESERVATION_MAX_ITEMS:
+            return Response({'non_field_errors': ['A batch can not hold more than {0} reservations.'.format(
+                settings.BULK_RESERVATION_MAX_ITEMS)]}, status=status.HTTP_400_BAD_REQUEST)
+
+        logger.info('Adding {0} reservations in bulk from the ip= {1}'.format(len(request.data), get_client_ip(request)))
+        batch = ReservationBatch(request.data, context=self.get_serializer_context())
+        batch.is_valid()
+        batch.save()
+        if batch.accepted:
+            return Response(batch.data, status=status.HTTP_201_CREATED)
+        return Response(batch.data, status=status.HTTP_400_BAD_REQUEST)
+
+
+class ReservationBulkCancel(generics.GenericAPIView):
+    """
+    Cancel every reservation of a hotel holding a room between two dates (POST method). The reservations are cancelled
+    settings.DELETE_BATCH_SIZE at a time, each batch in its own transaction, see ReservationQuerySet.cancel_in_batches.
+    :param request: hotel, from and to in the body
+    :return: the number of reservations cancelled and of batches
+    """
+    serializer_class = BulkCancelSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        hotel = serializer.validated_data['hotel']
+        start_date, end_date = serializer.validated_data['from'], serializer.validated_data['to']
+
+        logger.info('Cancelling the reservations of the hotel.id= {0} between {1} and {2} from the ip= {3}'.format(
+            hotel.id, start_date, end_date, get_client_ip(request)))
+        reservations = Reservation.objects.filter(hotel_id=hotel.id).overlapping(start_date, end_date)
+        cancelled = batches = 0
+        for count in reservations.cancel_in_batches(batch_size=settings.DELETE_BATCH_SIZE):
+            cancelled += count
+            batches += 1
+            logger.info('Cancelled {0} reservations of the hotel.id= {1}'.format(cancelled, hotel.id))
+        return Response({'hotel': hotel.id, 'cancelled': cancelled, 'batches': batches})
+
+
+class GuestReservations(generics.GenericAPIView):
+    """
+    The reservations made under an email address, whatever its case (GET method): the upcoming stays, not over yet,
+    soonest first and the past ones latest first, the archived ones included. Each list is read from the
+    (guest_email_key, departure_date, id) indexes up to its limit, the cost does not grow with the size of the tables.
+    :param request: email is taken from the url, optional limit query parameter on each list (10, up to 100)
+    :return: the folded email, and the upcoming and past stays with a more flag telling if the list was cut
+    """
+    queryset = Reservation.objects.select_related(*ReservationSerializer.select_related_fields).active()
+    archive_queryset = ArchivedReservation.objects.select_related(*ReservationSerializer.select_related_fields).active()
+    serializer_class = ReservationReadSerializer
+    archive_serializer_class = ArchivedReservationReadSerializer
+
+    @read_from_replica
+    def get(self, request, *args, **kwargs):
+        data = request.query_params.dict()
+        data['email'] = kwargs['email']
+        query = GuestReservationsQuerySerializer(data=data)
+        query.is_valid(raise_exception=True)
+        email, limit = query.validated_data['email'], query.validated_data['limit']
+
+        now = timezone.now()
+        reservations = self.get_queryset().of_guest(email)
+        upcoming = reservations.filter(departure_date__gt=now).order_by('departure_date', 'id')
+        past = reservations.filter(departure_date__lte=now).order_by('-departure_date', '-id')
+        # Only past stays are ever archived
+        archived = self.archive_queryset.of_guest(email).order_by('-departure_date', '-id')
+        return Response({
+            'email': fold_email(email),
+            'upcoming': self.get_stays([upcoming], limit),
+            'past': self.get_stays([past, archived], limit, reverse=True),
+        })
+
+    def get_stays(self, querysets, limit, reverse=False):
+        # One row past the limit of each list tells if there are more, the lists are merged in departure order
+        reservations = sorted(itertools.chain.from_iterable(queryset[:limit+1] for queryset in querysets),
+                              key=lambda reservation: (reservation.departure_date, reservation.id), reverse=reverse)
+        context = self.get_serializer_context()
+        return {
+            'more': len(reservations) > limit,
+            'results': [(self.archive_serializer_class if isinstance(reservation, ArchivedReservation)
+                         else self.serializer_class)(reservation, context=context).data
+                        for reservation in reservations[:limit]],
+        }
+
+
+class ReservationDetail(ArchiveMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     Get a reservation detail (GET method), Update a reservation (PUT method), Partial Update a reservation
      (PATCH method), Delete a reservation (DELETE method) based on Http methods.
     :param request: lookup_field is pk, which is taken from the url
     :return:
     """
-    queryset = Reservation.objects.select_related(*ReservationSerializer.select_related_fields).all()
+    queryset = Reservation.objects.select_related(*ReservationSerializer.select_related_fields).active()
     serializer_class = ReservationSerializer
+    read_serializer_class = ReservationReadSerializer
 
+    def get_serializer_class(self):
+        # Responses to GET only read, the browsable API forms still get ReservationSerializer
+        if self.request.method == 'GET':
+            return self.archive_serializer_class if self.archived else self.read_serializer_class
+        return self.serializer_class
 
-    @transaction.atomic()
+    @read_from_replica
+    @conditional(reservation_stamp)
     def get(self, request, *args, **kwargs):
         # Retrieves a specific reservation given a pk value
         return super(ReservationDetail, self).get(request, *args, **kwargs)
 
     @transaction.atomic()
+    @conditional(reservation_stamp)
     def put(self, request, *args, **kwargs):
         # Updates a specific reservation given a pk value
         logger.info('Updating the reservation.id={0} from the ip= {1}'.format(kwargs['pk'], get_client_ip(request)))
         return super(ReservationDetail, self).put(request, *args, **kwargs)
 
     @transaction.atomic()
+    @conditional(reservation_stamp)
     def patch(self, request, *args, **kwargs):
         # Partially update a specific reservation given a pk value
         logger.info('Patching the reservation.id={0} from the ip= {1}'.format(kwargs['pk'], get_client_ip(request)))
         return super(ReservationDetail, self).patch(request, *args, **kwargs)
 
     @transaction.atomic()
+    @conditional(reservation_stamp)
     def delete(self, request, *args, **kwargs):
-        # deletes a reservation given a pk value
-        logger.info('Deleting the reservation.id={0} from the ip= {1}'.format(kwargs['pk'], get_client_ip(request)))
-        return super(ReservationDetail, self).delete(request, *args, **kwargs)
\ No newline at end of file
+        # cancels a reservation given a pk value, the row is kept with the cancelled status or ?status=no_show
+        query = CancelQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        self.cancel_status = query.validated_data['status']
+        logger.info('Cancelling the reservation.id={0} as {1} from the ip= {2}'.format(
+            kwargs['pk'], self.cancel_status, get_client_ip(request)))
+        return super(ReservationDetail, self).delete(request, *args, **kwargs)
+
+    def perform_destroy(self, instance):
+        instance.cancel(status=self.cancel_status)
\ No newline at end of file